@@ -38,5 +38,8 @@ from .http import *
 from .jsonrpc import *
 from .dbus import *
 
+# The asyncio integration lives in gruvi.aio. It is not imported here so that
+# "import gruvi" does not import asyncio.
+
 # clean up module namespace
 del sys, absolute_import, print_function
@@ -0,0 +1,94 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+"""Command line interface.
+
+Usage: ``python -m gruvi serve module:app [--workers N] [--bind ADDRESS]``
+"""
+
+from __future__ import absolute_import, print_function
+
+import sys
+import argparse
+import importlib
+
+
+def load_app(spec):
+    """Load an application from a ``module:attribute`` specification."""
+    modname, _, attr = spec.partition(':')
+    if not modname or not attr:
+        raise ValueError('expecting "module:attribute", got {!r}'.format(spec))
+    module = importlib.import_module(modname)
+    app = module
+    for name in attr.split('.'):
+        app = getattr(app, name)
+    return app
+
+
+def parse_address(address):
+    """Parse a ``host:port`` string or a pipe path into an address."""
+    if '/' in address:
+        return address
+    host, _, port = address.rpartition(':')
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    return (host or '0.0.0.0', int(port))
+
+
+def serve(args):
+    from .prefork import Prefork
+    app = load_app(args.app)
+    if args.protocol == 'http':
+        from .http import HttpServer as server_type
+    else:
+        from .jsonrpc import JsonRpcServer as server_type
+    def factory():
+        server = server_type(app, timeout=args.timeout)
+        if args.idle_timeout is not None:
+            server.idle_timeout = args.idle_timeout
+        return server
+    server = Prefork(factory, workers=args.workers, dispatch=args.dispatch)
+    if args.graceful_timeout is not None:
+        server.graceful_timeout = args.graceful_timeout
+    for address in args.bind or ['0.0.0.0:8080']:
+        server.listen(parse_address(address), backlog=args.backlog)
+    try:
+        server.run()
+    finally:
+        server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m gruvi')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    sp = subparsers.add_parser('serve', help='serve an application using pre-forked workers')
+    sp.add_argument('app', help='the application, as "module:attribute"')
+    sp.add_argument('-w', '--workers', type=int,
+                    help='number of worker processes (default: number of CPUs)')
+    sp.add_argument('-b', '--bind', action='append', metavar='ADDRESS',
+                    help='"host:port" or path to listen on, may be repeated '
+                         '(default: 0.0.0.0:8080)')
+    sp.add_argument('-p', '--protocol', choices=('http', 'jsonrpc'), default='http',
+                    help='the server protocol (default: http)')
+    sp.add_argument('--dispatch', action='store_true',
+                    help='accept in the supervisor and pass connections to '
+                         'the least loaded worker')
+    sp.add_argument('--backlog', type=int, default=128, help='listen backlog')
+    sp.add_argument('--timeout', type=float, help='client timeout in seconds')
+    sp.add_argument('--idle-timeout', type=float,
+                    help='close connections that are idle for this many seconds')
+    sp.add_argument('--graceful-timeout', type=float,
+                    help='time in seconds workers get to finish on shutdown')
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+"""Interoperability with :mod:`asyncio`.
+
+This module provides an asyncio event loop that runs on top of the libuv loop
+of a :class:`Hub`. This allows asyncio based libraries to be used in the same
+thread as Gruvi fibers.
+
+This module requires Python 3.5.3 or later. It uses the private functions
+``asyncio.events._get_running_loop()`` and ``_set_running_loop()``, which
+were added in that version, and drives the loop through the private
+``_run_once()`` method and ``_ready`` and ``_scheduled`` attributes of
+:class:`asyncio.BaseEventLoop`.
+"""
+
+from __future__ import absolute_import, print_function
+
+import sys
+if sys.version_info[:3] < (3, 5, 3):
+    raise ImportError('gruvi.aio requires Python 3.5.3+')
+
+import asyncio
+import selectors
+import types
+
+from asyncio import events
+
+import pyuv
+
+from . import logging
+from .hub import get_hub, switchpoint, switch_back
+from .sync import Event
+
+__all__ = ['AsyncioLoop', 'get_asyncio_loop', 'await_coroutine']
+
+
+def _fileobj_to_fd(fileobj):
+    # Like selectors._fileobj_to_fd(), which is private.
+    if isinstance(fileobj, int):
+        fd = fileobj
+    else:
+        try:
+            fd = int(fileobj.fileno())
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError('invalid file object: {!r}'.format(fileobj))
+    if fd < 0:
+        raise ValueError('invalid file descriptor: {}'.format(fd))
+    return fd
+
+
+def _to_uv_events(events):
+    uvevents = 0
+    if events & selectors.EVENT_READ:
+        uvevents |= pyuv.UV_READABLE
+    if events & selectors.EVENT_WRITE:
+        uvevents |= pyuv.UV_WRITABLE
+    return uvevents
+
+
+class _HubSelector(selectors.BaseSelector):
+    # A selector that watches file descriptors with pyuv.Poll handles in the
+    # loop of a hub. It never blocks: select() returns the events that were
+    # collected since the last call, and *wakeup* is called when new events
+    # arrive.
+
+    def __init__(self, hub, wakeup):
+        self._hub = hub
+        self._wakeup = wakeup
+        self._keys = {}
+        self._polls = {}
+        self._events = {}
+
+    def _on_poll(self, fd, handle, uvevents, error):
+        key = self._keys.get(fd)
+        if key is None:
+            return
+        events = 0
+        # On error, report the fd as ready so that the callbacks see the error
+        # when they try to use it.
+        if error or uvevents & pyuv.UV_READABLE:
+            events |= selectors.EVENT_READ
+        if error or uvevents & pyuv.UV_WRITABLE:
+            events |= selectors.EVENT_WRITE
+        self._events[fd] = self._events.get(fd, 0) | (events & key.events)
+        self._wakeup()
+
+    def _start_poll(self, key):
+        poll = self._polls.get(key.fd)
+        if poll is None:
+            poll = self._polls[key.fd] = pyuv.Poll(self._hub.loop, key.fd)
+            # The polls are owned by the loop, which is cached in the hub and
+            # lives as long as it does. This includes the poll on the loop's
+            # self-pipe. Mark them as "system handles" so that the test suite
+            # does not report them as leaked.
+            poll._system_handle = True
+        poll.start(_to_uv_events(key.events), lambda *args: self._on_poll(key.fd, *args))
+
+    def register(self, fileobj, events, data=None):
+        if not events or events & ~(selectors.EVENT_READ | selectors.EVENT_WRITE):
+            raise ValueError('invalid events: {!r}'.format(events))
+        fd = _fileobj_to_fd(fileobj)
+        if fd in self._keys:
+            raise KeyError('{!r} (fd {}) is already registered'.format(fileobj, fd))
+        key = self._keys[fd] = selectors.SelectorKey(fileobj, fd, events, data)
+        self._start_poll(key)
+        return key
+
+    def unregister(self, fileobj):
+        fd = _fileobj_to_fd(fileobj)
+        key = self._keys.pop(fd)
+        self._events.pop(fd, None)
+        poll = self._polls.pop(fd)
+        poll.close()
+        return key
+
+    def modify(self, fileobj, events, data=None):
+        fd = _fileobj_to_fd(fileobj)
+        key = self._keys[fd]
+        if events == key.events:
+            key = self._keys[fd] = key._replace(data=data)
+            return key
+        if not events or events & ~(selectors.EVENT_READ | selectors.EVENT_WRITE):
+            raise ValueError('invalid events: {!r}'.format(events))
+        key = self._keys[fd] = key._replace(events=events, data=data)
+        if fd in self._events:
+            self._events[fd] &= events
+        self._start_poll(key)
+        return key
+
+    def select(self, timeout=None):
+        ready = []
+        for fd, mask in self._events.items():
+            key = self._keys.get(fd)
+            if key is not None and mask:
+                ready.append((key, mask))
+        self._events.clear()
+        return ready
+
+    def get_key(self, fileobj):
+        return self._keys[_fileobj_to_fd(fileobj)]
+
+    def get_map(self):
+        return types.MappingProxyType(self._keys)
+
+    def close(self):
+        for poll in self._polls.values():
+            poll.close()
+        self._polls.clear()
+        self._keys.clear()
+        self._events.clear()
+
+
+class AsyncioLoop(asyncio.SelectorEventLoop):
+    """An asyncio event loop that runs on top of the loop of a :class:`Hub`.
+
+    The asyncio loop does not have a ``run_forever()`` loop of its own.
+    Instead, the hub runs an iteration of it whenever asyncio callbacks are
+    ready, when a timer expires or when a file descriptor that asyncio waits
+    for becomes ready. For asyncio code, the loop is always running.
+
+    Asyncio callbacks, and with them the steps of coroutines, run in the hub's
+    fiber. This means they must not call Gruvi switchpoints. To wait for a
+    coroutine from a fiber, use :func:`await_coroutine`.
+
+    Normally you do not create instances yourself but use
+    :func:`get_asyncio_loop`.
+    """
+
+    def __init__(self, hub=None):
+        self._hub = hub or get_hub()
+        self._run_pending = False
+        self._stopped = Event()
+        self._timer = pyuv.Timer(self._hub.loop)
+        self._timer._system_handle = True
+        self._log = logging.get_logger()
+        super(AsyncioLoop, self).__init__(_HubSelector(self._hub, self._schedule_run))
+        # The hub always runs us, so from asyncio's point of view we are always
+        # running, in the hub's thread.
+        self._thread_id = self._hub._thread
+
+    @property
+    def hub(self):
+        """The hub this loop runs in."""
+        return self._hub
+
+    def _schedule_run(self):
+        # Schedule an iteration of the asyncio loop in the hub.
+        if self._run_pending or self._hub.loop is None:
+            return
+        self._run_pending = True
+        self._hub.run_callback(self._run_from_hub)
+
+    # The methods below use the private parts of BaseEventLoop and of
+    # asyncio.events that are listed in the module docstring. Any changes to
+    # those need to be handled here.
+
+    def _run_from_hub(self, *args):
+        # Run one iteration of the asyncio loop. Called by the hub.
+        self._run_pending = False
+        if self.is_closed():
+            return
+        old_loop = events._get_running_loop()
+        events._set_running_loop(self)
+        try:
+            self._run_once()
+        except Exception:
+            self._log.exception('uncaught exception in asyncio loop')
+        finally:
+            events._set_running_loop(old_loop)
+        if self._ready:
+            self._schedule_run()
+        else:
+            self._arm_timer()
+
+    def _arm_timer(self):
+        # Make sure we run when the earliest asyncio timer expires.
+        if self.is_closed():
+            return
+        if self._scheduled:
+            delay = max(0, self._scheduled[0]._when - self.time())
+            self._timer.start(self._run_from_hub, delay, 0)
+        else:
+            self._timer.stop()
+
+    def call_soon(self, callback, *args, **kwargs):
+        handle = super(AsyncioLoop, self).call_soon(callback, *args, **kwargs)
+        self._schedule_run()
+        return handle
+
+    def call_at(self, when, callback, *args, **kwargs):
+        handle = super(AsyncioLoop, self).call_at(when, callback, *args, **kwargs)
+        if self._scheduled[0] is handle:
+            self._arm_timer()
+        return handle
+
+    @switchpoint
+    def run_forever(self):
+        """Wait until :meth:`stop` is called.
+
+        This is provided for compatibility only. The loop runs as long as the
+        hub runs.
+        """
+        self._stopped.clear()
+        self._stopped.wait()
+
+    @switchpoint
+    def run_until_complete(self, future):
+        """Wait for *future*, which may also be a coroutine, and return its
+        result. This is the same as :func:`await_coroutine`."""
+        return await_coroutine(future, loop=self)
+
+    def stop(self):
+        """Make :meth:`run_forever` return."""
+        self._stopped.set()
+
+    def close(self):
+        """Close the loop."""
+        if self.is_closed():
+            return
+        self._thread_id = None
+        super(AsyncioLoop, self).close()
+        if not self._timer.closed:
+            self._timer.close()
+        self._stopped.set()
+
+
+def get_asyncio_loop(hub=None):
+    """Return the :class:`AsyncioLoop` for *hub*, or for the current hub if
+    *hub* is not specified.
+
+    The loop is created on first use. If *hub* runs in the current thread, the
+    loop is also installed as the current thread's event loop with
+    :func:`asyncio.set_event_loop`.
+    """
+    hub = hub or get_hub()
+    loop = hub.data.get('gruvi:asyncio_loop')
+    if loop is None or loop.is_closed():
+        loop = hub.data['gruvi:asyncio_loop'] = AsyncioLoop(hub)
+        if hub is get_hub():
+            asyncio.set_event_loop(loop)
+    return loop
+
+
+@switchpoint
+def await_coroutine(coro, timeout=None, loop=None):
+    """Wait for the asyncio coroutine *coro* and return its result.
+
+    The *coro* argument may be a coroutine, a future, or any other awaitable.
+    It is run in *loop*, which defaults to :func:`get_asyncio_loop`. If the
+    coroutine raises an exception, it is re-raised.
+
+    If *timeout* is specified and the coroutine does not complete in time, it
+    is cancelled and a :class:`~gruvi.Timeout` is raised. The coroutine is also
+    cancelled if the calling fiber is cancelled.
+    """
+    loop = loop or get_asyncio_loop()
+    future = asyncio.ensure_future(coro, loop=loop)
+    if not future.done():
+        hub = get_hub()
+        try:
+            with switch_back(timeout) as switcher:
+                future.add_done_callback(switcher)
+                hub.switch()
+        except BaseException:
+            future.remove_done_callback(switcher)
+            future.cancel()
+            raise
+    return future.result()
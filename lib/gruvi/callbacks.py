@@ -164,6 +164,7 @@ class dllist(object):
             next_node = node._next
             node._list = node._prev = node._next = None
             node = next_node
+        self._first = self._last = None
         self._size = 0
 
 
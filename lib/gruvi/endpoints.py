@@ -15,16 +15,22 @@ import functools
 import pyuv
 import six
 import errno
+import threading
 
-from . import logging
+from . import logging, util
 from .hub import get_hub, switchpoint, switch_back
 from .sync import Event
+from .futures import Future
+from .fibers import spawn
 from .errors import Timeout
-from .transports import TransportError, Transport
+from .transports import TransportError, Transport, DatagramTransport
+from .transports import _socket_options, _check_socket_options, _set_handle_option
+from .transports import _stats_counters
 from .ssl import SslTransport, create_ssl_context
 from .address import getaddrinfo, saddr
 
-__all__ = ['create_connection', 'create_server', 'Endpoint', 'Client', 'Server']
+__all__ = ['create_connection', 'create_server', 'create_datagram_endpoint', 'Endpoint',
+           'Client', 'Server', 'MultiHubServer', 'DatagramClient', 'DatagramServer']
 
 
 def _use_af_unix(addr):
@@ -63,9 +69,29 @@ def _af_unix_helper(handle, address, op):
     handle.open(fd)
 
 
+def _set_socket_options(handle, options, listening=False):
+    """Set the socket options in *options* on *handle*.
+
+    Options that do not apply to the type of handle, and options for listening
+    sockets if *listening* is false, are skipped. Options that cannot be set
+    are logged but otherwise ignored.
+    """
+    for name, value in options.items():
+        level, _, _, listen_only = _socket_options[name]
+        if value is None or listen_only and not listening:
+            continue
+        if level == socket.IPPROTO_TCP and not isinstance(handle, pyuv.TCP):
+            continue
+        try:
+            _set_handle_option(handle, name, value)
+        except TransportError as e:
+            logging.get_logger().warning('{!s}', e)
+
+
 @switchpoint
 def create_connection(protocol_factory, address, ssl=False, ssl_args={},
-                      family=0, flags=0, local_address=None, timeout=None, mode='rw'):
+                      family=0, flags=0, local_address=None, timeout=None, mode='rw',
+                      **sockopts):
     """Create a new client connection.
 
     This method creates a new :class:`pyuv.Handle`, connects it to *address*,
@@ -113,7 +139,13 @@ def create_connection(protocol_factory, address, ssl=False, ssl_args={},
 
     The *local_address* keyword argument is relevant only for TCP transports.
     If provided, it specifies the local address to bind to.
+
+    Any other keyword arguments are socket options that are set on the
+    connection, for example ``nodelay=True``. See
+    :meth:`~BaseTransport.set_option` for the supported options. Options that
+    only apply to listening sockets are ignored.
     """
+    _check_socket_options(sockopts)
     hub = get_hub()
     log = logging.get_logger()
     if isinstance(address, (six.binary_type, six.text_type)):
@@ -146,13 +178,18 @@ def create_connection(protocol_factory, address, ssl=False, ssl_args={},
             if handle_type is pyuv.Pipe and _use_af_unix(addr):
                 _af_unix_helper(handle, addr, 'connect')
             else:
-                with switch_back(timeout) as switcher:
+                switcher = switch_back(timeout)
+                with switcher:
                     handle.connect(addr, switcher)
                     result = hub.switch()
                     _, error = result[0]
         except pyuv.error.UVError as e:
             error = e[0]
-        except Timeout:
+        except Timeout as e:
+            # Propagate the timeout of an enclosing deadline.
+            if e is not switcher.timeout:
+                handle.close()
+                raise
             error = pyuv.errno.UV_ETIMEDOUT
         if not error:
             break
@@ -163,6 +200,7 @@ def create_connection(protocol_factory, address, ssl=False, ssl_args={},
         raise TransportError.from_errno(error)
     if local_address:
         handle.bind(*local_address)
+    _set_socket_options(handle, sockopts)
     protocol = protocol_factory()
     protocol._timeout = timeout
     if ssl:
@@ -179,7 +217,7 @@ def create_connection(protocol_factory, address, ssl=False, ssl_args={},
 
 @switchpoint
 def create_server(protocol_factory, address=None, ssl=False, ssl_args={},
-                  family=0, flags=0, backlog=128):
+                  family=0, flags=0, backlog=128, **sockopts):
     """
     Create a new network server.
 
@@ -209,18 +247,95 @@ def create_server(protocol_factory, address=None, ssl=False, ssl_args={},
     The *backlog* parameter specifies the listen backlog i.e the maximum
     number of not yet accepted connections to queue.
 
+    Any other keyword arguments are socket options, for example
+    ``nodelay=True`` or ``defer_accept=5``. See
+    :meth:`~BaseTransport.set_option` for the supported options. The options
+    are set on the listening sockets, and accepted connections inherit them.
+
     The return value is a :class:`Server` instance that can be used to control
     the listening transports.
     """
     server = Server(protocol_factory)
     server.listen(address, ssl=ssl, ssl_args=ssl_args, family=family,
-                  flags=flags, backlog=backlog)
+                  flags=flags, backlog=backlog, **sockopts)
     return server
 
 
+@switchpoint
+def create_datagram_endpoint(protocol_factory, local_address=None, remote_address=None,
+                             family=0, flags=0, mode='rw', **sockopts):
+    """Create a new datagram (UDP) endpoint.
+
+    This creates a :class:`pyuv.UDP` handle, wraps it in a
+    :class:`DatagramTransport`, and connects it to a new protocol instance
+    obtained by calling *protocol_factory*. The result is returned as a
+    ``(transport, protocol)`` tuple.
+
+    The *local_address* argument is a ``(host, port)`` tuple to bind to. The
+    *remote_address* argument is a ``(host, port)`` tuple that is used as the
+    default address for :meth:`~DatagramTransport.sendto`. If it is provided,
+    datagrams from other addresses are ignored. At least one of the two must
+    be provided. If only *remote_address* is provided, the endpoint is bound
+    to an ephemeral port on the wildcard address.
+
+    Both addresses are passed to :func:`getaddrinfo` together with the
+    *family* and *flags* arguments, and the first result is used.
+
+    See :func:`create_connection` for the *mode* argument, and
+    :meth:`~BaseTransport.set_option` for the socket options that can be
+    passed as keyword arguments. For UDP, only ``'sndbuf'`` and ``'rcvbuf'``
+    apply.
+    """
+    if local_address is None and remote_address is None:
+        raise ValueError('local_address and/or remote_address must be provided')
+    _check_socket_options(sockopts)
+    hub = get_hub()
+    if remote_address is not None:
+        result = getaddrinfo(remote_address[0], remote_address[1], family,
+                             socket.SOCK_DGRAM, socket.IPPROTO_UDP, flags)
+        remote_address = result[0][4]
+        family = result[0][0]
+    if local_address is None:
+        local_address = ('::', 0) if family == socket.AF_INET6 else ('0.0.0.0', 0)
+    result = getaddrinfo(local_address[0], local_address[1], family,
+                         socket.SOCK_DGRAM, socket.IPPROTO_UDP, flags | socket.AI_PASSIVE)
+    handle = pyuv.UDP(hub.loop)
+    try:
+        handle.bind(result[0][4])
+    except pyuv.error.UVError as e:
+        handle.close()
+        raise TransportError.from_errno(e.args[0])
+    _set_socket_options(handle, sockopts)
+    protocol = protocol_factory()
+    transport = DatagramTransport(handle, mode, remote_address)
+    transport.start(protocol)
+    return (transport, protocol)
+
+
+def _add_stats(total, stats):
+    # Add the transport stats *stats* to the aggregate *total*.
+    for name in _stats_counters:
+        if name == 'peak_write_buffer':
+            total[name] = max(total[name], stats[name])
+        else:
+            total[name] += stats[name]
+
+
 class Endpoint(object):
     """A communications endpoint."""
 
+    #: Default socket options for new connections. See
+    #: :meth:`~BaseTransport.set_option` for the supported options. Options
+    #: passed to :meth:`Client.connect` or :meth:`Server.listen` take
+    #: precedence.
+    default_socket_options = {}
+
+    #: Default idle, read and write timeouts for new connections, in seconds.
+    #: See :meth:`~BaseTransport.set_timeouts`. ``None`` means no timeout.
+    idle_timeout = None
+    read_timeout = None
+    write_timeout = None
+
     def __init__(self, protocol_factory, timeout=None):
         """
         The *protocol_factory* argument constructs a new protocol instance.
@@ -271,9 +386,12 @@ class Client(Endpoint):
         if self._transport:
             raise RuntimeError('already connected')
         kwargs.setdefault('timeout', self._timeout)
+        for name, value in self.default_socket_options.items():
+            kwargs.setdefault(name, value)
         conn = create_connection(self._protocol_factory, address, **kwargs)
         self._transport = conn[0]
         self._transport._log = self._log
+        self._transport.set_timeouts(self.idle_timeout, self.read_timeout, self.write_timeout)
         self._protocol = conn[1]
         self._protocol._log = self._log
         self._protocol._timeout = self._timeout
@@ -301,6 +419,8 @@ class Server(Endpoint):
         self._connections = dict()
         self._all_closed = Event()
         self._all_closed.set()
+        self._closed_stats = dict.fromkeys(_stats_counters, 0)
+        self._closed_connections = 0
 
     @property
     def addresses(self):
@@ -312,7 +432,7 @@ class Server(Endpoint):
         """An iterator yielding the (transport, protocol) pairs for each connection."""
         return self._connections.items()
 
-    def _on_new_connection(self, ssl, ssl_args, handle, error):
+    def _on_new_connection(self, ssl, ssl_args, sockopts, handle, error):
         # Callback used with handle.listen().
         assert handle in self._handles
         if error:
@@ -320,10 +440,19 @@ class Server(Endpoint):
             return
         client = type(handle)(self._hub.loop)
         handle.accept(client)
+        self._start_connection(client, ssl, ssl_args, sockopts)
+
+    def _start_connection(self, client, ssl, ssl_args, sockopts=None):
+        # Start serving a connection on the accepted handle *client*. This is
+        # also used for handles that were accepted by another process.
         if self.max_connections is not None and len(self._connections) >= self.max_connections:
             self._log.warning('max connections reached, dropping new connection')
             client.close()
             return
+        # Not all platforms let accepted sockets inherit the options of the
+        # listening socket, so set them explicitly.
+        if sockopts:
+            _set_socket_options(client, sockopts)
         if ssl:
             context = ssl if hasattr(ssl, 'set_ciphers') else create_ssl_context()
             transport = SslTransport(client, context, True, **ssl_args)
@@ -342,14 +471,37 @@ class Server(Endpoint):
         self._connections[transport] = protocol
         self.connection_made(transport, protocol)
         transport.start(protocol)
+        transport.set_timeouts(self.idle_timeout, self.read_timeout, self.write_timeout)
 
     def _on_close_complete(self, transport, protocol, exc=None):
         # Called by Transport._on_close_complete
+        _add_stats(self._closed_stats, transport.get_extra_info('stats'))
+        self._closed_connections += 1
         self._connections.pop(transport, None)
         if not self._connections:
             self._all_closed.set()
         self.connection_lost(transport, protocol, exc)
 
+    def get_stats(self):
+        """Return the aggregated traffic and flow control counters of all
+        connections, including the ones that were closed.
+
+        The return value is a dictionary with the same keys as the ``'stats'``
+        from :meth:`~BaseTransport.get_extra_info`, except ``'age'``. The
+        counters are summed, and ``'peak_write_buffer'`` is the maximum. In
+        addition, ``'connections'`` is the number of open connections and
+        ``'closed_connections'`` the number of connections that were closed.
+
+        To find slow connections, use the ``'stats'`` of the individual
+        transports in :attr:`connections`.
+        """
+        stats = dict(self._closed_stats)
+        for transport in self._connections:
+            _add_stats(stats, transport.get_extra_info('stats'))
+        stats['connections'] = len(self._connections)
+        stats['closed_connections'] = self._closed_connections
+        return stats
+
     def connection_made(self, transport, protocol):
         """Called when a new connection is made."""
 
@@ -357,13 +509,17 @@ class Server(Endpoint):
         """Called when a connection is lost."""
 
     @switchpoint
-    def listen(self, address, ssl=False, ssl_args={}, family=0, flags=0, backlog=128):
+    def listen(self, address, ssl=False, ssl_args={}, family=0, flags=0, backlog=128,
+               **sockopts):
         """Create a new transport, bind it to *address*, and start listening
         for new connections.
 
         See :func:`create_server` for a description of *address* and the
         supported keyword arguments.
         """
+        _check_socket_options(sockopts)
+        options = dict(self.default_socket_options)
+        options.update(sockopts)
         handles = []
         if isinstance(address, six.string_types):
             handle_type = pyuv.Pipe
@@ -391,7 +547,8 @@ class Server(Endpoint):
             handles.append(handle)
         addresses = []
         for handle in handles:
-            callback = functools.partial(self._on_new_connection, ssl, ssl_args)
+            _set_socket_options(handle, options, listening=True)
+            callback = functools.partial(self._on_new_connection, ssl, ssl_args, options)
             handle.listen(callback, backlog)
             addr = handle.getsockname()
             self._log.debug('listen on {}', saddr(addr))
@@ -419,3 +576,282 @@ class Server(Endpoint):
         explicitly.
         """
         get_hub().switch()
+
+
+class _Worker(object):
+    # A worker thread of a MultiHubServer.
+
+    __slots__ = ('name', 'thread', 'hub', 'server', 'started', 'stopped')
+
+    def __init__(self, name):
+        self.name = name
+        self.thread = None
+        self.hub = None
+        self.server = None
+        self.started = Future()
+        self.stopped = Future()
+
+
+class MultiHubServer(object):
+    """A server that accepts connections in multiple threads.
+
+    A :class:`Server` runs in the hub of the thread that created it, and
+    therefore uses at most one CPU core. This class starts a number of worker
+    threads, each with its own hub and its own :class:`Server` instance, that
+    all listen on the same address.
+
+    For TCP addresses, each worker binds its own listening socket with the
+    ``SO_REUSEPORT`` socket option, so that the kernel distributes incoming
+    connections over the workers. On platforms without ``SO_REUSEPORT``, and
+    for named pipes, the workers share a single listening socket.
+
+    Threads are only useful because libuv releases the GIL while it waits for
+    I/O, and some of the heavy lifting like TLS is done by C code that also
+    releases it. For CPU heavy applications, consider multiple processes
+    instead.
+    """
+
+    def __init__(self, server_factory, workers=None):
+        """
+        The *server_factory* argument must be a callable that creates a new
+        :class:`Server` instance, for example ``lambda: HttpServer(app)``. It
+        is called once in each worker thread.
+
+        The *workers* argument specifies the number of worker threads. The
+        default is the number of CPUs.
+        """
+        self._server_factory = server_factory
+        self._nworkers = workers or len(pyuv.util.cpu_info())
+        self._workers = []
+        self._addresses = []
+        self._log = logging.get_logger(self)
+
+    @property
+    def addresses(self):
+        """The addresses this server is listening on."""
+        return self._addresses
+
+    @property
+    def servers(self):
+        """A list with the :class:`Server` instance of each worker."""
+        return [worker.server for worker in self._workers if worker.server]
+
+    @property
+    def connections(self):
+        """A list of (transport, protocol) pairs for the connections of all
+        workers.
+
+        This is a snapshot. The transports and protocols are owned by the
+        hubs of the worker threads, and must not be used from other threads.
+        """
+        connections = []
+        for server in self.servers:
+            connections.extend(list(server._connections.items()))
+        return connections
+
+    @staticmethod
+    def _bind_socket(family, addr, reuseport):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuseport:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(addr)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def _create_sockets(self, address, family, flags):
+        # Create and bind the listening sockets. Return a list with for each
+        # worker a list of sockets.
+        if isinstance(address, six.string_types):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(address)
+            return [[sock]] * self._nworkers
+        elif not isinstance(address, tuple):
+            raise TypeError('expecting a string or tuple')
+        result = getaddrinfo(address[0], address[1], family, socket.SOCK_STREAM,
+                             socket.IPPROTO_TCP, flags)
+        reuseport = hasattr(socket, 'SO_REUSEPORT')
+        sockets = [[] for i in range(self._nworkers)]
+        for res in result:
+            try:
+                sock = self._bind_socket(res[0], res[4], reuseport)
+            except socket.error as e:
+                self._log.warning('bind error {!r}, skipping {}', e, saddr(res[4]))
+                continue
+            sockets[0].append(sock)
+            # Use the address the first socket was bound to, in case an
+            # ephemeral port was requested.
+            addr = sock.getsockname()
+            for worker_sockets in sockets[1:]:
+                if reuseport:
+                    sock = self._bind_socket(res[0], addr, reuseport)
+                worker_sockets.append(sock)
+        return sockets
+
+    def _worker_main(self, worker, sockets, kwargs):
+        # Main function of a worker thread.
+        hub = worker.hub = get_hub()
+        try:
+            worker.server = self._server_factory()
+            for sock in sockets:
+                if sock.family == socket.AF_UNIX:
+                    handle = pyuv.Pipe(hub.loop)
+                else:
+                    handle = pyuv.TCP(hub.loop)
+                handle.open(os.dup(sock.fileno()))
+                worker.server.listen(handle, **kwargs)
+        except BaseException as e:
+            worker.started.set_exception(e)
+            hub.close()
+        else:
+            worker.started.set_result(None)
+        try:
+            hub.switch()
+        finally:
+            worker.stopped.set_result(None)
+
+    @switchpoint
+    def listen(self, address, ssl=False, ssl_args={}, family=0, flags=0, backlog=128,
+               **sockopts):
+        """Start the worker threads and start listening on *address*.
+
+        The address can be a string for a named pipe, or a ``(host, port)``
+        tuple. See :func:`create_server` for a description of the supported
+        keyword arguments.
+        """
+        if self._workers:
+            raise RuntimeError('already listening')
+        _check_socket_options(sockopts)
+        sockets = self._create_sockets(address, family, flags)
+        kwargs = dict(sockopts, ssl=ssl, ssl_args=ssl_args, backlog=backlog)
+        try:
+            for i in range(self._nworkers):
+                worker = _Worker('{}:{}'.format(util.objref(self), i))
+                worker.thread = threading.Thread(target=self._worker_main, name=worker.name,
+                                                 args=(worker, sockets[i], kwargs))
+                worker.thread.daemon = True
+                worker.thread.start()
+                self._workers.append(worker)
+            for worker in self._workers:
+                worker.started.result()
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            # The worker threads have their own duplicates.
+            for sock in set(sock for socks in sockets for sock in socks):
+                sock.close()
+        self._addresses = self._workers[0].server.addresses
+        self._log.debug('listening on {} with {} workers', saddr(self._addresses[0])
+                            if self._addresses else '(none)', len(self._workers))
+
+    @staticmethod
+    def _stop_worker(worker):
+        # Runs in a fiber in the worker's hub.
+        if worker.server is not None:
+            worker.server.close()
+        worker.hub.close()
+
+    def _signal_stop(self, worker):
+        # Runs as a callback in the worker's hub.
+        spawn(self._stop_worker, worker)
+
+    @switchpoint
+    def close(self):
+        """Close the listening sockets and all accepted connections in all
+        workers, and stop the worker threads."""
+        for worker in self._workers:
+            if worker.stopped.done() or worker.hub is None:
+                continue
+            worker.hub.run_callback(self._signal_stop, worker)
+        for worker in self._workers:
+            worker.stopped.result()
+        del self._workers[:]
+
+    @switchpoint
+    def run(self):
+        """Block the current fiber while the workers serve requests.
+
+        See :meth:`Server.run`.
+        """
+        get_hub().switch()
+
+
+class DatagramClient(Client):
+    """A datagram (UDP) client endpoint."""
+
+    @switchpoint
+    def connect(self, address, **kwargs):
+        """Create a datagram endpoint with *address* as its remote address.
+
+        See :func:`~gruvi.create_datagram_endpoint` for the supported keyword
+        arguments.
+        """
+        if self._transport:
+            raise RuntimeError('already connected')
+        for name, value in self.default_socket_options.items():
+            kwargs.setdefault(name, value)
+        conn = create_datagram_endpoint(self._protocol_factory, remote_address=address, **kwargs)
+        self._transport = conn[0]
+        self._transport._log = self._log
+        self._protocol = conn[1]
+        self._protocol._log = self._log
+        self._protocol._timeout = self._timeout
+
+
+class DatagramServer(Endpoint):
+    """A datagram (UDP) server endpoint.
+
+    Unlike a stream :class:`Server`, there are no connections. A datagram
+    server has one transport and one protocol instance for each address it is
+    bound to, and the protocol receives the datagrams of all peers.
+    """
+
+    def __init__(self, protocol_factory, timeout=None):
+        super(DatagramServer, self).__init__(protocol_factory, timeout=timeout)
+        self._transports = []
+
+    @property
+    def addresses(self):
+        """The addresses this server is bound to."""
+        return [transport.get_extra_info('sockname') for transport in self._transports]
+
+    @property
+    def transports(self):
+        """A list of (transport, protocol) pairs, one for each address."""
+        return [(transport, transport._protocol) for transport in self._transports]
+
+    @switchpoint
+    def listen(self, address, family=0, flags=0, **sockopts):
+        """Bind to *address* and start receiving datagrams.
+
+        See :func:`~gruvi.create_datagram_endpoint` for a description of the
+        arguments. This method may be called multiple times to listen on
+        multiple addresses.
+        """
+        options = dict(self.default_socket_options)
+        options.update(sockopts)
+        transport, protocol = create_datagram_endpoint(self._protocol_factory, address,
+                                                       family=family, flags=flags, **options)
+        transport._log = protocol._log = self._log
+        protocol._timeout = self._timeout
+        self._transports.append(transport)
+        self._log.debug('listen on {}', saddr(transport.get_extra_info('sockname')))
+
+    @switchpoint
+    def close(self):
+        """Close all transports."""
+        transports, self._transports = self._transports, []
+        for transport in transports:
+            transport.close()
+        for transport in transports:
+            transport._closed.wait()
+
+    @switchpoint
+    def run(self):
+        """Run the event loop and start serving requests. See
+        :meth:`Server.run`."""
+        get_hub().switch()
@@ -11,12 +11,13 @@ from __future__ import absolute_import, print_function
 import fibers
 
 from . import logging
-from .hub import get_hub, switchpoint
+from .hub import get_hub, switchpoint, PRIORITY_NORMAL
 from .sync import Event
+from .local import inherit_locals
 from .errors import Cancelled, Timeout
 from .callbacks import add_callback, remove_callback, run_callbacks
 
-__all__ = ['current_fiber', 'Fiber', 'spawn']
+__all__ = ['current_fiber', 'Fiber', 'spawn', 'FiberCache', 'get_fiber_cache']
 
 
 def current_fiber():
@@ -41,9 +42,10 @@ class Fiber(fibers.Fiber):
     # Gruvi application that use the "raw" interface from the fibers package
     # are the root fiber and the Hub.
 
-    __slots__ = ('_name', 'context', '_target', '_log', '_done', '_callbacks')
+    __slots__ = ('_name', 'context', '_target', '_log', '_done', '_callbacks',
+                 '_cache', '_target_args', '_priority', '_locals')
 
-    def __init__(self, target, args=(), kwargs={}, name=None, hub=None):
+    def __init__(self, target, args=(), kwargs={}, name=None, hub=None, priority=None):
         """
         The *target* argument is the main function of the fiber. It must be a
         Python callable. The *args* and *kwargs* specify its arguments and
@@ -55,6 +57,11 @@ class Fiber(fibers.Fiber):
         The *hub* argument can be used to override the hub that will be used to
         schedule this fiber. This argument is used by the unit tests and should
         not by needed.
+
+        The *priority* argument specifies the priority with which the fiber is
+        scheduled by the hub. It can be :data:`~gruvi.PRIORITY_NORMAL` (the
+        default) or :data:`~gruvi.PRIORITY_LOW` for background work. See
+        :meth:`Hub.run_callback`.
         """
         self._hub = hub or get_hub()
         super(Fiber, self).__init__(self.run, args, kwargs, self._hub)
@@ -67,23 +74,35 @@ class Fiber(fibers.Fiber):
         self._log = logging.get_logger()
         self._done = Event()
         self._callbacks = None
+        self._cache = None
+        self._target_args = None
+        self._priority = PRIORITY_NORMAL if priority is None else priority
+        self._locals = inherit_locals(fibers.current(), self)
 
     @property
     def name(self):
         """The fiber's name."""
         return self._name
 
+    @property
+    def priority(self):
+        """The fiber's scheduling priority."""
+        return self._priority
+
     @property
     def alive(self):
-        """Whether the fiber is alive."""
-        return self.is_alive()
+        """Whether the fiber is alive.
+
+        A fiber that is idle in a :class:`FiberCache` is not alive.
+        """
+        return self._target is not None and self.is_alive()
 
     def start(self):
         """Schedule the fiber to be started in the next iteration of the
         event loop."""
         target = getattr(self._target, '__qualname__', self._target.__name__)
         self._log.debug('starting fiber {}, target {}', self.name, target)
-        self._hub.run_callback(self.switch)
+        self._hub.run_callback(self.switch, priority=self._priority)
 
     def switch(self, value=None):
         # Only the hub may call this.
@@ -92,13 +111,27 @@ class Fiber(fibers.Fiber):
         if not self.is_alive():
             self._log.warning('attempt to switch to a dead Fiber')
             return
-        return super(Fiber, self).switch(value)
+        profiler = self._hub._profiler
+        if profiler is None:
+            return super(Fiber, self).switch(value)
+        profiler.enter(self)
+        try:
+            return super(Fiber, self).switch(value)
+        finally:
+            profiler.leave()
 
     def throw(self, typ, val=None, tb=None):
         # Only the hub may call this.
         if self.current() is not self._hub:
             raise RuntimeError('only the Hub may throw() into a fiber')
-        return super(Fiber, self).throw(typ, val, tb)
+        profiler = self._hub._profiler
+        if profiler is None:
+            return super(Fiber, self).throw(typ, val, tb)
+        profiler.enter(self)
+        try:
+            return super(Fiber, self).throw(typ, val, tb)
+        finally:
+            profiler.leave()
 
     def cancel(self, message=None):
         """Schedule the fiber to be cancelled in the next iteration of the
@@ -108,7 +141,7 @@ class Fiber(fibers.Fiber):
         into the fiber. If *message* is provided, it will be set as the value
         of the exception.
         """
-        if not self.is_alive():
+        if not self.alive:
             return
         if message is None:
             message = 'cancelled by Fiber.cancel()'
@@ -124,14 +157,43 @@ class Fiber(fibers.Fiber):
         # Target of the first :meth:`switch()` call.
         if self.current() is not self:
             raise RuntimeError('run() may only be called from self')
-        try:
-            self._target(*args, **kwargs)
-        except Cancelled as e:
-            self._log.debug('fiber was cancelled ({!s})', e)
-        except BaseException:
-            self._log.exception('uncaught exception in fiber')
-        self._done.set()
-        run_callbacks(self)
+        while True:
+            self._hub._live_fibers += 1
+            try:
+                self._target(*args, **kwargs)
+            except Cancelled as e:
+                self._log.debug('fiber was cancelled ({!s})', e)
+            except BaseException:
+                self._log.exception('uncaught exception in fiber')
+            self._hub._live_fibers -= 1
+            self._done.set()
+            run_callbacks(self)
+            # If we came from a cache, try to go back there and wait for a new
+            # target. Otherwise the fiber exits.
+            if self._cache is None or not self._cache._park(self):
+                break
+            if not self._wait_for_target():
+                break
+            args, kwargs = self._target_args
+            self._target_args = None
+
+    def _wait_for_target(self):
+        # Wait in the cache until we are given a new target. Return whether we
+        # got one. Stale switches and cancellations that were scheduled for the
+        # previous target are ignored.
+        while self._target is None and self._cache is not None:
+            try:
+                self._hub.switch()
+            except Cancelled:
+                pass
+            except Exception:
+                # We are going to exit. Leave the cache first, so that spawn()
+                # cannot hand a new target to a dead fiber.
+                cache, self._cache = self._cache, None
+                if self in cache._idle:
+                    cache._idle.remove(self)
+                break
+        return self._target is not None
 
     # Support wait()
 
@@ -154,7 +216,135 @@ def spawn(func, *args, **kwargs):
     by calling its :meth:`~Fiber.start` method.
 
     The fiber instance is returned.
+
+    If the :class:`FiberCache` of the hub is enabled, an idle fiber from the
+    cache is used if one is available. See :class:`FiberCache` for the
+    implications.
     """
+    hub = kwargs.get('hub') or get_hub()
+    cache = hub.data.get('gruvi:fiber_cache')
+    if cache is not None and cache.maxsize:
+        return cache.spawn(func, args, **kwargs)
     fiber = Fiber(func, args, **kwargs)
     fiber.start()
     return fiber
+
+
+class FiberCache(object):
+    """A cache of idle fibers.
+
+    Creating a fiber allocates a new C stack and a number of Python objects.
+    For servers that spawn a fiber per request, this can be a significant part
+    of the cost of handling a short request. A fiber cache avoids this by
+    keeping fibers whose main function has returned around, and reusing them
+    to run new main functions.
+
+    There is one fiber cache per hub. It is returned by
+    :func:`get_fiber_cache` and is used automatically by :func:`spawn`, and
+    therefore by :class:`FiberPool` and by the dispatcher of
+    :class:`MessageProtocol`, once it has a non-zero :attr:`maxsize`.
+
+    When a fiber is reused, its :class:`local` data is cleared. The
+    :class:`Fiber` instance returned by :func:`spawn` is also reused, and
+    refers to the fiber's *current* main function. This means that you should
+    not call :meth:`Fiber.cancel` or :meth:`Fiber.join` on a fiber after its
+    main function has returned, because by then it may be running a different
+    main function. For this reason the cache is disabled by default.
+    """
+
+    #: The default maximum number of idle fibers. Zero disables the cache.
+    default_maxsize = 0
+
+    def __init__(self, maxsize=None, hub=None):
+        """
+        The *maxsize* argument specifies the maximum number of idle fibers to
+        keep. The default is :attr:`default_maxsize`.
+        """
+        self._hub = hub or get_hub()
+        self._maxsize = self.default_maxsize if maxsize is None else maxsize
+        self._idle = []
+        self._hits = 0
+        self._misses = 0
+        self._log = logging.get_logger()
+
+    @property
+    def maxsize(self):
+        """The maximum number of idle fibers to keep."""
+        return self._maxsize
+
+    def set_maxsize(self, maxsize):
+        """Set the maximum number of idle fibers to keep.
+
+        If there are more idle fibers than *maxsize*, the excess fibers are
+        released and will exit.
+        """
+        self._maxsize = maxsize
+        while len(self._idle) > maxsize:
+            self._release(self._idle.pop())
+
+    def spawn(self, func, args=(), kwargs={}, name=None, hub=None, priority=None):
+        """Run *func* with positional arguments *args* and keyword arguments
+        *kwargs* in a fiber from the cache.
+
+        If no idle fiber is available, a new fiber is created. The *name* and
+        *priority* arguments are as for :class:`Fiber`.
+
+        The fiber instance is returned.
+        """
+        if hub is not None and hub is not self._hub:
+            raise ValueError('cannot spawn a fiber in a different hub')
+        if not self._idle:
+            self._misses += 1
+            fiber = Fiber(func, args, kwargs, name=name, hub=self._hub, priority=priority)
+            fiber._cache = self
+            fiber.start()
+            return fiber
+        self._hits += 1
+        fiber = self._idle.pop()
+        if name is not None:
+            fiber._name = name
+        fiber._target = func
+        fiber._target_args = (args, kwargs)
+        fiber._priority = PRIORITY_NORMAL if priority is None else priority
+        fiber._locals = inherit_locals(fibers.current(), fiber)
+        fiber._done.clear()
+        fiber.start()
+        return fiber
+
+    def _park(self, fiber):
+        # Called by a fiber from this cache after its main function returned.
+        # Return whether the fiber was taken into the cache.
+        if len(self._idle) >= self._maxsize or self._hub._closing:
+            return False
+        fiber._target = None
+        fiber._callbacks = None
+        fiber._locals = None
+        self._idle.append(fiber)
+        return True
+
+    def _release(self, fiber):
+        # Make an idle fiber exit.
+        fiber._cache = None
+        self._hub.run_callback(fiber.switch)
+
+    def clear(self):
+        """Release all idle fibers."""
+        self.set_maxsize(self._maxsize)
+        while self._idle:
+            self._release(self._idle.pop())
+
+    def stats(self):
+        """Return a dictionary with the keys ``'hits'``, ``'misses'``,
+        ``'idle'`` and ``'maxsize'``."""
+        return {'hits': self._hits, 'misses': self._misses,
+                'idle': len(self._idle), 'maxsize': self._maxsize}
+
+
+def get_fiber_cache(hub=None):
+    """Return the :class:`FiberCache` for *hub*, or for the current hub if
+    *hub* is not specified."""
+    hub = hub or get_hub()
+    cache = hub.data.get('gruvi:fiber_cache')
+    if cache is None:
+        cache = hub.data['gruvi:fiber_cache'] = FiberCache(hub=hub)
+    return cache
@@ -14,7 +14,7 @@ import threading
 import pyuv
 
 from . import fibers, compat, logging, util
-from .hub import switchpoint, switch_back
+from .hub import switchpoint, switch_back, _check_scopes
 from .sync import Event, Queue
 from .errors import Timeout, Cancelled
 from .callbacks import add_callback, remove_callback, run_callbacks
@@ -398,9 +398,7 @@ class FiberPool(PoolBase):
         return fibers.current_fiber()
 
     def _create_worker(self, name):
-        fiber = fibers.Fiber(self._worker_main, name=name)
-        fiber.start()
-        return fiber
+        return fibers.spawn(self._worker_main, name=name)
 
     def _cancel_fiber(self, fut, fiber):
         if fut.cancelled():
@@ -560,5 +558,6 @@ def wait(objects, count=None, timeout=None):
             if len(done) == count:
                 break
     except Timeout:
-        pass
+        # Propagate the timeout of an enclosing deadline.
+        _check_scopes()
     return done, list(filter(bool, pending))
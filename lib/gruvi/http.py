@@ -51,7 +51,9 @@ identity function (``lambda x: x``).
 
 from __future__ import absolute_import, print_function
 
+import os
 import re
+import stat
 import time
 import functools
 import six
@@ -380,6 +382,12 @@ def create_chunk(buf):
     return chunk
 
 
+def create_chunk_buffers(buf):
+    """Like :func:`create_chunk`, but return the chunk as a list of buffers
+    that can be passed to ``writelines()``. This avoids copying *buf*."""
+    return [s2b('{:X}\r\n'.format(len(buf))), buf, b'\r\n']
+
+
 def create_chunked_body_end(trailers=None):
     """Create the ending that terminates a chunked body."""
     ending = bytearray()
@@ -579,8 +587,9 @@ class HttpRequest(object):
                                     .format(self._bytes_written, self._content_length))
         self._bytes_written += len(buf)
         if self._chunked:
-            buf = create_chunk(buf)
-        self._protocol.writer.write(buf)
+            self._protocol.writer.writelines(create_chunk_buffers(buf))
+        else:
+            self._protocol.writer.write(buf)
 
     @switchpoint
     def end_request(self):
@@ -615,6 +624,45 @@ class ErrorStream(object):
             self.write(line)
 
 
+class FileWrapper(object):
+    """Passed to the WSGI application as environ['wsgi.file_wrapper'].
+
+    When an application returns an instance of this class wrapping a regular
+    file, the file is sent with :meth:`Transport.sendfile`. Otherwise it is
+    iterated over in blocks of *blksize* bytes.
+    """
+
+    __slots__ = ['filelike', 'blksize']
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.blksize)
+            if not data:
+                break
+            yield data
+
+    def fileno(self):
+        # Return the file descriptor if the file can be used with sendfile(),
+        # or None otherwise.
+        try:
+            fd = self.filelike.fileno()
+            if not stat.S_ISREG(os.fstat(fd).st_mode):
+                return None
+            # We send from the current position so it must be known.
+            self.filelike.tell()
+        except (AttributeError, OSError, IOError, ValueError):
+            return None
+        return fd
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+
 class WsgiAdapter(object):
     """WSGI Adapter"""
 
@@ -631,6 +679,10 @@ class WsgiAdapter(object):
     @switchpoint
     def send_headers(self):
         # Send out the actual headers.
+        self._protocol.writer.write(self.create_header())
+
+    def create_header(self):
+        # Create the response header. After this, the headers count as sent.
         # We need to figure out the transfer encoding of the body that will
         # follow the header. Here's what we do:
         #  - If we know the body length, don't use any TE.
@@ -672,8 +724,8 @@ class WsgiAdapter(object):
         if date is None:
             self._headers.append(('Date', rfc1123_date()))
         header = create_response(version, self._status, self._headers)
-        self._protocol.writer.write(header)
         self._headers_sent = True
+        return header
 
     def start_response(self, status, headers, exc_info=None):
         # Callable to be passed to the WSGI application.
@@ -702,11 +754,34 @@ class WsgiAdapter(object):
             return
         if not self._status:
             raise HttpError('WSGI handler did not call start_response()')
-        if not self._headers_sent:
-            self.send_headers()
+        # Send the header and the (framed) data with a single vectored write.
+        bufs = [] if self._headers_sent else [self.create_header()]
         if self._chunked:
-            data = create_chunk(data)
-        self._protocol.writer.write(data)
+            bufs.extend(create_chunk_buffers(data))
+        else:
+            bufs.append(data)
+        self._protocol.writer.writelines(bufs)
+
+    @switchpoint
+    def send_file(self, wrapper):
+        # Send the file from a FileWrapper using sendfile(). Return False if
+        # this is not possible and the wrapper should be iterated instead.
+        if not self._status:
+            raise HttpError('WSGI handler did not call start_response()')
+        fd = wrapper.fileno()
+        if fd is None or self._headers_sent or not hasattr(self._transport, 'sendfile'):
+            return False
+        offset = wrapper.filelike.tell()
+        count = max(0, os.fstat(fd).st_size - offset)
+        clen = get_header(self._headers, 'Content-Length')
+        if clen is not None:
+            count = min(count, int(clen))
+        else:
+            self._body_len = count
+        self.send_headers()
+        if count:
+            self._protocol.writer.sendfile(fd, offset, count)
+        return True
 
     @switchpoint
     def end_response(self):
@@ -746,8 +821,9 @@ class WsgiAdapter(object):
             # Prevent chunking in this common case:
             if isinstance(result, list) and len(result) == 1:
                 self._body_len = len(result[0])
-            for chunk in result:
-                self.write(chunk)
+            if not (isinstance(result, FileWrapper) and self.send_file(result)):
+                for chunk in result:
+                    self.write(chunk)
             self.end_response()
         finally:
             if hasattr(result, 'close'):
@@ -806,6 +882,7 @@ class WsgiAdapter(object):
         env['wsgi.multiprocess'] = True
         env['wsgi.run_once'] = False
         env['wsgi.charset'] = m.charset
+        env['wsgi.file_wrapper'] = FileWrapper
         # Gruvi specific variables
         env['gruvi.sockname'] = self._sockname
         env['gruvi.peername'] = self._peername
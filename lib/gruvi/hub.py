@@ -14,16 +14,32 @@ import threading
 import traceback
 import functools
 
+from timeit import default_timer
+
 import pyuv
 import fibers
 
 from . import logging, compat
-from .errors import Timeout
+from .errors import Timeout, Cancelled
+from .local import local
 from .callbacks import add_callback, run_callbacks
 from .poll import Poller
+from .timers import TimerWheel
+from .watchdog import Watchdog
+from .profiler import Profiler
+from .idlegc import IdleGC
 
 __all__ = ['switchpoint', 'assert_no_switchpoints', 'switch_back', 'get_hub',
-           'Hub', 'sleep']
+           'Hub', 'sleep', 'PRIORITY_NORMAL', 'PRIORITY_LOW', 'cancel_scope',
+           'deadline']
+
+#: Priority for callbacks and fibers that are latency sensitive. This is the
+#: default, and is used for all I/O wakeups.
+PRIORITY_NORMAL = 0
+
+#: Priority for background callbacks and fibers. These run only after the
+#: normal priority callbacks that were ready in the same loop iteration.
+PRIORITY_LOW = 1
 
 
 def switchpoint(func):
@@ -45,6 +61,8 @@ def switchpoint(func):
             raise RuntimeError('cannot call switchpoint from the Hub')
         if hub._noswitch_depth:
             raise AssertionError('switchpoint called from no-switch section')
+        if hub._active_scopes:
+            _check_scopes()
         return func(*args, **kwargs)
     switchpoint.__switchpoint__ = True
     # The py27 version of functools.wraps() doesn't store the wrapped function
@@ -108,15 +126,20 @@ class switch_back(object):
           hub.switch()
     """
 
-    __slots__ = ('_timeout', '_hub', '_fiber', '_timer', '_callbacks', '_lock')
+    __slots__ = ('_timeout', '_hub', '_fiber', '_timer', '_callbacks', '_lock',
+                 '_precise', '_scopes', '_prev')
 
-    def __init__(self, timeout=None, hub=None, lock=None):
+    def __init__(self, timeout=None, hub=None, lock=None, precise=False):
         """
         The *timeout* argument can be used to force a timeout after this many
         seconds. It can be an int or a float. If a timeout happens,
         :meth:`Hub.switch` will raise a :class:`Timeout` exception in the
         origin fiber. The default is None, meaning there is no timeout.
 
+        By default the timeout is implemented using the hub's shared
+        :attr:`~Hub.timers` wheel, which is cheap but has a coarse resolution.
+        If *precise* is true, a dedicated :class:`pyuv.Timer` is used instead.
+
         The *hub* argument can be used to specify an alternate hub to use.
         This argument is used by the unit tests and should normally not be
         needed.
@@ -126,6 +149,9 @@ class switch_back(object):
         self._fiber = fibers.current()
         self._callbacks = None
         self._lock = lock
+        self._precise = precise
+        self._timer = None
+        self._scopes = None
 
     @property
     def fiber(self):
@@ -148,7 +174,8 @@ class switch_back(object):
         the event loop runs."""
         if self._hub is None or not self._fiber.is_alive():
             return
-        self._hub.run_callback(self._fiber.switch, value)
+        priority = getattr(self._fiber, 'priority', PRIORITY_NORMAL)
+        self._hub.run_callback(self._fiber.switch, value, priority=priority)
         self._hub = self._fiber = None  # switch back at most once!
 
     def throw(self, typ, val=None, tb=None):
@@ -159,7 +186,8 @@ class switch_back(object):
         # cancel() method.
         if self._hub is None or not self._fiber.is_alive():
             return
-        self._hub.run_callback(self._fiber.throw, typ, val, tb)
+        priority = getattr(self._fiber, 'priority', PRIORITY_NORMAL)
+        self._hub.run_callback(self._fiber.throw, typ, val, tb, priority=priority)
         self._hub = self._fiber = None  # switch back at most once!
 
     def add_cleanup(self, callback, *args):
@@ -167,8 +195,34 @@ class switch_back(object):
         positional arguments when the context manager exists."""
         add_callback(self, callback, args)
 
+    def _deliver(self, exc):
+        # Throw an exception from an enclosing cancel_scope.
+        if self._lock:
+            self._lock.acquire()
+        try:
+            self.throw(type(exc), exc)
+        finally:
+            if self._lock:
+                self._lock.release()
+
     def __enter__(self):
-        if self._timeout is not None:
+        timeout = self._timeout
+        if self._hub._active_scopes:
+            scopes = _get_scope_stack()
+            if scopes is not None and scopes.scopes:
+                # If a scope already expired, fail right away. Otherwise
+                # register with the enclosing scopes, so that they can
+                # interrupt us.
+                exc = scopes.exception()
+                if exc is not None:
+                    raise exc
+                self._scopes = scopes
+                self._prev, scopes.switcher = scopes.switcher, self
+                # No need for a timer of our own if a scope expires first.
+                remaining = scopes.remaining()
+                if timeout is not None and remaining is not None and remaining <= timeout:
+                    timeout = None
+        if timeout is not None:
             # There are valid scenarios for a Gruvi application where the loop
             # will not run for a long time. For example, a single fiber program
             # that only calls out to the loop to perform a blocking action.
@@ -176,14 +230,20 @@ class switch_back(object):
             # to make sure the loop's time is up to date. That's why we call
             # update_time().
             self._hub.loop.update_time()
-            self._timer = pyuv.Timer(self._hub.loop)
-            self._timer.start(self, self._timeout, 0)
+            if self._precise:
+                self._timer = pyuv.Timer(self._hub.loop)
+                self._timer.start(self, timeout, 0)
+            else:
+                self._timer = self._hub.timers.add(timeout, self)
         return self
 
     def __exit__(self, *exc_info):
-        if self._timeout is not None:
+        if self._timer is not None:
             self._timer.close()
             self._timer = None
+        if self._scopes is not None:
+            self._scopes.switcher = self._prev
+            self._scopes = self._prev = None
         run_callbacks(self)
 
     def __call__(self, *args, **kwargs):
@@ -195,7 +255,7 @@ class switch_back(object):
         if self._lock:
             self._lock.acquire()
         try:
-            if self._timeout is not None and args == (self._timer,):
+            if self._timer is not None and args == (self._timer,):
                 self._timeout = Timeout('timeout in switch_back() block')
                 self.throw(Timeout, self._timeout)
             else:
@@ -205,6 +265,242 @@ class switch_back(object):
                 self._lock.release()
 
 
+class _ScopeStack(object):
+    # The active cancel scopes of a fiber, and its active switch_back.
+
+    __slots__ = ('scopes', 'switcher')
+
+    def __init__(self):
+        self.scopes = []
+        self.switcher = None
+
+    def exception(self):
+        # Return the exception of the outermost scope that was cancelled.
+        for scope in self.scopes:
+            if scope._exception is not None:
+                return scope._exception
+
+    def remaining(self):
+        # Return the time until the first scope expires, or None.
+        remaining = None
+        for scope in self.scopes:
+            left = scope.remaining
+            if left is not None and (remaining is None or left < remaining):
+                remaining = left
+        return remaining
+
+
+_scope_state = local()
+
+def _get_scope_stack(create=False):
+    # Return the _ScopeStack for the current fiber.
+    stack = getattr(_scope_state, 'stack', None)
+    if stack is None and create:
+        stack = _scope_state.stack = _ScopeStack()
+    return stack
+
+
+def _check_scopes():
+    # Raise the exception of a cancelled scope of the current fiber, if any.
+    # This makes switchpoints that do not block fail in a cancelled scope.
+    stack = getattr(_scope_state, 'stack', None)
+    if stack is not None and stack.scopes:
+        exc = stack.exception()
+        if exc is not None:
+            raise exc
+
+
+class cancel_scope(object):
+    """A context manager that allows a block of code to be cancelled, either
+    explicitly or when a deadline expires.
+
+    A cancel scope applies to all switchpoints that are called in its block by
+    the current fiber. When the scope is cancelled, the switchpoint that the
+    fiber is blocked in raises :class:`~gruvi.Cancelled`. Every switchpoint
+    that is called afterwards in the block raises it again, so cancellation
+    cannot be lost by code that catches and ignores the exception. When the
+    exception reaches the end of the block, it is swallowed and execution
+    continues after the block::
+
+      with cancel_scope(timeout=10) as scope:
+          result = client.call_method('slow')
+      if scope.cancelled_caught:
+          result = None
+
+    A scope with a *timeout* uses a single timer for the entire block,
+    regardless of how many switchpoints are called in it. Switchpoints that
+    have their own timeout do not start a timer if the scope expires first.
+
+    Scopes can be nested. A scope is cancelled if any enclosing scope is
+    cancelled. See also :class:`deadline`.
+    """
+
+    __slots__ = ('_hub', '_timeout', '_deadline', '_timer', '_exception',
+                 '_stack', '_cancelled_caught')
+
+    def __init__(self, timeout=None, hub=None):
+        """
+        The *timeout* argument specifies an optional timeout in seconds, after
+        which the scope is cancelled. The deadline is computed when the block
+        is entered.
+
+        The *hub* argument can be used to specify an alternate hub to use.
+        This argument is used by the unit tests and should normally not be
+        needed.
+        """
+        self._hub = hub or get_hub()
+        self._timeout = timeout
+        self._deadline = None
+        self._timer = None
+        self._exception = None
+        self._stack = None
+        self._cancelled_caught = False
+
+    @property
+    def remaining(self):
+        """The number of seconds until the deadline expires, or ``None`` if
+        the scope has no deadline."""
+        if self._deadline is None:
+            return
+        return max(0.0, (self._deadline - self._hub.loop.now()) / 1000.0)
+
+    @property
+    def cancelled(self):
+        """Whether the scope was cancelled or its deadline expired."""
+        return self._exception is not None
+
+    @property
+    def cancelled_caught(self):
+        """Whether the block was exited because the scope was cancelled."""
+        return self._cancelled_caught
+
+    def _timeout_exception(self):
+        return Cancelled('cancel_scope() deadline expired')
+
+    def cancel(self, exc=None):
+        """Cancel the scope.
+
+        If the fiber is blocked in a switchpoint inside the scope, it is
+        interrupted with the next iteration of the event loop. This method may
+        be called from a different fiber than the one that entered the scope.
+        """
+        if self._exception is not None:
+            return
+        if exc is None:
+            exc = Cancelled('cancelled by cancel_scope.cancel()')
+        self._exception = exc
+        if self._timer is not None:
+            self._timer.close()
+            self._timer = None
+        switcher = self._stack.switcher if self._stack else None
+        if switcher is not None:
+            switcher._deliver(exc)
+
+    def _on_timer(self, timer):
+        self._timer = None
+        self.cancel(self._timeout_exception())
+
+    def __enter__(self):
+        if self._stack is not None:
+            raise RuntimeError('cancel scope already entered')
+        self._stack = _get_scope_stack(True)
+        self._stack.scopes.append(self)
+        self._hub._active_scopes += 1
+        if self._timeout is not None and self._exception is None:
+            self._hub.loop.update_time()
+            self._deadline = self._hub.loop.now() + int(self._timeout * 1000)
+            self._timer = self._hub.timers.add(self._timeout, self._on_timer)
+        return self
+
+    def __exit__(self, typ, exc, tb):
+        if self._timer is not None:
+            self._timer.close()
+            self._timer = None
+        self._stack.scopes.remove(self)
+        self._stack = None
+        self._hub._active_scopes -= 1
+        if exc is not None and exc is self._exception and isinstance(exc, Cancelled):
+            self._cancelled_caught = True
+            return True
+
+
+class deadline(cancel_scope):
+    """A cancel scope that fails with a :class:`~gruvi.Timeout` when its
+    deadline expires.
+
+    This is the same as :class:`cancel_scope`, except that when the timeout
+    expires, the switchpoints in the block raise :class:`~gruvi.Timeout`
+    instead of :class:`~gruvi.Cancelled`, and the exception is propagated out
+    of the block::
+
+      with deadline(5):
+          for name in names:
+              results.append(client.call_method('lookup', name))
+    """
+
+    __slots__ = ()
+
+    def __init__(self, seconds, hub=None):
+        super(deadline, self).__init__(seconds, hub)
+
+    def _timeout_exception(self):
+        return Timeout('deadline expired')
+
+
+class HubStats(object):
+    """Event loop statistics for a :class:`Hub`.
+
+    An instance of this class is created by :meth:`Hub.enable_stats`. There is
+    no public constructor.
+    """
+
+    __slots__ = ('started', 'iterations', 'callbacks', 'max_callbacks',
+                 'max_queue_depth', 'callbacks_time', 'loop_time', 'switches',
+                 'budget_exhausted')
+
+    def __init__(self):
+        self.started = default_timer()
+        self.iterations = 0
+        self.callbacks = 0
+        self.max_callbacks = 0
+        self.max_queue_depth = 0
+        self.callbacks_time = 0.0
+        self.loop_time = 0.0
+        self.switches = 0
+        self.budget_exhausted = 0
+
+    def add_iteration(self, ncallbacks, callbacks_time, loop_time):
+        """Account for one iteration of the event loop in which *ncallbacks*
+        callbacks were run."""
+        self.iterations += 1
+        self.callbacks += ncallbacks
+        if ncallbacks > self.max_callbacks:
+            self.max_callbacks = ncallbacks
+        self.callbacks_time += callbacks_time
+        self.loop_time += loop_time
+
+    def add_queue_depth(self, depth):
+        """Account for a callback queue depth of *depth*."""
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def as_dict(self):
+        """Return the statistics as a dictionary."""
+        elapsed = max(1e-9, default_timer() - self.started)
+        iterations = max(1, self.iterations)
+        return {'elapsed': elapsed,
+                'iterations': self.iterations,
+                'callbacks': self.callbacks,
+                'callbacks_per_iteration': self.callbacks / float(iterations),
+                'max_callbacks_per_iteration': self.max_callbacks,
+                'max_queue_depth': self.max_queue_depth,
+                'callbacks_time': self.callbacks_time,
+                'loop_time': self.loop_time,
+                'switches': self.switches,
+                'switches_per_second': self.switches / elapsed,
+                'budget_exhausted': self.budget_exhausted}
+
+
 _local = threading.local()
 
 def get_hub():
@@ -228,6 +524,14 @@ class Hub(fibers.Fiber):
     # The hub is used by fibers to pause themselves until a wake-up condition
     # becomes true. See the documentation for switch_back for details
 
+    #: The default maximum number of callbacks to run per loop iteration.
+    #: ``None`` means no limit. See :meth:`set_callback_budget`.
+    default_callback_budget = None
+
+    #: The default maximum time in seconds to spend running callbacks per loop
+    #: iteration. ``None`` means no limit. See :meth:`set_callback_budget`.
+    default_time_budget = None
+
     def __init__(self):
         if self.parent is not None:
             raise RuntimeError('Hub must be created in the root fiber')
@@ -242,6 +546,33 @@ class Hub(fibers.Fiber):
         # need a thread-safe append, and we don't need to remove things from
         # the middle.
         self._callbacks = collections.deque()
+        # Queue for PRIORITY_LOW callbacks. The index in _queues is the
+        # priority.
+        self._background = collections.deque()
+        self._queues = (self._callbacks, self._background)
+        # Callbacks added with run_when_idle(). These run at most once per
+        # idle period: after they have run, the loop needs to block at least
+        # once before they run again (see run()).
+        self._idle_callbacks = collections.deque()
+        self._idle_armed = True
+        self._idle_gc = None
+        # Number of active cancel scopes. Allows switch_back to skip looking
+        # for scopes if there are none.
+        self._active_scopes = 0
+        self._callback_budget = self.default_callback_budget
+        self._time_budget = self.default_time_budget
+        # Whether a wakeup of the loop is pending. Only the first callback
+        # that is queued after the queue is drained needs to interrupt the
+        # loop. See run_callback().
+        self._interrupt_pending = False
+        self._wakeups = 0
+        self._wakeups_coalesced = 0
+        # Event loop statistics. None means disabled, which makes the check in
+        # the hot paths a single attribute load.
+        self._stats = None
+        self._live_fibers = 0
+        self._watchdog = None
+        self._profiler = None
         # Thread IDs may be recycled when a thread exits. But as long as the
         # hub is alive, it won't be recycled so in that case we can use just
         # the ID as a check whether we are in the same thread or not.
@@ -257,6 +588,7 @@ class Hub(fibers.Fiber):
         self._log.debug('new Hub for {.name}', threading.current_thread())
         self._closing = False
         self._poll = Poller(self)
+        self._timers = TimerWheel(self._loop)
 
     @property
     def loop(self):
@@ -277,6 +609,13 @@ class Hub(fibers.Fiber):
         file descriptor readiness events."""
         return self._poll
 
+    @property
+    def timers(self):
+        """A centrally managed :class:`~gruvi.timers.TimerWheel` that
+        multiplexes coarse-grained timers onto a single libuv timer. It is
+        used by :class:`switch_back` and :func:`sleep` to implement timeouts."""
+        return self._timers
+
     def _on_sigint(self, h, signo):
         # SIGINT handler. Terminate the hub and switch back to the root.
         self._log.debug('SIGINT received, stopping loop')
@@ -329,16 +668,41 @@ class Hub(fibers.Fiber):
         # callbacks need to run (via _interrupt_loop()). After those are run,
         # we enter the libuv loop again.
         while True:
-            self._run_callbacks()
+            stats = self._stats
+            if stats is not None:
+                t0 = default_timer()
+            ncallbacks = self._run_callbacks()
             if self._closing:
                 break
-            # If the Python callbacks run above scheduled further callbacks, do
-            # not wait for new events in the libuv loop. This would cause the
-            # Pyton callbacks to potentially be delayed indefinitely.
-            mode = pyuv.UV_RUN_NOWAIT if len(self._callbacks) else pyuv.UV_RUN_DEFAULT
+            # If the Python callbacks run above scheduled further callbacks, or
+            # if the callback budget was exhausted, do not wait for new events
+            # in the libuv loop. This would cause the Pyton callbacks to
+            # potentially be delayed indefinitely.
+            mode = pyuv.UV_RUN_NOWAIT if self._callbacks or self._background \
+                        else pyuv.UV_RUN_DEFAULT
+            # If we are about to block and there is idle work, first poll for
+            # I/O without blocking. Only if that doesn't make any callbacks
+            # ready are we really idle.
+            idle = mode == pyuv.UV_RUN_DEFAULT and self._idle_armed \
+                        and len(self._idle_callbacks) > 0
+            if idle:
+                mode = pyuv.UV_RUN_NOWAIT
+            if stats is not None:
+                t1 = default_timer()
             with assert_no_switchpoints(self):
                 self._loop.run(mode)
+            if stats is not None:
+                stats.add_iteration(ncallbacks, t1 - t0, default_timer() - t1)
+            if mode == pyuv.UV_RUN_DEFAULT:
+                self._idle_armed = True
+            elif idle and not (self._callbacks or self._background):
+                self._run_idle_callbacks()
+                self._idle_armed = False
         # Hub is going to exit at this point. Clean everyting up.
+        self.disable_watchdog()
+        self.disable_profiler()
+        self.disable_idle_gc()
+        self._timers.close()
         for handle in self._loop.handles:
             if not handle.closed:
                 handle.close()
@@ -350,6 +714,8 @@ class Hub(fibers.Fiber):
             del _local.hub
         self._loop = None
         self._callbacks.clear()
+        self._background.clear()
+        self._idle_callbacks.clear()
         self._async = None
         self._sigint = None
         self._log.debug('hub fiber terminated')
@@ -375,45 +741,348 @@ class Hub(fibers.Fiber):
             raise RuntimeError('cannot switch to myself')
         elif compat.get_thread_ident() != self._thread:
             raise RuntimeError('cannot switch from a different thread')
+        if self._stats is not None:
+            self._stats.switches += 1
+        if self._profiler is not None:
+            self._profiler.switch(self.current())
         value = super(Hub, self).switch()
         if isinstance(value, Exception):
             raise value
         return value
 
     def _run_callbacks(self):
-        """Run registered callbacks."""
-        for i in range(len(self._callbacks)):
-            callback, args = self._callbacks.popleft()
-            try:
-                callback(*args)
-            except Exception:
-                self._log.exception('Ignoring exception in callback:')
+        """Run registered callbacks. Return the number of callbacks run."""
+        # Clear the pending flag *before* looking at the queue. A callback
+        # that is added after this point will cause a new interrupt.
+        self._interrupt_pending = False
+        watchdog = self._watchdog
+        budget = self._callback_budget
+        deadline = self._time_budget
+        if deadline is not None:
+            deadline += default_timer()
+        nrun = 0
+        exhausted = False
+        # Run the queues in priority order. Only callbacks that were queued
+        # before we started are considered, so that a callback that queues
+        # another callback cannot starve the libuv loop. The queue lengths are
+        # all taken up front. Otherwise a low priority callback that is queued
+        # by a fiber running in this pass would run before a normal priority
+        # one that is queued at the same time. At least one callback of each
+        # queue is run, so that background work is never starved completely.
+        ready_counts = [len(queue) for queue in self._queues]
+        for queue, ready in zip(self._queues, ready_counts):
+            todo = ready
+            if budget is not None:
+                todo = min(ready, max(1, budget - nrun))
+            exhausted = exhausted or todo < ready
+            for i in range(todo):
+                if i > 0 and deadline is not None and default_timer() > deadline:
+                    exhausted = True
+                    break
+                callback, args = queue.popleft()
+                if watchdog is not None:
+                    watchdog.enter(callback)
+                try:
+                    callback(*args)
+                except Exception:
+                    self._log.exception('Ignoring exception in callback:')
+                if watchdog is not None:
+                    watchdog.leave()
+                nrun += 1
+        if exhausted and self._stats is not None:
+            self._stats.budget_exhausted += 1
+        return nrun
 
-    def run_callback(self, callback, *args):
+    def run_callback(self, callback, *args, **kwargs):
         """Queue a callback.
 
         The *callback* will be called with positional arguments *args* in the
-        next iteration of the event loop. If you add multiple callbacks, they
-        will be called in the order that you added them. The callback will run
-        in the Hub's fiber.
+        next iteration of the event loop. If you add multiple callbacks with
+        the same priority, they will be called in the order that you added
+        them. The callback will run in the Hub's fiber.
+
+        The *priority* keyword argument can be used to specify the priority of
+        the callback. It can be :data:`PRIORITY_NORMAL` (the default) or
+        :data:`PRIORITY_LOW`. Low priority callbacks run after normal priority
+        callbacks, and are the first to be postponed to a later loop iteration
+        if the callback budget is exhausted. See :meth:`set_callback_budget`.
 
         This method is thread-safe: it is allowed to queue a callback from a
         different thread than the one running the Hub.
         """
+        priority = kwargs.pop('priority', PRIORITY_NORMAL)
+        if kwargs:
+            raise TypeError('unexpected keyword arguments: {}'.format(', '.join(kwargs)))
         if self._loop is None:
             raise RuntimeError('hub is closed')
         elif not callable(callback):
             raise TypeError('"callback": expecting a callable')
-        self._callbacks.append((callback, args))  # thread-safe
+        elif priority not in (PRIORITY_NORMAL, PRIORITY_LOW):
+            raise ValueError('unknown priority: {!r}'.format(priority))
+        queue = self._queues[priority]
+        queue.append((callback, args))  # thread-safe
+        if self._stats is not None:
+            self._stats.add_queue_depth(len(queue))
+        # Coalesce wakeups: if a wakeup is already pending, the callback will
+        # be picked up by the same call to _run_callbacks(). Under the GIL this
+        # is race free because _run_callbacks() clears the flag before it looks
+        # at the queue. The counters are statistics only and are not updated
+        # atomically when called from multiple threads.
+        if self._interrupt_pending:
+            self._wakeups_coalesced += 1
+            return
+        self._interrupt_pending = True
+        self._wakeups += 1
         self._interrupt_loop()
 
+    def _run_idle_callbacks(self):
+        # Run the idle callbacks that are queued. Stop as soon as a regular
+        # callback becomes ready, because then we are not idle anymore.
+        for i in range(len(self._idle_callbacks)):
+            if self._callbacks or self._background:
+                break
+            callback, args = self._idle_callbacks.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                self._log.exception('Ignoring exception in idle callback:')
+
+    def run_when_idle(self, callback, *args):
+        """Queue a callback to run when the hub is idle.
+
+        The *callback* will be called once with positional arguments *args*,
+        when there are no other callbacks ready to run and no I/O events
+        pending, i.e. when the event loop would otherwise block. Use this for
+        low priority work that should not add latency to network I/O.
+
+        Idle callbacks run at most once per idle period. If an idle callback
+        queues itself again, it will run after the event loop has blocked for
+        new events at least once. This prevents idle work from turning into a
+        busy loop.
+
+        This method must be called from the thread that runs the hub.
+        """
+        if self._loop is None:
+            raise RuntimeError('hub is closed')
+        elif not callable(callback):
+            raise TypeError('"callback": expecting a callable')
+        self._idle_callbacks.append((callback, args))
+
+    @property
+    def idle_gc(self):
+        """The active :class:`~gruvi.idlegc.IdleGC`, or ``None`` if idle
+        garbage collection is not enabled."""
+        return self._idle_gc
+
+    def enable_idle_gc(self, max_delay=None):
+        """Move cyclic garbage collection to idle periods.
+
+        This disables the automatic garbage collector of the :mod:`gc` module,
+        and instead runs collections when the hub is idle. If the hub has not
+        been idle for *max_delay* seconds while a collection is due, then a
+        collection is forced. See :class:`~gruvi.idlegc.IdleGC` for details.
+
+        Only one hub per process should enable this. The return value is the
+        new :class:`~gruvi.idlegc.IdleGC` instance.
+        """
+        self.disable_idle_gc()
+        self._idle_gc = IdleGC(self, max_delay)
+        return self._idle_gc
+
+    def disable_idle_gc(self):
+        """Restore automatic garbage collection."""
+        if self._idle_gc is None:
+            return
+        self._idle_gc.close()
+        self._idle_gc = None
+
+    @property
+    def callback_budget(self):
+        """A ``(count, time)`` tuple with the current callback budget. See
+        :meth:`set_callback_budget`."""
+        return (self._callback_budget, self._time_budget)
+
+    def set_callback_budget(self, count=None, time=None):
+        """Limit the work done by callbacks in a single loop iteration.
+
+        By default, the hub runs all callbacks that are ready before it polls
+        for I/O again. When many fibers are ready, this delays new I/O events
+        such as incoming connections and data. Setting a budget bounds this
+        delay at the cost of delaying some callbacks to the next iteration.
+
+        The *count* argument specifies the maximum number of callbacks, and the
+        *time* argument the maximum time in seconds, to spend running
+        callbacks per iteration. Either can be ``None`` for no limit. Normal
+        priority callbacks always run before low priority ones. At least one
+        callback of each priority is run per iteration, so that no priority is
+        starved.
+        """
+        if count is not None and count < 1:
+            raise ValueError('count must be at least 1')
+        self._callback_budget = count
+        self._time_budget = time
+
+    def enable_stats(self):
+        """Start collecting event loop statistics.
+
+        If statistics were already enabled, the counters are reset. When
+        statistics are disabled (the default), the overhead of the
+        instrumentation is a single attribute check per loop iteration.
+        """
+        self._stats = HubStats()
+
+    def disable_stats(self):
+        """Stop collecting event loop statistics."""
+        self._stats = None
+
+    @property
+    def watchdog(self):
+        """The active :class:`~gruvi.watchdog.Watchdog`, or ``None`` if the
+        watchdog is not enabled."""
+        return self._watchdog
+
+    def enable_watchdog(self, threshold=0.1, interval=0.1, stacks=True):
+        """Enable the event loop watchdog.
+
+        The watchdog reports callbacks and fibers that run for more than
+        *threshold* seconds without yielding to the hub, and keeps a histogram
+        of the event loop lag, measured every *interval* seconds. If *stacks*
+        is true, the stack of a slow fiber is logged while it is still
+        running. See :class:`~gruvi.watchdog.Watchdog` for details.
+
+        If a watchdog was already enabled, it is replaced. The return value is
+        the new watchdog.
+        """
+        self.disable_watchdog()
+        self._watchdog = Watchdog(self, threshold, interval, stacks)
+        return self._watchdog
+
+    def disable_watchdog(self):
+        """Disable the event loop watchdog."""
+        if self._watchdog is None:
+            return
+        self._watchdog.close()
+        self._watchdog = None
+
+    @property
+    def profiler(self):
+        """The active :class:`~gruvi.profiler.Profiler`, or ``None`` if the
+        profiler is not enabled."""
+        return self._profiler
+
+    def enable_profiler(self, interval=0.01):
+        """Enable the per-fiber profiler.
+
+        The profiler measures CPU time, wall time and switch counts per fiber,
+        and samples the stack of the hub thread every *interval* seconds. See
+        :class:`~gruvi.profiler.Profiler` for details.
+
+        If a profiler was already enabled, it is replaced. The return value is
+        the new profiler.
+        """
+        self.disable_profiler()
+        self._profiler = Profiler(self, interval)
+        return self._profiler
+
+    def disable_profiler(self):
+        """Disable the per-fiber profiler.
+
+        The profiler that was active is returned, so that its data can still be
+        inspected. If no profiler was active, ``None`` is returned.
+        """
+        profiler, self._profiler = self._profiler, None
+        if profiler is not None:
+            profiler.close()
+        return profiler
+
+    def stats(self):
+        """Return a dictionary with statistics for this hub.
+
+        The following keys are always available:
+
+        =================================  ===================================
+        Name                               Description
+        =================================  ===================================
+        ``'wakeups'``                      Number of times
+                                           :meth:`run_callback` interrupted
+                                           the event loop.
+        ``'wakeups_coalesced'``            Number of times
+                                           :meth:`run_callback` did not need
+                                           to interrupt the event loop because
+                                           a wakeup was already pending.
+        ``'wakeup_pending'``               Whether a wakeup is currently
+                                           pending.
+        ``'live_fibers'``                  Number of fibers that have started
+                                           and not yet exited.
+        ``'handles'``                      A dictionary mapping libuv handle
+                                           type names to the number of active
+                                           handles of that type.
+        =================================  ===================================
+
+        If the watchdog is enabled, its statistics are available under the
+        ``'watchdog'`` key. See :meth:`~gruvi.watchdog.Watchdog.stats`.
+
+        If idle garbage collection is enabled, its statistics are available
+        under the ``'gc'`` key. See :meth:`~gruvi.idlegc.IdleGC.stats`.
+
+        The following keys are available only after :meth:`enable_stats` was
+        called. Times are in seconds.
+
+        =================================  ===================================
+        Name                               Description
+        =================================  ===================================
+        ``'elapsed'``                      Time since statistics were enabled.
+        ``'iterations'``                   Number of event loop iterations.
+        ``'callbacks'``                    Number of callbacks that were run.
+        ``'callbacks_per_iteration'``      Average number of callbacks run
+                                           per iteration.
+        ``'max_callbacks_per_iteration'``  Maximum number of callbacks run
+                                           in a single iteration.
+        ``'max_queue_depth'``              Maximum length of the callback
+                                           queue.
+        ``'callbacks_time'``               Time spent running callbacks.
+        ``'loop_time'``                    Time spent in the libuv loop,
+                                           which includes waiting for I/O.
+        ``'switches'``                     Number of switches to the hub.
+        ``'switches_per_second'``          Average number of switches to the
+                                           hub per second.
+        ``'budget_exhausted'``             Number of iterations in which
+                                           callbacks were postponed because
+                                           the callback budget was exhausted.
+        =================================  ===================================
+        """
+        stats = self._stats.as_dict() if self._stats is not None else {}
+        stats['wakeups'] = self._wakeups
+        stats['wakeups_coalesced'] = self._wakeups_coalesced
+        stats['wakeup_pending'] = self._interrupt_pending
+        stats['live_fibers'] = self._live_fibers
+        if self._watchdog is not None:
+            stats['watchdog'] = self._watchdog.stats()
+        if self._idle_gc is not None:
+            stats['gc'] = self._idle_gc.stats()
+        handles = stats['handles'] = {}
+        if self._loop is not None:
+            for handle in self._loop.handles:
+                if handle.active:
+                    name = type(handle).__name__
+                    handles[name] = handles.get(name, 0) + 1
+        return stats
+
 
 @switchpoint
-def sleep(secs):
-    """Sleep for *secs* seconds. The *secs* argument can be an int or a float."""
+def sleep(secs, precise=False):
+    """Sleep for *secs* seconds. The *secs* argument can be an int or a float.
+
+    By default the sleep is implemented using the hub's shared timer wheel and
+    may last up to one wheel tick longer than requested. Pass *precise* to use
+    a dedicated libuv timer instead.
+    """
     hub = get_hub()
+    switcher = switch_back(secs, precise=precise)
     try:
-        with switch_back(secs):
+        with switcher:
             hub.switch()
-    except Timeout:
-        pass
+    except Timeout as e:
+        # Propagate the timeout of an enclosing deadline.
+        if e is not switcher.timeout:
+            raise
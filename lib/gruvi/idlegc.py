@@ -0,0 +1,134 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+from __future__ import absolute_import, print_function
+
+import gc
+
+from timeit import default_timer
+
+import pyuv
+
+from . import logging
+
+__all__ = []
+
+
+class IdleGC(object):
+    """Garbage collection during idle periods.
+
+    The cyclic garbage collector in the :mod:`gc` module runs whenever the
+    number of allocations exceeds a threshold. In a busy server this tends to
+    happen in the middle of a burst of requests, and a collection of the oldest
+    generation can easily take tens of milliseconds. This shows up directly as
+    a spike in the tail latency.
+
+    This class disables the automatic collector and instead runs collections
+    from an idle callback (see :meth:`Hub.run_when_idle`). The same thresholds
+    as the automatic collector are used to decide which generation to collect,
+    so the amount of work does not change, only its timing.
+
+    As a safeguard, if a collection is due but the hub has not been idle for
+    *max_delay* seconds, the collection is forced anyway. This bounds the
+    amount of garbage that can build up under sustained load, and with that the
+    memory growth and the length of the eventual pause.
+
+    Normally you do not instantiate this class yourself but use
+    :meth:`Hub.enable_idle_gc`.
+    """
+
+    #: The default for *max_delay*, in seconds.
+    default_max_delay = 1.0
+
+    def __init__(self, hub, max_delay=None):
+        self._hub = hub
+        self._max_delay = self.default_max_delay if max_delay is None else max_delay
+        self._log = logging.get_logger()
+        self._was_enabled = gc.isenabled()
+        gc.disable()
+        self._last_collect = default_timer()
+        self._collections = [0, 0, 0]
+        self._forced = 0
+        self._total_time = 0.0
+        self._max_pause = 0.0
+        self._closed = False
+        self._timer = pyuv.Timer(hub.loop)
+        self._timer.start(self._on_timer, self._max_delay, self._max_delay)
+        self._timer._system_handle = True
+        hub.run_when_idle(self._on_idle)
+
+    @property
+    def max_delay(self):
+        """The maximum time a due collection is postponed waiting for the hub
+        to become idle."""
+        return self._max_delay
+
+    def _due_generation(self):
+        # Return the generation that the automatic collector would collect
+        # now, or None.
+        counts = gc.get_count()
+        thresholds = gc.get_threshold()
+        for gen in (2, 1, 0):
+            if thresholds[gen] and counts[gen] >= thresholds[gen]:
+                return gen
+
+    def collect(self, generation=2):
+        """Collect *generation* and update the statistics."""
+        t0 = default_timer()
+        gc.collect(generation)
+        elapsed = default_timer() - t0
+        self._last_collect = t0
+        self._collections[generation] += 1
+        self._total_time += elapsed
+        if elapsed > self._max_pause:
+            self._max_pause = elapsed
+        return elapsed
+
+    def _on_idle(self):
+        # Idle callback. Collect if a collection is due and re-arm.
+        if self._closed:
+            return
+        gen = self._due_generation()
+        if gen is not None:
+            self.collect(gen)
+        self._hub.run_when_idle(self._on_idle)
+
+    def _on_timer(self, handle):
+        # Safeguard timer.
+        if default_timer() - self._last_collect < self._max_delay:
+            return
+        gen = self._due_generation()
+        if gen is None:
+            return
+        elapsed = self.collect(gen)
+        self._forced += 1
+        self._log.debug('forced gen{} collection, took {:.3f} seconds', gen, elapsed)
+
+    def stats(self):
+        """Return a dictionary with garbage collection statistics.
+
+        The dictionary contains the keys ``'collections'`` (a list with the
+        number of collections per generation), ``'forced'`` (the number of
+        collections that were forced because the hub was not idle),
+        ``'total_time'`` and ``'max_pause'``. Times are in seconds.
+        """
+        return {'collections': list(self._collections),
+                'forced': self._forced,
+                'total_time': self._total_time,
+                'max_pause': self._max_pause}
+
+    def close(self):
+        """Stop collecting during idle periods and restore the automatic
+        collector if it was enabled before."""
+        if self._closed:
+            return
+        self._closed = True
+        if not self._timer.closed:
+            self._timer.close()
+        if self._was_enabled:
+            gc.enable()
@@ -465,6 +465,9 @@ class JsonRpcProtocol(MessageProtocol):
 class JsonRpcClient(Client):
     """A JSON-RPC :class:`~gruvi.Client`."""
 
+    # Small request/response messages suffer from Nagle's algorithm.
+    default_socket_options = {'nodelay': True}
+
     def __init__(self, handler=None, version=None, timeout=None):
         """
         The *handler* argument specifies an optional JSON-RPC message handler.
@@ -490,6 +493,7 @@ class JsonRpcServer(Server):
     """A JSON-RPC :class:`~gruvi.Server`."""
 
     max_connections = 1000
+    default_socket_options = {'nodelay': True}
 
     def __init__(self, handler, version=None, timeout=None):
         """
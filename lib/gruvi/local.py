@@ -9,10 +9,80 @@
 from __future__ import absolute_import, print_function
 
 import weakref
+import itertools
 import fibers
 
 __all__ = ['local']
 
+# Fiber-local data is stored in the "_locals" slot of each gruvi.Fiber. This
+# is a dictionary mapping the key of a local instance to a dictionary with
+# its attributes, or None if the fiber has no local data. Looking up a value
+# is therefore two dictionary lookups, without any hashing of the fiber.
+#
+# Fibers that are not a gruvi.Fiber (the root fiber and the hub) do not have
+# this slot. For these, the storage is kept in a WeakKeyDictionary.
+#
+# Because the data is keyed by an integer and not by the local instance, it
+# would outlive the instance. To prevent this, the fibers that have data for a
+# local instance are tracked in a WeakSet, and the data is removed from them
+# when the instance is garbage collected.
+
+_fallback = weakref.WeakKeyDictionary()
+_next_key = itertools.count()
+
+# Keys of the local instances whose data is inherited by new fibers.
+_inherited = set()
+
+# Maps the key of a local instance to the fibers that have data for it.
+_holders = {}
+
+
+def _get_storage(fiber, create=False):
+    # Return the fiber-local storage for *fiber*.
+    try:
+        storage = fiber._locals
+        if storage is None and create:
+            storage = fiber._locals = {}
+    except AttributeError:
+        storage = _fallback.get(fiber)
+        if storage is None and create:
+            storage = _fallback[fiber] = {}
+    return storage
+
+
+def inherit_locals(parent, child):
+    """Return the initial fiber-local storage for the fiber *child* that is
+    created by *parent*.
+
+    This copies the data of the :class:`local` instances that were created
+    with *inherit* set. The return value is ``None`` if there's nothing to
+    inherit.
+    """
+    if not _inherited:
+        return
+    storage = _get_storage(parent)
+    if not storage:
+        return
+    inherited = dict((key, dict(storage[key])) for key in _inherited if storage.get(key))
+    for key in inherited:
+        _holders[key].add(child)
+    return inherited or None
+
+
+def _release(key, inherited=_inherited, holders=_holders, fallback=_fallback):
+    # Remove the data of the local instance with *key* from all fibers. This
+    # runs from local.__del__(), possibly while the interpreter is shutting
+    # down and the module globals are already cleared. Therefore everything
+    # that is needed is bound as a default argument.
+    inherited.discard(key)
+    for fiber in list(holders.pop(key, ())):
+        try:
+            storage = fiber._locals
+        except AttributeError:
+            storage = fallback.get(fiber)
+        if storage:
+            storage.pop(key, None)
+
 
 class local(object):
     """Fiber-local data.
@@ -24,25 +94,48 @@ class local(object):
         mydata.x = 10
 
     Attributes have a value or are unset independently for each fiber.
+
+    If *inherit* is true, then a new fiber starts out with a copy of the
+    attributes of the fiber that created it. This is useful to propagate
+    context like a request ID to fibers that are spawned to handle part of a
+    request. The copy is shallow, and changes made afterwards in either fiber
+    are not visible in the other.
+
+    The data is stored on the fiber itself, and is released when either the
+    fiber or the local instance is garbage collected.
     """
 
-    def __init__(self):
-        self.__dict__['_keys'] = weakref.WeakKeyDictionary()
+    __slots__ = ('_key',)
+
+    def __init__(self, inherit=False):
+        key = next(_next_key)
+        object.__setattr__(self, '_key', key)
+        _holders[key] = weakref.WeakSet()
+        if inherit:
+            _inherited.add(key)
+
+    def __del__(self, _release=_release):
+        _release(self._key)
 
     def __getattr__(self, key):
-        current = fibers.current()
+        storage = _get_storage(fibers.current())
         try:
-            return self._keys[current][key]
-        except KeyError:
+            return storage[self._key][key]
+        except (KeyError, TypeError):
             raise AttributeError(key)
 
     def __setattr__(self, key, value):
         current = fibers.current()
-        self._keys.setdefault(current, {})[key] = value
+        storage = _get_storage(current, True)
+        try:
+            storage[self._key][key] = value
+        except KeyError:
+            storage[self._key] = {key: value}
+            _holders[self._key].add(current)
 
     def __delattr__(self, key):
-        current = fibers.current()
+        storage = _get_storage(fibers.current())
         try:
-            del self._keys[current][key]
-        except KeyError:
+            del storage[self._key][key]
+        except (KeyError, TypeError):
             raise AttributeError(key)
@@ -0,0 +1,541 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+"""Prefork server.
+
+This module implements a supervisor process that forks a number of worker
+processes. Each worker runs its own hub and server, and accepts connections on
+listening sockets that are created by the supervisor and inherited over
+fork(), or that are passed to them by the supervisor. This is the way to use
+more than one CPU core for CPU heavy applications, because each process has its
+own GIL.
+
+This module is available on POSIX systems only.
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import time
+import errno
+import signal
+import socket
+import select
+import functools
+import collections
+
+import pyuv
+import six
+
+from . import logging, hub as hub_module
+from .hub import get_hub
+from .fibers import spawn
+from .address import saddr
+from .transports import TransportError
+from .transports import _socket_options, _check_socket_options, _setsockopt
+
+__all__ = ['Prefork']
+
+
+class _WorkerProcess(object):
+    # A worker process of a Prefork supervisor.
+
+    __slots__ = ('pid', 'slot', 'started', 'stopping', 'channel', 'buffer', 'sent',
+                 'received', 'active')
+
+    def __init__(self, pid, slot):
+        self.pid = pid
+        self.slot = slot
+        self.started = time.time()
+        self.stopping = False
+        self.channel = None
+        self.buffer = b''
+        self.sent = 0
+        self.received = 0
+        self.active = 0
+
+    @property
+    def load(self):
+        # The connections the worker reported as active, plus those that
+        # were passed to it but that it has not reported yet.
+        return self.active + self.sent - self.received
+
+
+class Prefork(object):
+    """A supervisor for a pool of pre-forked server processes.
+
+    The supervisor creates the listening sockets, and then forks a number of
+    worker processes that each create a :class:`~gruvi.Server` and accept
+    connections on the inherited sockets. The kernel distributes incoming
+    connections over the workers.
+
+    The kernel does not know how busy each worker is, however. If the cost of
+    a connection varies a lot, for example when long lived JSON-RPC or D-BUS
+    sessions are mixed with short HTTP requests, some workers may end up with
+    many more connections than others. In that case, pass ``dispatch=True``.
+    The supervisor then accepts all connections itself, and passes each
+    connection to the worker with the fewest active connections over an IPC
+    pipe. The workers report their number of active connections back over the
+    same pipe.
+
+    The supervisor restarts workers that exit unexpectedly. It responds to
+    the following signals:
+
+    ============  ===========================================================
+    Signal        Action
+    ============  ===========================================================
+    ``SIGTERM``,  Graceful shutdown. The workers stop accepting connections,
+    ``SIGINT``    and are given :attr:`graceful_timeout` seconds to finish
+                  the connections they have.
+    ``SIGHUP``    Rolling restart. The workers are replaced one by one. A new
+                  worker is started and waited for before the old one is
+                  stopped, so there is no interruption in service.
+    ============  ===========================================================
+
+    The supervisor itself does not use a hub. It must be run from the main
+    thread of a process that has not started the event loop yet.
+    """
+
+    #: The time in seconds a worker is given to finish its connections when
+    #: it is stopped.
+    graceful_timeout = 30
+
+    #: The minimum time in seconds between two starts of the same worker.
+    #: This prevents a fork loop if a worker crashes on startup. The initial
+    #: start of the workers is not delayed.
+    restart_delay = 1.0
+
+    #: The time in seconds to wait for a new worker to start listening.
+    startup_timeout = 30
+
+    #: The interval in seconds at which workers report their number of
+    #: active connections to the supervisor in dispatch mode.
+    report_interval = 0.05
+
+    def __init__(self, server_factory, workers=None, dispatch=False):
+        """
+        The *server_factory* argument must be a callable that creates a new
+        :class:`~gruvi.Server` instance, for example ``lambda:
+        HttpServer(app)``. It is called in each worker process.
+
+        The *workers* argument specifies the number of worker processes. The
+        default is the number of CPUs.
+
+        If *dispatch* is true, the supervisor accepts connections and passes
+        them to the least loaded worker. The default is to let the workers
+        accept connections themselves.
+        """
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('Prefork requires os.fork()')
+        self._server_factory = server_factory
+        self._nworkers = workers or len(pyuv.util.cpu_info())
+        self._dispatch = dispatch
+        self._loop = None
+        self._timer = None
+        self._handles = []
+        self._sockets = []
+        self._workers = {}
+        self._last_spawn = {}
+        self._stopping = False
+        self._restart = False
+        self._log = logging.get_logger(self)
+
+    @property
+    def addresses(self):
+        """The addresses the server is listening on."""
+        return [sock.getsockname() for sock, _ in self._sockets]
+
+    @property
+    def pids(self):
+        """The process IDs of the current workers."""
+        return sorted(self._workers)
+
+    def listen(self, address, ssl=False, ssl_args={}, family=0, flags=0, backlog=128,
+               **sockopts):
+        """Create listening sockets for *address*.
+
+        The address can be a string for a named pipe, or a ``(host, port)``
+        tuple. The *ssl* and *ssl_args* arguments are passed to
+        :meth:`Server.listen() <gruvi.Server.listen>` in the workers. See
+        :func:`~gruvi.create_server` for a description of all arguments.
+
+        This method may be called multiple times to listen on multiple
+        addresses. Unlike most methods in Gruvi, it does not use the hub and
+        blocks while resolving *address*.
+        """
+        _check_socket_options(sockopts)
+        kwargs = dict(sockopts, ssl=ssl, ssl_args=ssl_args, backlog=backlog)
+        if isinstance(address, six.string_types):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(address)
+            self._set_socket_options(sock, sockopts)
+            sock.listen(backlog)
+            self._sockets.append((sock, kwargs))
+        elif isinstance(address, tuple):
+            result = socket.getaddrinfo(address[0], address[1], family, socket.SOCK_STREAM,
+                                        socket.IPPROTO_TCP, flags)
+            for res in result:
+                sock = socket.socket(res[0], socket.SOCK_STREAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                try:
+                    sock.bind(res[4])
+                except socket.error as e:
+                    sock.close()
+                    self._log.warning('bind error {!r}, skipping {}', e, saddr(res[4]))
+                    continue
+                self._set_socket_options(sock, sockopts)
+                sock.listen(backlog)
+                self._sockets.append((sock, kwargs))
+        else:
+            raise TypeError('expecting a string or tuple')
+
+    def _set_socket_options(self, sock, options):
+        # Set socket options on a listening socket before it starts listening.
+        # The workers set them again on their handles, which is harmless.
+        for name, value in options.items():
+            level = _socket_options[name][0]
+            if value is None or level == socket.IPPROTO_TCP and sock.family == socket.AF_UNIX:
+                continue
+            try:
+                _setsockopt(sock, name, value)
+            except TransportError as e:
+                self._log.warning('{!s}', e)
+
+    def _worker_main(self, ready, channel):
+        # Main function of a worker process. Returns the exit status.
+        for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        # Drop the hub we may have inherited from our parent, and close the
+        # descriptors of the supervisor's own loop. Neither must be used here.
+        hub_module._local.__dict__.pop('hub', None)
+        for fd in self._supervisor_fds():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        hub = get_hub()
+        server = self._server_factory()
+        handles = []
+        if channel is None:
+            for sock, kwargs in self._sockets:
+                handle = pyuv.Pipe(hub.loop) if sock.family == socket.AF_UNIX \
+                            else pyuv.TCP(hub.loop)
+                handle.open(os.dup(sock.fileno()))
+                server.listen(handle, **kwargs)
+        else:
+            handles = self._start_channel(channel, server, hub)
+        for sock, _ in self._sockets:
+            sock.close()
+        # A Ctrl-C on a terminal reaches the workers as well. Treat it like a
+        # SIGTERM instead of letting the hub close immediately.
+        hub._sigint_handle.close()
+        signals = []
+        def on_signal(handle, signum):
+            for handle in signals + handles:
+                if not handle.closed:
+                    handle.close()
+            hub.run_callback(spawn, self._stop_worker, server, hub)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            handle = pyuv.Signal(hub.loop)
+            handle.start(on_signal, signum)
+            signals.append(handle)
+        os.write(ready, b'1')
+        os.close(ready)
+        hub.switch()
+        return 0
+
+    def _start_channel(self, fd, server, hub):
+        # Start receiving connections from the supervisor over the IPC pipe
+        # *fd*, and start reporting our load. Return the handles used.
+        channel = pyuv.Pipe(hub.loop, True)
+        channel.open(fd)
+        # The supervisor sends the index of the listening socket along with
+        # each connection, so that we use the arguments of that socket.
+        listen_args = []
+        for _, kwargs in self._sockets:
+            sockopts = dict(server.default_socket_options)
+            sockopts.update((name, value) for name, value in kwargs.items()
+                            if name in _socket_options)
+            listen_args.append((kwargs['ssl'], kwargs['ssl_args'], sockopts))
+        counts = [0, None]
+        buffer = [b'']
+        indices = collections.deque()
+        def on_read(handle, data, error):
+            if error:
+                handle.close()
+                return
+            lines = (buffer[0] + data).split(b'\n')
+            buffer[0] = lines.pop()
+            indices.extend(int(line) for line in lines)
+            while True:
+                handle_type = handle.pending_handle_type()
+                if handle_type == pyuv.UV_UNKNOWN_HANDLE:
+                    break
+                elif handle_type == pyuv.UV_NAMED_PIPE:
+                    client = pyuv.Pipe(hub.loop)
+                else:
+                    client = pyuv.TCP(hub.loop)
+                handle.accept(client)
+                counts[0] += 1
+                ssl, ssl_args, sockopts = listen_args[indices.popleft()]
+                server._start_connection(client, ssl, ssl_args, sockopts)
+            report()
+        def report(timer=None):
+            status = (counts[0], len(server._connections))
+            if status == counts[1] or channel.closed:
+                return
+            counts[1] = status
+            channel.write('{} {}\n'.format(*status).encode('ascii'))
+        channel.start_read(on_read)
+        timer = pyuv.Timer(hub.loop)
+        timer.start(report, self.report_interval, self.report_interval)
+        timer._system_handle = True
+        return [channel, timer]
+
+    def _stop_worker(self, server, hub):
+        # Gracefully stop a worker. Runs in a fiber in the worker.
+        for handle in server._handles:
+            if not handle.closed:
+                handle.close()
+        if not server._all_closed.wait(self.graceful_timeout):
+            self._log.warning('graceful timeout expired, closing connections')
+        server.close()
+        hub.close()
+
+    def _spawn_worker(self, slot):
+        # Fork a new worker for *slot* and wait for it to be ready. Restarts
+        # of a slot are throttled by restart_delay.
+        if slot in self._last_spawn:
+            delay = self._last_spawn[slot] + self.restart_delay - time.time()
+            if delay > 0:
+                self._sleep(delay)
+        self._last_spawn[slot] = time.time()
+        rfd, wfd = os.pipe()
+        if self._dispatch:
+            msock, wsock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            channel = None
+            if self._dispatch:
+                msock.close()
+                channel = os.dup(wsock.fileno())
+                wsock.close()
+            status = 1
+            try:
+                status = self._worker_main(wfd, channel)
+            except BaseException:
+                self._log.exception('uncaught exception in worker')
+            finally:
+                os._exit(status)
+        os.close(wfd)
+        worker = self._workers[pid] = _WorkerProcess(pid, slot)
+        try:
+            readable, _, _ = select.select([rfd], [], [], self.startup_timeout)
+            ready = readable and os.read(rfd, 1) == b'1'
+        except (OSError, select.error):
+            ready = False
+        finally:
+            os.close(rfd)
+        if self._dispatch:
+            wsock.close()
+            channel = pyuv.Pipe(self._loop, True)
+            channel.open(os.dup(msock.fileno()))
+            msock.close()
+            channel.start_read(functools.partial(self._on_worker_report, worker))
+            worker.channel = channel
+        if ready:
+            self._log.debug('started worker {}', pid)
+        else:
+            self._log.error('worker {} did not start up', pid)
+        return ready
+
+    def _stop_workers(self, workers, timeout):
+        # Send SIGTERM to *workers* and wait for them to exit. Workers that do
+        # not exit within *timeout* seconds are killed.
+        for worker in workers:
+            worker.stopping = True
+            self._kill(worker.pid, signal.SIGTERM)
+        deadline = time.time() + timeout
+        while any(worker.pid in self._workers for worker in workers):
+            if time.time() > deadline:
+                for worker in workers:
+                    if worker.pid in self._workers:
+                        self._log.warning('killing worker {}', worker.pid)
+                        self._kill(worker.pid, signal.SIGKILL)
+                deadline = float('inf')
+            self._reap()
+            self._sleep(0.05)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _reap(self):
+        # Collect exited workers.
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                elif e.errno == errno.ECHILD:
+                    break
+                raise
+            if pid == 0:
+                break
+            worker = self._workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.channel is not None and not worker.channel.closed:
+                worker.channel.close()
+            if not worker.stopping:
+                self._log.warning('worker {} exited unexpectedly with status {}', pid, status)
+
+    def _sleep(self, timeout):
+        # Sleep for *timeout* seconds. In dispatch mode, run our loop to keep
+        # accepting connections while we sleep.
+        if self._loop is None:
+            time.sleep(timeout)
+            return
+        self._timer.start(lambda handle: self._loop.stop(), timeout, 0)
+        self._loop.run()
+
+    def _supervisor_fds(self):
+        # Return the descriptors used by the handles of the supervisor loop.
+        handles = list(self._handles)
+        handles += [worker.channel for worker in self._workers.values()
+                    if worker.channel is not None and not worker.channel.closed]
+        return [handle.fileno() for handle in handles]
+
+    def _on_new_connection(self, index, handle, error):
+        # Accept a connection and pass it to the least loaded worker.
+        if error:
+            self._log.warning('error {} in listen() callback', error)
+            return
+        client = type(handle)(self._loop)
+        handle.accept(client)
+        workers = [worker for worker in self._workers.values()
+                   if worker.channel is not None and not worker.stopping]
+        if not workers:
+            self._log.warning('no workers available, dropping new connection')
+            client.close()
+            return
+        worker = min(workers, key=lambda worker: worker.load)
+        worker.sent += 1
+        worker.channel.write('{}\n'.format(index).encode('ascii'),
+                             lambda handle, error: client.close(), client)
+
+    def _on_worker_report(self, worker, handle, data, error):
+        # A worker reported its load, as lines of "<received> <active>".
+        if error:
+            handle.close()
+            return
+        worker.buffer += data
+        lines = worker.buffer.split(b'\n')
+        worker.buffer = lines.pop()
+        if lines:
+            received, active = lines[-1].split()
+            worker.received, worker.active = int(received), int(active)
+
+    def _start_dispatch(self):
+        # Create the supervisor loop.
+        self._loop = pyuv.Loop()
+        self._timer = pyuv.Timer(self._loop)
+
+    def _start_accepting(self):
+        # Start accepting connections in dispatch mode. This is done after
+        # the initial workers have started, so that the first connections
+        # are not all passed to the first worker.
+        for index, (sock, kwargs) in enumerate(self._sockets):
+            handle = pyuv.Pipe(self._loop) if sock.family == socket.AF_UNIX \
+                        else pyuv.TCP(self._loop)
+            handle.open(os.dup(sock.fileno()))
+            handle.listen(functools.partial(self._on_new_connection, index), kwargs['backlog'])
+            self._handles.append(handle)
+
+    def _stop_dispatch(self):
+        for handle in self._handles:
+            handle.close()
+        del self._handles[:]
+        self._timer.close()
+        self._loop.run()
+        self._loop = self._timer = None
+
+    def _spawn_missing(self):
+        # Restart the workers of slots that have no worker.
+        used = set(worker.slot for worker in self._workers.values())
+        for slot in range(self._nworkers):
+            if self._stopping:
+                break
+            if slot not in used:
+                self._spawn_worker(slot)
+
+    def _rolling_restart(self):
+        self._log.info('rolling restart of {} workers', len(self._workers))
+        for worker in list(self._workers.values()):
+            if self._stopping:
+                break
+            self._spawn_worker(worker.slot)
+            self._stop_workers([worker], self.graceful_timeout + 5)
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._restart = True
+        else:
+            self._stopping = True
+
+    def restart(self):
+        """Request a rolling restart of the workers."""
+        self._restart = True
+
+    def stop(self):
+        """Request the supervisor to stop."""
+        self._stopping = True
+
+    def run(self):
+        """Start the workers and supervise them until a stop is requested,
+        either by a signal or by :meth:`stop`."""
+        if not self._sockets:
+            raise RuntimeError('not listening')
+        handlers = {}
+        for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+            handlers[signum] = signal.signal(signum, self._on_signal)
+        self._log.info('starting {} workers', self._nworkers)
+        if self._dispatch:
+            self._start_dispatch()
+        try:
+            for slot in range(self._nworkers):
+                if self._stopping:
+                    break
+                self._spawn_worker(slot)
+            if self._dispatch:
+                self._start_accepting()
+            while not self._stopping:
+                self._reap()
+                if self._restart:
+                    self._restart = False
+                    self._rolling_restart()
+                self._spawn_missing()
+                self._sleep(0.1)
+        finally:
+            self._log.info('stopping {} workers', len(self._workers))
+            self._stop_workers(list(self._workers.values()), self.graceful_timeout + 5)
+            if self._loop is not None:
+                self._stop_dispatch()
+            for signum in handlers:
+                signal.signal(signum, handlers[signum])
+
+    def close(self):
+        """Close the listening sockets."""
+        for sock, _ in self._sockets:
+            sock.close()
+        del self._sockets[:]
@@ -0,0 +1,199 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import threading
+
+from timeit import default_timer
+
+from . import util
+
+__all__ = []
+
+# CPU time of the current thread, if the platform supports it. Otherwise fall
+# back to process CPU time which is still useful for a single hub.
+cpu_time = getattr(time, 'thread_time', None) or getattr(time, 'process_time', None) \
+                or time.clock
+
+
+def fiber_name(fiber):
+    """Return the name under which *fiber* is reported by the profiler."""
+    return getattr(fiber, 'name', None) or util.objref(fiber)
+
+
+def frame_name(frame):
+    """Return the name of *frame* as used in collapsed stack output."""
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+class FiberProfile(object):
+    """Profile data for a single fiber."""
+
+    __slots__ = ('name', 'cpu_time', 'wall_time', 'switches', 'slices', 'samples')
+
+    def __init__(self, name):
+        self.name = name
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self.switches = 0
+        self.slices = 0
+        self.samples = 0
+
+    def as_dict(self):
+        """Return the profile as a dictionary."""
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class Profiler(object):
+    """Per-fiber profiler.
+
+    A regular profiler like :mod:`cProfile` is not very useful with fibers. It
+    attributes time to functions, and when a function switches to the hub and
+    back, the time that other fibers ran in between is attributed to it.
+
+    This profiler works at the level of fibers instead. It is hooked into
+    :meth:`Fiber.switch` and :meth:`Hub.switch` and measures the CPU and wall
+    time of every slice that a fiber runs between two switches, as well as the
+    number of times a fiber switched to the hub.
+
+    In addition, a sampling thread captures the stack of the hub thread at a
+    low frequency and attributes it to the fiber that is running. The samples
+    can be exported in the "collapsed stack" format that is used by flame graph
+    tools, with the fiber name as the root frame.
+
+    Profile data is keyed by fiber name, so it is retained after a fiber exits.
+
+    Normally you do not instantiate this class yourself but use
+    :meth:`Hub.enable_profiler`.
+    """
+
+    def __init__(self, hub, interval=0.01):
+        """
+        The *interval* argument specifies the sampling interval in seconds. If
+        it is ``None``, stack sampling is disabled and only the switch
+        instrumentation is active.
+        """
+        self._hub = hub
+        self._interval = interval
+        self._profiles = {}
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._current = None
+        self._started = None
+        self._stopped = threading.Event()
+        self._thread = None
+        if interval is not None:
+            self._thread = threading.Thread(target=self._sampler, name='Profiler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _get_profile(self, name):
+        profile = self._profiles.get(name)
+        if profile is None:
+            profile = self._profiles[name] = FiberProfile(name)
+        return profile
+
+    def enter(self, fiber):
+        """Called by the hub before it switches to *fiber*."""
+        self._current = fiber_name(fiber)
+        self._started = (default_timer(), cpu_time())
+
+    def leave(self):
+        """Called by the hub after the current fiber switched back."""
+        if self._current is None:
+            return
+        wall, cpu = self._started
+        profile = self._get_profile(self._current)
+        profile.wall_time += default_timer() - wall
+        profile.cpu_time += cpu_time() - cpu
+        profile.slices += 1
+        self._current = None
+
+    def switch(self, fiber):
+        """Called when *fiber* switches to the hub."""
+        self._get_profile(fiber_name(fiber)).switches += 1
+
+    def _sampler(self):
+        # Main function of the sampling thread.
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._hub._thread)
+            if frame is None:
+                continue
+            name = self._current or 'Hub'
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            stack.append(name)
+            key = ';'.join(reversed(stack))
+            with self._lock:
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            profile = self._profiles.get(name)
+            if profile is not None:
+                profile.samples += 1
+
+    def profiles(self):
+        """Return a list of :class:`FiberProfile` instances, one per fiber."""
+        return list(self._profiles.values())
+
+    def top(self, count=10, key='cpu_time'):
+        """Return the *count* fibers that rank highest by *key*.
+
+        The *key* argument can be any of the attributes of
+        :class:`FiberProfile`, e.g. ``'cpu_time'``, ``'wall_time'`` or
+        ``'switches'``. The return value is a list of :class:`FiberProfile`
+        instances.
+        """
+        profiles = sorted(self._profiles.values(), key=lambda p: getattr(p, key), reverse=True)
+        return profiles[:count]
+
+    def report(self, count=10, key='cpu_time'):
+        """Return a human readable report of the top *count* fibers by *key*,
+        as a string."""
+        lines = ['{:<30} {:>10} {:>10} {:>10} {:>10}'.format(
+                    'fiber', 'cpu', 'wall', 'switches', 'samples')]
+        for profile in self.top(count, key):
+            lines.append('{:<30} {:>10.4f} {:>10.4f} {:>10} {:>10}'.format(
+                         profile.name[:30], profile.cpu_time, profile.wall_time,
+                         profile.switches, profile.samples))
+        return '\n'.join(lines) + '\n'
+
+    def collapsed(self):
+        """Return the stack samples in collapsed stack format.
+
+        The return value is a list of lines, each line containing a stack with
+        frames separated by semicolons, followed by a space and the number of
+        samples for that stack. The first frame is the name of the fiber. The
+        output can be passed directly to flame graph tools like
+        ``flamegraph.pl``.
+        """
+        with self._lock:
+            items = sorted(self._stacks.items())
+        return ['{} {}'.format(stack, count) for stack, count in items]
+
+    def write_collapsed(self, fout):
+        """Write the collapsed stack samples to the file-like object *fout*."""
+        for line in self.collapsed():
+            fout.write(line + '\n')
+
+    def clear(self):
+        """Clear all profile data."""
+        self._profiles.clear()
+        with self._lock:
+            self._stacks.clear()
+
+    def close(self):
+        """Stop the profiler. The profile data remains available."""
+        self._stopped.set()
+        self._thread = None
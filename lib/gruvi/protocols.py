@@ -60,9 +60,29 @@ class Protocol(BaseProtocol):
 class DatagramProtocol(BaseProtocol):
     """Base classs for datagram oriented protocols."""
 
+    #: Whether to enable receive batching on the transport. If enabled,
+    #: datagrams are passed to :meth:`datagrams_received` in batches. See
+    #: :meth:`DatagramTransport.set_receive_batching`.
+    batch_datagrams = False
+
+    def connection_made(self, transport):
+        """Called when the transport is started."""
+        if self.batch_datagrams and hasattr(transport, 'set_receive_batching'):
+            transport.set_receive_batching(True)
+
     def datagram_received(self, data, addr):
         """Called when a new datagram is received."""
 
+    def datagrams_received(self, datagrams):
+        """Called with a list of ``(data, addr)`` tuples when receive batching
+        is enabled.
+
+        The default implementation calls :meth:`datagram_received` for each
+        datagram. Override this method to process a batch at once.
+        """
+        for data, addr in datagrams:
+            self.datagram_received(data, addr)
+
     def error_received(self, exc):
         """Called when an error has occurred."""
 
@@ -72,6 +92,11 @@ class MessageProtocol(Protocol):
 
     max_queue_size = 10
 
+    #: Whether to enable write coalescing on the transport. Message protocols
+    #: tend to write many small pieces of data in bursts. See
+    #: :meth:`Transport.set_write_coalescing`.
+    coalesce_writes = True
+
     def __init__(self, message_handler=None, timeout=None):
         super(MessageProtocol, self).__init__(timeout=timeout)
         self._message_handler = message_handler
@@ -101,12 +126,17 @@ class MessageProtocol(Protocol):
                 self._message_handler(message, self._transport, self)
         finally:
             self._log.debug('dispatcher exiting, closing transport')
+            # The fiber may be recycled by a FiberCache, make sure we do not
+            # cancel it later on in connection_lost().
+            self._dispatcher = None
             if self._transport is not None:
                 self._transport.close()
 
     def connection_made(self, transport):
         # Protocol callback
         self._transport = transport
+        if self.coalesce_writes and hasattr(transport, 'set_write_coalescing'):
+            transport.set_write_coalescing(True)
         if self._message_handler:
             self._dispatcher = spawn(self._dispatch_loop)
 
@@ -12,7 +12,7 @@ import pyuv
 import ssl
 
 from . import compat
-from .transports import Transport, TransportError
+from .transports import Transport, TransportError, _FileSender
 from .sync import Event
 
 from .sslcompat import SSLContext, MemoryBIO, get_reason, wrap_bio
@@ -270,6 +270,7 @@ class SslTransport(Transport):
         self._do_handshake_on_connect = do_handshake_on_connect
         self._close_on_unwrap = close_on_unwrap
         self._write_backlog = []
+        self._write_backlog_size = 0
         self._ssl_active = Event()
 
     def start(self, protocol):
@@ -304,6 +305,11 @@ class SslTransport(Transport):
         else:
             return super(SslTransport, self).get_extra_info(name, default)
 
+    def get_write_buffer_size(self):
+        # Return the size of the write buffer. This includes the plaintext in
+        # the backlog that is waiting to be encrypted.
+        return super(SslTransport, self).get_write_buffer_size() + self._write_backlog_size
+
     def write(self, data):
         # Write *data* to the transport.
         if not isinstance(data, (bytes, bytearray, memoryview)):
@@ -313,46 +319,96 @@ class SslTransport(Transport):
             raise compat.saved_exc(self._error)
         elif self._closing or self._handle.closed:
             raise TransportError('transport is closing/closed')
-        elif len(data) == 0:
+        elif len(data) == 0 or self._hold_write([data]):
+            return
+        self._write_backlog.append([data, 0])
+        self._write_backlog_size += len(data)
+        self._process_write_backlog()
+
+    def writelines(self, seq):
+        # Write all elements of *seq* to the transport.
+        bufs = []
+        for data in seq:
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                raise TypeError("data: expecting a bytes-like instance, got {!r}"
+                                    .format(type(data).__name__))
+            if data:
+                bufs.append(data)
+        if self._error:
+            raise compat.saved_exc(self._error)
+        elif self._closing or self._handle.closed:
+            raise TransportError('transport is closing/closed')
+        elif not bufs or self._hold_write(bufs):
+            return
+        # Encrypt the buffers as one. This fills up the TLS records instead of
+        # creating at least one record per buffer.
+        data = bufs[0] if len(bufs) == 1 else b''.join(bufs)
+        self._write_backlog.append([data, 0])
+        self._write_backlog_size += len(data)
+        self._process_write_backlog()
+
+    def _write_ssldata(self, ssldata):
+        # Write record level data to the handle, as a single vectored write.
+        # Flow control is done at the record level data.
+        if not ssldata:
             return
+        # Temporarily set _closing to False to prevent Transport.write() from
+        # raising an error when we are doing a close_notify.
+        saved, self._closing = self._closing, False
+        try:
+            if len(ssldata) == 1:
+                self._write(ssldata[0])
+            else:
+                self._write(ssldata)
+        finally:
+            self._closing = saved
+
+    def _can_send_more(self):
+        # The file chunks for sendfile() go through the backlog as well.
+        return self._write_buffer_size == 0 and not self._write_backlog
+
+    def _send_chunk(self, data):
         self._write_backlog.append([data, 0])
+        self._write_backlog_size += len(data)
         self._process_write_backlog()
 
+    def _create_sender(self, fd, offset, count):
+        # The data needs to be encrypted so it is always read into memory.
+        return _FileSender(self, fd, offset, count, False)
+
     def _process_write_backlog(self):
-        # Try to make progress on the write backlog.
+        # Try to make progress on the write backlog. The record level data for
+        # all processed entries is written to the handle in one go.
+        output = []
         try:
             for i in range(len(self._write_backlog)):
-                data, offset = self._write_backlog[0]
+                data, start = self._write_backlog[0]
                 if data:
-                    ssldata, offset = self._sslpipe.feed_appdata(data, offset)
-                elif offset:
+                    ssldata, offset = self._sslpipe.feed_appdata(data, start)
+                    # The plaintext that was encrypted is now accounted for
+                    # by the record level data in the handle's write queue.
+                    self._write_backlog_size -= offset - start
+                elif start:
                     ssldata, offset = self._sslpipe.do_handshake(self._ssl_active.set), 1
                 else:
                     ssldata, offset = self._sslpipe.shutdown(self._ssl_active.clear), 1
-                # Temporarily set _closing to False to prevent Transport.write()
-                # from raising an error when we are doing a close_notify.
-                saved, self._closing = self._closing, False
-                # Write the ssl data that came out of the SSL pipe to the handle.
-                # Note that flow control is done at the record level data.
-                for chunk in ssldata:
-                    super(SslTransport, self).write(chunk)
-                self._closing = saved
+                output.extend(ssldata)
                 if offset < len(data):
                     self._write_backlog[0][1] = offset
                     # A short write means that a write is blocked on a read
-                    # We need to enable reading if it is not enabled!!
-                    # At the same time stop the protocol from writing data to
-                    # make the situation not worse.
+                    # We need to enable reading if it is not enabled!! The
+                    # remaining plaintext stays in the write buffer size, so
+                    # the protocol gets paused if it keeps on writing.
                     assert self._sslpipe.need_ssldata
                     if not self._reading:
                         self.resume_reading()
-                    if self._writing:
-                        self._protocol.pause_writing()
-                        self._writing = False
                     break
                 # An entire chunk from the backlog was processed. We can
-                # delete it and reduce the outstanding buffer size.
+                # delete it.
                 del self._write_backlog[0]
+            self._write_ssldata(output)
+            self._maybe_pause_protocol()
+            self._maybe_resume_protocol()
         except ssl.SSLError as e:
             self._log.warning('SSL error {} (reason {})', e.errno, e.reason, exc_info=True)
             self._error = e
@@ -361,6 +417,7 @@ class SslTransport(Transport):
     def _on_read_complete(self, handle, data, error):
         # Callback used with handle.start_read().
         assert handle is self._handle
+        self._note_read()
         try:
             if self._error:
                 self._log.warning('ignore read status {} after close', error)
@@ -376,9 +433,10 @@ class SslTransport(Transport):
                 self._error = TransportError.from_errno(error)
                 self.abort()
             else:
+                self._reads += 1
+                self._bytes_read += len(data)
                 ssldata, appdata = self._sslpipe.feed_ssldata(data)
-                for chunk in ssldata:
-                    super(SslTransport, self).write(chunk)
+                self._write_ssldata(ssldata)
                 for chunk in appdata:
                     if chunk and not self._closing:
                         self._protocol.data_received(chunk)
@@ -475,9 +533,17 @@ class SslTransport(Transport):
         """Cleanly shut down the SSL protocol and close the transport."""
         if self._closing or self._handle.closed:
             return
+        if self._sender is not None:
+            self._sender.close_when_done = True
+            return
         self._closing = True
+        self._corked = False
         self._write_backlog.append([b'', False])
         self._process_write_backlog()
+        try:
+            self._flush_pending()
+        except TransportError:
+            pass
 
 
 def create_ssl_context(**sslargs):
@@ -8,6 +8,7 @@
 
 from __future__ import absolute_import, print_function
 
+import collections
 from io import BufferedIOBase
 
 from . import compat
@@ -32,6 +33,10 @@ class StreamBuffer(object):
 
     This is a utility class that is used to by :class:`Stream` to implement the
     read side buffering.
+
+    The received chunks are kept in a deque without being copied. A delimiter
+    can be searched for across chunk boundaries, so that a line that arrived
+    in many small pieces is returned as a single chunk.
     """
 
     default_buffer_size = 65536
@@ -40,7 +45,7 @@ class StreamBuffer(object):
         self._transport = transport
         self._timeout = timeout
         self._can_read = Event()
-        self._buffers = []
+        self._buffers = collections.deque()
         self._buffer_size = 0
         self._buffer_high = self.default_buffer_size
         self._buffer_low = self.default_buffer_size // 2
@@ -71,6 +76,8 @@ class StreamBuffer(object):
 
     def feed(self, data):
         """Add *data* to the buffer."""
+        if not data:
+            return
         self._buffers.append(data)
         self._buffer_size += len(data)
         self._maybe_pause_transport()
@@ -98,43 +105,160 @@ class StreamBuffer(object):
         if self._buffer_size > self._buffer_high:
             self._transport.pause_reading()
 
+    def _find(self, delim, start, end):
+        # Return the position of *delim* in the buffered data, or -1 if it is
+        # not found. The delimiter must start at or after *start* and end at or
+        # before *end*. Positions are relative to the current read offset.
+        overlap = len(delim) - 1
+        start = max(0, start - overlap)
+        pos = -self._offset
+        tail = b''
+        for chunk in self._buffers:
+            if pos >= end:
+                break
+            chunkend = pos + len(chunk)
+            if chunkend <= start:
+                pos = chunkend
+                continue
+            lo = max(start, pos) - pos
+            hi = min(end, chunkend) - pos
+            # A delimiter that straddles the boundary with the previous chunk.
+            if tail:
+                window = tail + chunk[lo:min(hi, lo + overlap)]
+                idx = window.find(delim)
+                if idx != -1:
+                    return pos + lo - len(tail) + idx
+            idx = chunk.find(delim, lo, hi)
+            if idx != -1:
+                return pos + idx
+            if overlap:
+                tail = (tail + chunk[max(lo, hi - overlap):hi])[-overlap:]
+            pos = chunkend
+        return -1
+
+    def _take(self, nbytes):
+        # Remove *nbytes* from the front of the buffer and return them. Whole
+        # chunks are moved rather than copied where possible.
+        first = self._buffers[0]
+        if self._offset == 0 and nbytes == len(first):
+            chunk = self._buffers.popleft()
+        elif self._offset + nbytes <= len(first):
+            chunk = first[self._offset:self._offset + nbytes]
+            self._offset += nbytes
+            if self._offset == len(first):
+                self._buffers.popleft()
+                self._offset = 0
+        else:
+            pieces = []
+            needed = nbytes
+            while needed:
+                first = self._buffers[0]
+                avail = len(first) - self._offset
+                if avail <= needed:
+                    pieces.append(first[self._offset:] if self._offset else first)
+                    self._buffers.popleft()
+                    self._offset = 0
+                    needed -= avail
+                else:
+                    pieces.append(first[self._offset:self._offset + needed])
+                    self._offset += needed
+                    needed = 0
+            chunk = b''.join(pieces)
+        self._buffer_size -= nbytes
+        return chunk
+
     @switchpoint
-    def get_chunk(self, size=-1, delim=None):
+    def get_chunk(self, size=-1, delim=None, exact=False):
         # Get a single chunk of data. The chunk will be at most *size* bytes.
-        # If *delim* is provided, then return a partial chunk if it contains
-        # the delimiter.
+        # If *delim* is provided, then wait until the delimiter is available
+        # and return all data up to and including it, even if it was received
+        # in multiple pieces. Without the delimiter, a chunk is returned on EOF
+        # or error, when *size* bytes are available, or when the buffer is full.
+        # If *exact* is true, then in the same way wait for *size* bytes.
         if size != 0 and not self._can_read.wait(self._timeout):
             raise Timeout('timeout waiting for data')
         if not self._buffers:
             return b''  # EOF or error
-        # Clamp the current buffer to *size* bytes.
-        endpos = len(self._buffers[0])
-        if size == -1:
-            size = endpos
-        if self._offset + size < endpos:
-            endpos = self._offset + size
-        # Reduce it even further if the delimiter is found
         if delim:
-            pos = self._buffers[0].find(delim, self._offset, endpos)
-            if pos != -1:
-                endpos = pos + len(delim)
-        nbytes = endpos - self._offset
-        # Try to move a buffer instead of copying.
-        if self._offset == 0 and endpos == len(self._buffers[0]):
-            chunk = self._buffers.pop(0)
+            scanned = 0
+            while True:
+                end = self._buffer_size
+                if 0 <= size < end:
+                    end = size
+                pos = self._find(delim, scanned, end)
+                if pos != -1:
+                    nbytes = pos + len(delim)
+                    break
+                if end == size or self._eof or self._error:
+                    nbytes = end
+                    break
+                if self._buffer_size >= self._buffer_high:
+                    # The buffer is full. Keep back a possible partial
+                    # delimiter so that it is found on the next call.
+                    nbytes = end - len(delim) + 1
+                    if nbytes <= 0:
+                        nbytes = end
+                    break
+                # Only scan the new data the next time around.
+                scanned = end
+                self._can_read.clear()
+                if not self._can_read.wait(self._timeout):
+                    raise Timeout('timeout waiting for data')
+        elif exact and size > 0:
+            while self._buffer_size < size and not self._eof and not self._error \
+                        and self._buffer_size < self._buffer_high:
+                self._can_read.clear()
+                if not self._can_read.wait(self._timeout):
+                    raise Timeout('timeout waiting for data')
+            nbytes = min(size, self._buffer_size)
         else:
-            chunk = self._buffers[0][self._offset:endpos]
-            self._offset = endpos
-            if self._offset == len(self._buffers[0]):
-                del self._buffers[0]
+            nbytes = len(self._buffers[0]) - self._offset
+            if 0 <= size < nbytes:
+                nbytes = size
+        chunk = self._take(nbytes)
+        self._data_consumed()
+        return chunk
+
+    @switchpoint
+    def get_into(self, buf):
+        # Copy data into the writable memoryview *buf* and return the number
+        # of bytes copied. Unlike get_chunk(), this copies from as many chunks
+        # as are needed to fill *buf*, without creating intermediate objects.
+        size = len(buf)
+        if size != 0 and not self._can_read.wait(self._timeout):
+            raise Timeout('timeout waiting for data')
+        nbytes = min(size, self._buffer_size)
+        pos = 0
+        while pos < nbytes:
+            first = self._buffers[0]
+            count = min(len(first) - self._offset, nbytes - pos)
+            buf[pos:pos+count] = memoryview(first)[self._offset:self._offset+count]
+            pos += count
+            self._offset += count
+            if self._offset == len(first):
+                self._buffers.popleft()
                 self._offset = 0
-        # Adjust buffer size and notify callback
         self._buffer_size -= nbytes
+        self._data_consumed()
+        return nbytes
+
+    def unread(self, data):
+        """Put *data* back at the front of the buffer."""
+        if not data:
+            return
+        if self._offset:
+            self._buffers[0] = self._buffers[0][self._offset:]
+            self._offset = 0
+        self._buffers.appendleft(data)
+        self._buffer_size += len(data)
+        self._maybe_pause_transport()
+        self._can_read.set()
+
+    def _data_consumed(self):
         self._maybe_resume_transport()
         # If there's no data and no error, clear the reading indicator.
         if not self._buffers and not self._eof and not self._error:
             self._can_read.clear()
-        return chunk
 
 
 class Stream(BufferedIOBase):
@@ -247,6 +371,76 @@ class Stream(BufferedIOBase):
             raise compat.saved_exc(self._buffer.error)
         return chunk
 
+    @switchpoint
+    def readinto(self, b):
+        """Read bytes into the pre-allocated, writable buffer *b*, and return
+        the number of bytes read.
+
+        The buffer may be any object supporting the buffer protocol, such as a
+        ``bytearray`` or a ``memoryview``. The data is copied directly from the
+        stream buffer into *b*. Like :meth:`read`, this blocks until *b* is
+        full, and only returns a short read on EOF or error.
+        """
+        self._check_readable()
+        view = memoryview(b)
+        if view.itemsize != 1:
+            view = view.cast('B')
+        bytes_read = 0
+        while bytes_read < len(view):
+            nbytes = self._buffer.get_into(view[bytes_read:])
+            if not nbytes:
+                break
+            bytes_read += nbytes
+        if not bytes_read and not self._buffer.eof and self._buffer.error:
+            raise compat.saved_exc(self._buffer.error)
+        return bytes_read
+
+    @switchpoint
+    def readinto1(self, b):
+        """Read bytes into the writable buffer *b*, and return the number of
+        bytes read.
+
+        Like :meth:`read1`, this waits for data only once and returns whatever
+        is available, up to the size of *b*.
+        """
+        self._check_readable()
+        view = memoryview(b)
+        if view.itemsize != 1:
+            view = view.cast('B')
+        nbytes = self._buffer.get_into(view)
+        if not nbytes and not self._buffer.eof and self._buffer.error:
+            raise compat.saved_exc(self._buffer.error)
+        return nbytes
+
+    @switchpoint
+    def readexactly(self, n):
+        """Read exactly *n* bytes.
+
+        This is useful for reading length-prefixed frames. If all *n* bytes
+        fit in the stream buffer, they are returned without joining a list of
+        chunks. Larger reads are copied directly into a single ``bytearray``.
+
+        If EOF is reached before any data is read, an empty bytes object is
+        returned. If EOF is reached after a partial read, a
+        :class:`StreamError` is raised.
+        """
+        self._check_readable()
+        chunk = self._buffer.get_chunk(n, exact=True)
+        if len(chunk) == n:
+            return chunk
+        if not chunk:
+            if not self._buffer.eof and self._buffer.error:
+                raise compat.saved_exc(self._buffer.error)
+            return chunk
+        # The buffer filled up before *n* bytes were received. Read the rest
+        # straight into the result.
+        buf = bytearray(n)
+        buf[:len(chunk)] = chunk
+        bytes_read = len(chunk) + self.readinto(memoryview(buf)[len(chunk):])
+        if bytes_read != n:
+            raise StreamError('EOF after {} of {} bytes'.format(bytes_read, n))
+        return bytes(buf)
+
     @switchpoint
     def readline(self, limit=-1, delim=b'\n'):
         """Read a single line.
@@ -269,7 +463,33 @@ class Stream(BufferedIOBase):
                     break
         if not chunks and not self._buffer.eof and self._buffer.error:
             raise compat.saved_exc(self._buffer.error)
-        return b''.join(chunks)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    @switchpoint
+    def readuntil(self, delim=b'\n', limit=-1):
+        """Read until *delim* is found, and return the data up to and
+        including the delimiter.
+
+        Unlike :meth:`readline`, a partial result is never returned. If EOF is
+        reached before any data is read, an empty bytes object is returned. If
+        *limit* bytes are read without finding the delimiter, or if EOF is
+        reached before it, a :class:`StreamError` is raised. If an error
+        occurs before the delimiter is found, that error is raised. In all
+        these cases the data that was read is left in the buffer, so that it
+        can still be read with e.g. :meth:`read`.
+        """
+        self._check_readable()
+        data = self.readline(limit, delim)
+        if not data or data.endswith(delim):
+            return data
+        if 0 <= limit <= len(data):
+            exc = StreamError('delimiter not found within {} bytes'.format(limit))
+        elif not self._buffer.eof and self._buffer.error:
+            exc = compat.saved_exc(self._buffer.error)
+        else:
+            exc = StreamError('EOF before delimiter, after {} bytes'.format(len(data)))
+        self._buffer.unread(data)
+        raise exc
 
     @switchpoint
     def readlines(self, hint=-1):
@@ -322,12 +542,24 @@ class Stream(BufferedIOBase):
     def writelines(self, seq):
         """Write the elements of the sequence *seq* to the transport.
 
-        This method will block if the transport's write buffer is at capacity.
+        The elements are written with a single vectored write. This method will
+        block if the transport's write buffer is at capacity.
         """
         self._check_writable()
-        for line in seq:
-            self._transport._can_write.wait()
-            self._transport.write(line)
+        self._transport._can_write.wait()
+        self._transport.writelines(seq)
+
+    @switchpoint
+    def sendfile(self, fileobj, offset=0, count=None):
+        """Send *count* bytes from the file *fileobj* starting at *offset*,
+        and return the number of bytes sent.
+
+        See :meth:`Transport.sendfile` for the details. This method blocks
+        until the entire file has been handed to the transport.
+        """
+        self._check_writable()
+        self._transport._can_write.wait()
+        return self._transport.sendfile(fileobj, offset, count).result()
 
     @switchpoint
     def write_eof(self):
@@ -418,7 +650,11 @@ class StreamClient(Client):
 
     delegate_method(stream, Stream.read)
     delegate_method(stream, Stream.read1)
+    delegate_method(stream, Stream.readinto)
+    delegate_method(stream, Stream.readinto1)
+    delegate_method(stream, Stream.readexactly)
     delegate_method(stream, Stream.readline)
+    delegate_method(stream, Stream.readuntil)
     delegate_method(stream, Stream.readlines)
     delegate_method(stream, Stream.write)
     delegate_method(stream, Stream.writelines)
@@ -453,9 +689,13 @@ class StreamServer(Server):
             self._log.debug('stream handler cancelled')
         except Exception:
             self._log.exception('uncaught exception in stream handler')
+        # The fiber may be recycled by a FiberCache, make sure we do not
+        # cancel it later on in connection_lost().
+        self._dispatchers.pop(transport, None)
         transport.close()
         self._log.debug('stream handler exiting')
 
     def connection_lost(self, transport, protocol, exc=None):
-        dispatcher = self._dispatchers.pop(transport)
-        dispatcher.cancel()
+        dispatcher = self._dispatchers.pop(transport, None)
+        if dispatcher is not None:
+            dispatcher.cancel()
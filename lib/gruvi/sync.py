@@ -11,13 +11,14 @@ from __future__ import absolute_import, print_function
 import fibers
 import threading
 import heapq
+import collections
 
 from .hub import switchpoint, get_hub, switch_back, assert_no_switchpoints
 from .callbacks import add_callback, remove_callback, pop_callback
 from .callbacks import run_callbacks, walk_callbacks
 
 __all__ = ['Lock', 'RLock', 'Event', 'Condition', 'QueueEmpty', 'QueueFull',
-           'Queue', 'LifoQueue', 'PriorityQueue']
+           'Queue', 'LifoQueue', 'PriorityQueue', 'Channel']
 
 
 # All primitives in this module a thread safe!
@@ -567,3 +568,177 @@ class PriorityQueue(Queue):
         # Priority function for a priority queue: item should typically be a
         # (priority, item) tuple
         return item
+
+
+class Channel(object):
+    """A channel for passing items between fibers, possibly in different
+    threads.
+
+    A channel is a FIFO like :class:`Queue`, but it is optimized for passing
+    many small items between hubs in different threads, with any number of
+    producers and consumers. The differences with a :class:`Queue` are:
+
+    * Putting an item into a channel does not take a lock, unless a consumer
+      is waiting for an item.
+    * A waiting consumer is woken up once per batch of items rather than once
+      per item. It can take the whole batch at once with :meth:`get_many`.
+    * There is no support for item sizes, :meth:`Queue.task_done` or
+      :meth:`Queue.join`.
+    * With multiple producers, *maxsize* is a soft limit that can be exceeded
+      by the number of producers minus one.
+    """
+
+    __slots__ = ('_maxsize', '_items', '_lock', '_getters', '_putters')
+
+    def __init__(self, maxsize=0):
+        """
+        The *maxsize* argument specifies the maximum number of items in the
+        channel. If it is less than or equal to zero, the channel size is
+        infinite.
+        """
+        self._maxsize = maxsize
+        # A deque's append() and popleft() are atomic. This is what makes the
+        # lock free fast path possible.
+        self._items = collections.deque()
+        # The lock protects the lists of waiters only.
+        self._lock = threading.Lock()
+        self._getters = []
+        self._putters = []
+
+    maxsize = property(lambda self: self._maxsize)
+
+    def qsize(self):
+        """Return the number of items in the channel."""
+        return len(self._items)
+
+    empty = lambda self: not self._items
+    full = lambda self: len(self._items) >= self._maxsize > 0
+
+    def _wait(self, waiters, ready, timeout):
+        # Wait until *ready* returns True. Return False on timeout.
+        hub = get_hub()
+        try:
+            with switch_back(timeout, lock=self._lock) as switcher:
+                with self._lock:
+                    # Register before checking. A producer that adds an item
+                    # after our check is then guaranteed to see us.
+                    waiters.append(switcher)
+                    if ready():
+                        waiters.remove(switcher)
+                        return True
+                hub.switch()
+        except BaseException as e:
+            with self._lock:
+                if switcher in waiters:
+                    waiters.remove(switcher)
+            # We may have been woken up and timed out at the same time. Pass
+            # the wakeup on so that it does not get lost.
+            self._wake(self._getters, self._items)
+            self._wake(self._putters, not self.full())
+            if e is switcher.timeout:
+                return False
+            raise
+        return True
+
+    def _wake(self, waiters, condition=True):
+        # Wake up the first fiber in *waiters*, if *condition* holds.
+        if not waiters or not condition:
+            return
+        with self._lock:
+            if waiters:
+                waiters.pop(0).switch()
+
+    @switchpoint
+    def put(self, item, block=True, timeout=None):
+        """Put *item* into the channel.
+
+        If the channel is currently full and *block* is True (the default),
+        then wait up to *timeout* seconds for space to become available. If no
+        timeout is specified, then wait indefinitely.
+
+        If the channel is full and *block* is False or a timeout occurs, then
+        raise a :class:`QueueFull` exception.
+        """
+        if self.full():
+            if not block or not self._wait(self._putters, lambda: not self.full(), timeout):
+                raise QueueFull
+        self._items.append(item)
+        # Only the first item of a batch finds a waiting consumer.
+        if self._getters:
+            self._wake(self._getters)
+
+    def put_nowait(self, item):
+        """"Equivalent of ``put(item, False)``."""
+        # See note in Queue.put_nowait()
+        return self.put.__wrapped__(self, item, False)
+
+    def put_many(self, items):
+        """Put all elements of *items* into the channel, waking up a consumer
+        at most once.
+
+        This method never blocks. The *maxsize* of the channel is ignored.
+        """
+        self._items.extend(items)
+        if self._getters:
+            self._wake(self._getters)
+
+    @switchpoint
+    def get(self, block=True, timeout=None):
+        """Pop an item from the channel.
+
+        If the channel is not empty, an item is returned immediately.
+        Otherwise, if *block* is True (the default), wait up to *timeout*
+        seconds for an item to become available. If no timeout is provided,
+        then wait indefinitely.
+
+        If the channel is empty and *block* is false or a timeout occurs, then
+        raise a :class:`QueueEmpty` exception.
+        """
+        items = self._items
+        while True:
+            try:
+                item = items.popleft()
+                break
+            except IndexError:
+                if not block or not self._wait(self._getters, lambda: items, timeout):
+                    raise QueueEmpty
+        # Pass on the wakeup if there are more items for other consumers.
+        self._wake(self._getters, items)
+        self._wake(self._putters)
+        return item
+
+    def get_nowait(self):
+        """"Equivalent of ``get(False)``."""
+        # See note in Queue.put_nowait()
+        return self.get.__wrapped__(self, False)
+
+    @switchpoint
+    def get_many(self, maxitems=None, block=True, timeout=None):
+        """Pop up to *maxitems* items from the channel and return them as a
+        list. If *maxitems* is not specified, all available items are
+        returned.
+
+        If the channel is empty, this method blocks like :meth:`get`, and
+        returns as soon as at least one item is available. If the channel is
+        empty and *block* is false or a timeout occurs, an empty list is
+        returned.
+        """
+        items = self._items
+        if not items:
+            if not block or not self._wait(self._getters, lambda: items, timeout):
+                return []
+        result = []
+        popleft = items.popleft
+        try:
+            while maxitems is None or len(result) < maxitems:
+                result.append(popleft())
+        except IndexError:
+            pass
+        self._wake(self._getters, items)
+        if self._putters:
+            with self._lock:
+                putters = self._putters[:]
+                del self._putters[:]
+                for switcher in putters:
+                    switcher.switch()
+        return result
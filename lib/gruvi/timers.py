@@ -0,0 +1,232 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+from __future__ import absolute_import, print_function
+
+import pyuv
+
+from . import logging
+from .callbacks import Node, dllist
+
+__all__ = []
+
+
+# A hashed timer wheel, as described in Varghese & Lauck, "Hashed and
+# Hierarchical Timing Wheels". Timers are stored in a fixed number of slots,
+# each slot being a doubly linked list. A timer expiring at tick T is stored in
+# slot T % size. When the wheel turns, only the current slot is inspected, and
+# timers in it that are due are fired. Timers that are more than one revolution
+# away simply stay in their slot until the wheel comes around again.
+#
+# This gives O(1) insertion and O(1) cancellation at the cost of a coarser
+# timer resolution. This is the right trade-off for the timeouts that are
+# passed to switch_back(): these are almost always cancelled before they fire,
+# and it does not matter if they fire a few milliseconds late.
+#
+# The wheel does not tick periodically. The libuv timer is a one-shot timer
+# that is started for the first non-empty slot, so an idle wheel, or one with
+# only far away timers, does not keep waking up the loop. Timeouts shorter
+# than one tick do not go on the wheel at all. They use a dedicated libuv timer
+# so that e.g. sleep(0) does not have to wait for the next tick.
+
+
+class Timer(Node):
+    """A timer that is registered with a :class:`TimerWheel`."""
+
+    __slots__ = ('_wheel', '_deadline')
+
+    def __init__(self, wheel, deadline, callback):
+        super(Timer, self).__init__(callback)
+        self._wheel = wheel
+        self._deadline = deadline
+
+    @property
+    def active(self):
+        """Whether the timer is still pending."""
+        return self._list is not None
+
+    def close(self):
+        """Cancel the timer. It is not an error to cancel a timer that already
+        fired or that was already cancelled."""
+        if self._wheel is not None:
+            self._wheel.remove(self)
+            self._wheel = None
+
+
+class ShortTimer(object):
+    """A timer for a timeout shorter than one tick of a :class:`TimerWheel`.
+
+    It has the same interface as :class:`Timer`, but is backed by a one-shot
+    :class:`pyuv.Timer`.
+    """
+
+    __slots__ = ('_wheel', '_handle', 'callback')
+
+    def __init__(self, wheel, timeout, callback):
+        self._wheel = wheel
+        self.callback = callback
+        self._handle = pyuv.Timer(wheel._loop)
+        self._handle.start(self._on_expire, max(0, timeout), 0)
+
+    @property
+    def active(self):
+        """Whether the timer is still pending."""
+        return self._handle is not None
+
+    def _on_expire(self, handle):
+        self.close()
+        try:
+            self.callback(self)
+        except Exception:
+            self._wheel._log.exception('uncaught exception in timer callback')
+
+    def close(self):
+        """Cancel the timer. It is not an error to cancel a timer that already
+        fired or that was already cancelled."""
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+class TimerWheel(object):
+    """A timer wheel that multiplexes many coarse-grained timers onto a single
+    libuv timer.
+
+    Normally you do not need to instantiate this class yourself. Instead, use
+    the per-hub instance that is available as :attr:`Hub.timers`.
+    """
+
+    #: The default resolution of the wheel, in seconds.
+    default_resolution = 0.01
+
+    #: The default number of slots in the wheel.
+    default_size = 512
+
+    def __init__(self, loop, resolution=None, size=None):
+        """
+        The *loop* argument is the :class:`pyuv.Loop` that drives the wheel.
+
+        The *resolution* argument specifies the duration of a single tick of
+        the wheel, in seconds. Timers will never fire early, but they may fire
+        up to one tick late. Timeouts shorter than one tick are served by a
+        dedicated libuv timer instead.
+
+        The *size* argument specifies the number of slots in the wheel.
+        """
+        self._loop = loop
+        resolution = self.default_resolution if resolution is None else resolution
+        self._resolution = max(1, int(resolution * 1000))  # in ms
+        self._size = self.default_size if size is None else size
+        self._slots = [dllist() for i in range(self._size)]
+        self._count = 0
+        self._tick = 0
+        self._wakeup = None
+        self._timer = pyuv.Timer(loop)
+        # The timer is started and stopped on demand. Mark it as a "system
+        # handle" so that it is not reported as leaked by the test suite.
+        self._timer._system_handle = True
+        self._log = logging.get_logger()
+
+    @property
+    def resolution(self):
+        """The resolution of the wheel, in seconds."""
+        return self._resolution / 1000.0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timeout, callback):
+        """Add a timer that expires in *timeout* seconds.
+
+        When the timer expires, *callback* is called with the timer as its
+        only argument. This mimics the calling convention of
+        :class:`pyuv.Timer`.
+
+        The return value is a :class:`Timer` instance, or a
+        :class:`ShortTimer` if *timeout* is shorter than one tick. To cancel
+        the timer, call its ``close()`` method.
+        """
+        if self._timer is None:
+            raise RuntimeError('timer wheel is closed')
+        if timeout * 1000 < self._resolution:
+            return ShortTimer(self, timeout, callback)
+        now = self._loop.now()
+        if self._count == 0:
+            self._tick = now // self._resolution
+        # Round the deadline up so that timers never fire early, and make sure
+        # that it is always in the future.
+        expires = now + int(timeout * 1000)
+        deadline = max(-(-expires // self._resolution), self._tick + 1)
+        timer = Timer(self, deadline, callback)
+        self._slots[deadline % self._size].insert(timer)
+        self._count += 1
+        if self._wakeup is None or deadline < self._wakeup:
+            self._schedule(deadline, now)
+        return timer
+
+    def remove(self, timer):
+        """Remove a timer. It is not an error to remove a timer that already
+        fired or that was already removed."""
+        if timer._list is None:
+            return
+        self._slots[timer._deadline % self._size].remove(timer)
+        self._count -= 1
+        if self._count == 0 and self._timer is not None:
+            self._timer.stop()
+            self._wakeup = None
+
+    def _schedule(self, tick, now):
+        # Start the libuv timer so that it fires at the start of *tick*.
+        self._wakeup = tick
+        delay = max(0, tick * self._resolution - now)
+        self._timer.start(self._on_tick, delay / 1000.0, 0)
+
+    def _on_tick(self, handle):
+        # Callback for our pyuv.Timer. Turn the wheel up to the current time.
+        # If the loop was blocked for a long time, we may need to catch up
+        # multiple ticks, but never more than a full revolution.
+        self._wakeup = None
+        now = self._loop.now() // self._resolution
+        last = min(now, self._tick + self._size)
+        expired = []
+        for tick in range(self._tick + 1, last + 1):
+            slot = self._slots[tick % self._size]
+            if slot:
+                expired.extend(timer for timer in slot if timer._deadline <= now)
+        # Advance the wheel before running the callbacks, so that timers they
+        # add are not put in a slot that was already inspected.
+        self._tick = now
+        for timer in expired:
+            # A callback may have cancelled a later timer.
+            if timer._list is None:
+                continue
+            self.remove(timer)
+            try:
+                timer.callback(timer)
+            except Exception:
+                self._log.exception('uncaught exception in timer callback')
+        if self._count == 0 or self._timer is None:
+            return
+        # Sleep until the first slot that has a timer in it. If that timer is
+        # one or more revolutions away, we will simply look again then.
+        for tick in range(now + 1, now + self._size + 1):
+            if self._slots[tick % self._size]:
+                break
+        if self._wakeup is None or tick < self._wakeup:
+            self._schedule(tick, self._loop.now())
+
+    def close(self):
+        """Close the wheel and remove all timers."""
+        if self._timer is None:
+            return
+        self._timer.close()
+        self._timer = None
+        self._wakeup = None
+        for slot in self._slots:
+            slot.clear()
+        self._count = 0
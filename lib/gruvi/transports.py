@@ -8,8 +8,13 @@
 
 from __future__ import absolute_import, print_function
 
+import os
+import sys
+import errno
 import pyuv
+import functools
 import contextlib
+import collections
 import socket
 import struct
 
@@ -17,8 +22,11 @@ from . import logging, compat
 from .util import docfrom
 from .errors import Error
 from .sync import Event
+from .hub import get_hub
+from .futures import Future
 
-__all__ = ['TransportError', 'BaseTransport', 'Transport', 'DatagramTransport']
+__all__ = ['TransportError', 'TransportTimeout', 'BaseTransport', 'Transport',
+           'DatagramTransport']
 
 
 class TransportError(Error):
@@ -40,6 +48,92 @@ class TransportError(Error):
         return cls(message, errno)
 
 
+class TransportTimeout(TransportError):
+    """A transport timeout expired.
+
+    The :attr:`reason` attribute is the timeout that expired: ``'idle'``,
+    ``'read'`` or ``'write'``. See :meth:`BaseTransport.set_timeouts`.
+    """
+
+    def __init__(self, reason):
+        # Keep *reason* as the only argument, so that the exception can be
+        # re-created from its args, like compat.saved_exc() does.
+        super(TransportTimeout, self).__init__(reason, pyuv.errno.UV_ETIMEDOUT)
+
+    @property
+    def reason(self):
+        return self.args[0]
+
+    def __str__(self):
+        return '{} timeout expired'.format(self.reason)
+
+
+# Socket options supported by set_option(). Maps a name to a tuple of (level,
+# name in the socket module, value on Linux, whether it applies to listening
+# sockets only). The value on Linux is used if the socket module does not
+# define the option, which is the case for some options on older Pythons.
+
+_socket_options = {
+    'nodelay': (socket.IPPROTO_TCP, 'TCP_NODELAY', 1, False),
+    'keepalive': (socket.SOL_SOCKET, 'SO_KEEPALIVE', 9, False),
+    'keepalive_idle': (socket.IPPROTO_TCP, 'TCP_KEEPIDLE', 4, False),
+    'keepalive_interval': (socket.IPPROTO_TCP, 'TCP_KEEPINTVL', 5, False),
+    'keepalive_count': (socket.IPPROTO_TCP, 'TCP_KEEPCNT', 6, False),
+    'sndbuf': (socket.SOL_SOCKET, 'SO_SNDBUF', 7, False),
+    'rcvbuf': (socket.SOL_SOCKET, 'SO_RCVBUF', 8, False),
+    'quickack': (socket.IPPROTO_TCP, 'TCP_QUICKACK', 12, False),
+    'fastopen': (socket.IPPROTO_TCP, 'TCP_FASTOPEN', 23, True),
+    'defer_accept': (socket.IPPROTO_TCP, 'TCP_DEFER_ACCEPT', 9, True),
+}
+
+if sys.platform == 'darwin':
+    # On OSX, the idle time is called TCP_KEEPALIVE.
+    _socket_options['keepalive_idle'] = (socket.IPPROTO_TCP, 'TCP_KEEPALIVE', None, False)
+
+
+def _check_socket_options(options):
+    # Raise an error if *options* contains an unknown socket option.
+    for name in options:
+        if name not in _socket_options:
+            raise ValueError('unknown socket option: {!r}'.format(name))
+
+
+def _setsockopt(sock, name, value):
+    # Set the socket option *name* on the socket object *sock*.
+    if name not in _socket_options:
+        raise ValueError('unknown socket option: {!r}'.format(name))
+    level, optname, linux_value, _ = _socket_options[name]
+    optval = getattr(socket, optname, None)
+    if optval is None and sys.platform.startswith('linux'):
+        optval = linux_value
+    if optval is None:
+        raise TransportError('socket option {!r} not supported on this platform'.format(name))
+    try:
+        sock.setsockopt(level, optval, int(value))
+    except socket.error as e:
+        raise TransportError('cannot set socket option {!r}: {!s}'.format(name, e))
+
+
+def _set_handle_option(handle, name, value):
+    # Set the socket option *name* on the pyuv handle *handle*.
+    try:
+        fd = handle.fileno()
+    except (AttributeError, pyuv.error.UVError):
+        raise TransportError('handle does not have a socket')
+    # The family and type do not matter for setsockopt().
+    sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        _setsockopt(sock, name, value)
+    finally:
+        sock.close()
+
+
+# The counters in get_extra_info('stats') that can be aggregated.
+_stats_counters = ('bytes_read', 'bytes_written', 'reads', 'writes', 'read_pauses',
+                   'write_pauses', 'read_paused_time', 'write_paused_time',
+                   'peak_write_buffer')
+
+
 class BaseTransport(object):
     """Base class for :mod:`pyuv` based transports. There is no public
     constructor."""
@@ -58,6 +152,22 @@ class BaseTransport(object):
         self._write_buffer_low = self.default_write_buffer // 2
         self._closing = False
         self._error = None
+        # Writes that are held back by cork() or write coalescing, and the
+        # file that is being sent by sendfile(). Only used by Transport.
+        self._pending = []
+        self._sender = None
+        # Timeouts, see set_timeouts(). All times are in loop time (ms).
+        self._timeouts = None
+        self._timeout_timer = None
+        self._last_read = self._last_write = 0
+        # Traffic and flow control counters, see get_extra_info('stats').
+        self._created = handle.loop.now()
+        self._bytes_read = self._bytes_written = 0
+        self._reads = self._writes = 0
+        self._read_pauses = self._write_pauses = 0
+        self._read_paused = self._write_paused = 0
+        self._read_paused_at = self._write_paused_at = None
+        self._peak_write_buffer = 0
         self._reading = False
         self._writing = False
         self._started = False
@@ -75,6 +185,9 @@ class BaseTransport(object):
         if self._writable:
             self._writing = True
             self._can_write.set()
+        if self._timeouts is not None and self._timeout_timer is None:
+            self._last_read = self._last_write = self._handle.loop.now()
+            self._arm_timeout()
 
     def _check_status(self):
         # Check the status of the transport.
@@ -86,42 +199,92 @@ class BaseTransport(object):
             raise TransportError('transport was closed')
 
     def get_write_buffer_size(self):
-        """Return the total number of bytes in the write buffer."""
-        return self._write_buffer_size
+        """Return the total number of bytes in the write buffer.
+
+        This is the number of bytes that were written but that could not yet
+        be passed to the operating system.
+        """
+        raise NotImplementedError
 
     def get_write_buffer_limits(self):
         """Return the write buffer limits as a ``(low, high)`` tuple."""
         return self._write_buffer_low, self._write_buffer_high
 
     def set_write_buffer_limits(self, high=None, low=None):
-        """Set the low and high watermark for the write buffer."""
+        """Set the low and high watermark for the write buffer.
+
+        The protocol is paused when the write buffer size exceeds *high* bytes,
+        and resumed again when it drops to *low* bytes or below. The default
+        for *high* is :attr:`default_write_buffer` and the default for *low*
+        is half of *high*.
+        """
         if high is None:
-            high = self.write_buffer_size
+            high = self.default_write_buffer
         if low is None:
             low = high // 2
         if low > high:
             low = high
         self._write_buffer_high = high
         self._write_buffer_low = low
+        if self._protocol is not None:
+            self._maybe_pause_protocol()
+            self._maybe_resume_protocol()
 
     def _maybe_resume_protocol(self):
         # Called after the write buffer size decreased. Possibly resume the protocol.
         if self._closing or self._handle.closed or self._writing:
             return
-        if self.get_write_buffer_size() <= self.get_write_buffer_limits()[0]:
+        if self.get_write_buffer_size() <= self._write_buffer_low:
             self._writing = True
+            if self._write_paused_at is not None:
+                self._write_paused += self._handle.loop.now() - self._write_paused_at
+                self._write_paused_at = None
             self._can_write.set()
             self._protocol.resume_writing()
 
     def _maybe_pause_protocol(self):
         # Called after the write buffer size increased. Possibly pause the protocol.
-        if self._closing or self._handle.closed or not self._writing:
+        if self._closing or self._handle.closed:
             return
-        if self.get_write_buffer_size() > self.get_write_buffer_limits()[0]:
+        size = self.get_write_buffer_size()
+        if size > self._peak_write_buffer:
+            self._peak_write_buffer = size
+        if self._writing and size > self._write_buffer_high:
             self._writing = False
+            self._write_pauses += 1
+            self._write_paused_at = self._handle.loop.now()
             self._can_write.clear()
             self._protocol.pause_writing()
 
+    def _note_read_paused(self, paused):
+        # Record that reading was paused (or resumed) by the protocol.
+        now = self._handle.loop.now()
+        if paused:
+            self._read_pauses += 1
+            self._read_paused_at = now
+        elif self._read_paused_at is not None:
+            self._read_paused += now - self._read_paused_at
+            self._read_paused_at = None
+
+    def _get_stats(self):
+        # Return the traffic and flow control counters as a dict.
+        now = self._handle.loop.now()
+        read_paused, write_paused = self._read_paused, self._write_paused
+        if self._read_paused_at is not None:
+            read_paused += now - self._read_paused_at
+        if self._write_paused_at is not None:
+            write_paused += now - self._write_paused_at
+        return {'bytes_read': self._bytes_read,
+                'bytes_written': self._bytes_written,
+                'reads': self._reads,
+                'writes': self._writes,
+                'read_pauses': self._read_pauses,
+                'write_pauses': self._write_pauses,
+                'read_paused_time': read_paused / 1000.0,
+                'write_paused_time': write_paused / 1000.0,
+                'peak_write_buffer': self._peak_write_buffer,
+                'age': (now - self._created) / 1000.0}
+
     def resume_reading(self):
         """Resume calling callbacks on the protocol.
 
@@ -141,9 +304,103 @@ class BaseTransport(object):
         """
         raise NotImplementedError
 
+    def set_timeouts(self, idle=None, read=None, write=None):
+        """Set the timeouts for this transport, in seconds.
+
+        The *idle* timeout expires if no data was received and no write
+        completed for the specified time. The *read* timeout expires if
+        reading is enabled but no data was received. The *write* timeout
+        expires if there are outstanding writes but none of them made
+        progress, for example because the peer stopped reading.
+
+        When a timeout expires, the transport is aborted and the protocol's
+        :meth:`~gruvi.Protocol.connection_lost` is called with a
+        :class:`TransportTimeout` that has the expired timeout as its reason.
+
+        A timeout of ``None`` disables it. Calling this method restarts all
+        timeouts. If the transport was not started yet, the timeouts start
+        running when it is started. The timeouts are driven by the hub's
+        :attr:`~gruvi.Hub.timers` wheel, so they are cheap but coarse, and
+        activity itself only records a timestamp.
+        """
+        if self._timeout_timer is not None:
+            self._timeout_timer.close()
+            self._timeout_timer = None
+        if idle is None and read is None and write is None:
+            self._timeouts = None
+            return
+        self._timeouts = tuple(None if timeout is None else int(timeout * 1000)
+                               for timeout in (idle, read, write))
+        self._last_read = self._last_write = self._handle.loop.now()
+        self._arm_timeout()
+
+    def get_timeouts(self):
+        """Return the timeouts as an ``(idle, read, write)`` tuple."""
+        if self._timeouts is None:
+            return (None, None, None)
+        return tuple(None if timeout is None else timeout / 1000.0
+                     for timeout in self._timeouts)
+
+    def _note_read(self):
+        # Record read activity for the timeouts.
+        if self._timeouts is not None:
+            self._last_read = self._handle.loop.now()
+            if self._timeout_timer is None:
+                self._arm_timeout()
+
+    def _note_write(self):
+        # Record write activity for the timeouts. Called when a write request
+        # completes, and when one is submitted while none were outstanding.
+        if self._timeouts is not None:
+            self._last_write = self._handle.loop.now()
+            if self._timeout_timer is None:
+                self._arm_timeout()
+
+    def _next_timeout(self):
+        # Return a (deadline, reason) tuple for the first timeout that will
+        # expire, or None if no timeout is running.
+        idle, read, write = self._timeouts
+        timeouts = []
+        if idle is not None:
+            timeouts.append((max(self._last_read, self._last_write) + idle, 'idle'))
+        if read is not None and self._reading:
+            timeouts.append((self._last_read + read, 'read'))
+        if write is not None and self._write_buffer_size > 0:
+            timeouts.append((self._last_write + write, 'write'))
+        return min(timeouts) if timeouts else None
+
+    def _arm_timeout(self):
+        # Start a timer for the first timeout that will expire. Activity only
+        # updates the timestamps, and the timer re-arms itself if it finds that
+        # the deadline moved. So there is at most one timer per transport.
+        # The timeouts only start running when the transport is started.
+        if self._handle.closed or self._protocol is None:
+            return
+        timeout = self._next_timeout()
+        if timeout is None:
+            return
+        delay = max(0, timeout[0] - self._handle.loop.now()) / 1000.0
+        self._timeout_timer = get_hub().timers.add(delay, self._on_timeout)
+
+    def _on_timeout(self, timer):
+        # Callback for the timeout timer.
+        self._timeout_timer = None
+        if self._timeouts is None or self._handle.closed or self._error:
+            return
+        timeout = self._next_timeout()
+        if timeout is None:
+            return
+        deadline, reason = timeout
+        if deadline > self._handle.loop.now():
+            self._arm_timeout()
+            return
+        self._log.debug('{} timeout expired, aborting transport', reason)
+        self._error = TransportTimeout(reason)
+        self.abort()
+
     def _maybe_close(self):
         # Check a pending close request and close.
-        if not self._closing or self._write_buffer_size > 0:
+        if not self._closing or self._write_buffer_size > 0 or self._pending:
             return
         if not self._handle.closed:
             self._handle.close(self._on_close_complete)
@@ -154,6 +411,9 @@ class BaseTransport(object):
         # Callback used with handle.close().
         assert handle is self._handle
         assert handle.closed
+        if self._timeout_timer is not None:
+            self._timeout_timer.close()
+            self._timeout_timer = None
         if self._server is not None:
             self._server._on_close_complete(self, self._protocol, self._error)
         self._protocol.connection_lost(self._error)
@@ -183,6 +443,41 @@ class BaseTransport(object):
         self._handle.close(self._on_close_complete)
         assert self._handle.closed
 
+    def set_option(self, name, value):
+        """Set the socket option *name* to *value*.
+
+        The following options are supported. Which of these are available
+        depends on the platform and on the type of socket. Options that are
+        not available raise a :class:`TransportError`.
+
+        ========================  =============================================
+        Name                      Description
+        ========================  =============================================
+        ``'nodelay'``             Disable Nagle's algorithm (``TCP_NODELAY``).
+        ``'keepalive'``           Enable TCP keepalive (``SO_KEEPALIVE``).
+        ``'keepalive_idle'``      Idle time in seconds before the first
+                                  keepalive probe is sent.
+        ``'keepalive_interval'``  Time in seconds between keepalive probes.
+        ``'keepalive_count'``     Number of unanswered probes before the
+                                  connection is dropped.
+        ``'sndbuf'``              Socket send buffer size (``SO_SNDBUF``).
+        ``'rcvbuf'``              Socket receive buffer size (``SO_RCVBUF``).
+        ``'quickack'``            Send ACKs immediately (``TCP_QUICKACK``,
+                                  Linux only). The kernel may reset this.
+        ``'fastopen'``            Length of the TCP Fast Open queue of a
+                                  listening socket (``TCP_FASTOPEN``).
+        ``'defer_accept'``        Seconds to wait for data before a connection
+                                  is accepted (``TCP_DEFER_ACCEPT``, Linux
+                                  only). For listening sockets.
+        ========================  =============================================
+
+        These options can also be passed as keyword arguments to
+        :func:`~gruvi.create_connection` and :func:`~gruvi.create_server`.
+        """
+        if self._handle.closed:
+            raise TransportError('transport was closed')
+        _set_handle_option(self._handle, name, value)
+
     def get_extra_info(self, name, default=None):
         """Get transport specific data.
 
@@ -192,17 +487,168 @@ class BaseTransport(object):
         Name            Description
         ==============  =================================================
         ``'handle'``    The pyuv handle that is being wrapped.
+        ``'stats'``     A dictionary with traffic and flow control
+                        counters. See below.
         ==============  =================================================
+
+        The ``'stats'`` dictionary has the following keys. Times are in
+        seconds, and the pause times include a pause that is in progress.
+
+        =======================  ==============================================
+        Name                     Description
+        =======================  ==============================================
+        ``'bytes_read'``         Bytes received. For SSL this is the record
+                                 level data.
+        ``'bytes_written'``      Bytes passed to the operating system. Bytes
+                                 are counted when their write completes.
+        ``'reads'``              Number of reads, or datagrams received.
+        ``'writes'``             Number of write requests, or datagrams sent.
+        ``'read_pauses'``        Number of times reading was paused.
+        ``'write_pauses'``       Number of times the protocol was paused
+                                 because the write buffer was full.
+        ``'read_paused_time'``   Time that reading was paused.
+        ``'write_paused_time'``  Time that the protocol was paused for writing.
+        ``'peak_write_buffer'``  Largest write buffer size seen, in bytes.
+        ``'age'``                Time since the transport was created.
+        =======================  ==============================================
         """
         if name == 'handle':
             return self._handle
+        elif name == 'stats':
+            return self._get_stats()
         else:
             return default
 
 
+class _WriteFlusher(object):
+    # Calls _flush_pending() on transports at the end of the loop iteration.
+    # This flushes the pending writes of transports that coalesce writes, and
+    # delivers the batched datagrams of datagram transports. It is done from
+    # a prepare handle, which runs just before the loop blocks for I/O. There
+    # is one instance per hub.
+
+    def __init__(self, loop):
+        self._prepare = pyuv.Prepare(loop)
+        self._prepare._system_handle = True
+        self._transports = []
+
+    def add(self, transport):
+        if not self._transports:
+            self._prepare.start(self._flush)
+        self._transports.append(transport)
+
+    def _flush(self, handle):
+        transports, self._transports = self._transports, []
+        for transport in transports:
+            try:
+                transport._flush_pending()
+            except TransportError:
+                pass  # The transport was aborted and has the error.
+        if not self._transports:
+            self._prepare.stop()
+
+
+class _FileSender(object):
+    # Sends a file over a transport for Transport.sendfile().
+    #
+    # When the transport's write queue is empty, data is sent with
+    # os.sendfile(), directly from the page cache to the socket. When the
+    # socket buffer is full, one chunk is read into memory and written
+    # through libuv, which waits for the socket to become writable. When that
+    # write completes, we go back to os.sendfile(). Without os.sendfile(), or
+    # for TLS, every chunk is read into memory.
+
+    chunk_size = 65536
+
+    def __init__(self, transport, fd, offset, count, use_sendfile):
+        self.transport = transport
+        self.fd = fd
+        self.offset = offset
+        self.remaining = count
+        self.sent = 0
+        self.use_sendfile = use_sendfile and hasattr(os, 'sendfile')
+        self.close_when_done = False
+        self.future = Future()
+
+    def _read(self, size):
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, size, self.offset)
+        os.lseek(self.fd, self.offset, os.SEEK_SET)
+        return os.read(self.fd, size)
+
+    def step(self):
+        # Make progress. Called when the transport has no outstanding writes.
+        transport = self.transport
+        try:
+            while self.remaining > 0:
+                if self.use_sendfile:
+                    try:
+                        nbytes = os.sendfile(transport._handle.fileno(), self.fd, self.offset,
+                                             min(self.remaining, 0x7ffff000))
+                    except OSError as e:
+                        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                            nbytes = None
+                        elif e.errno in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK):
+                            self.use_sendfile = False
+                            continue
+                        else:
+                            raise
+                    if nbytes == 0:
+                        break  # EOF
+                    elif nbytes is not None:
+                        self._advance(nbytes)
+                        transport._bytes_written += nbytes
+                        continue
+                # The socket is full, or we cannot use sendfile. Write a chunk
+                # and let libuv wait for the socket to become writable.
+                data = self._read(min(self.remaining, self.chunk_size))
+                if not data:
+                    break  # EOF
+                self._advance(len(data))
+                transport._send_chunk(data)
+                if not transport._can_send_more():
+                    return
+        except (OSError, IOError) as e:
+            transport._error = TransportError('sendfile error: {!s}'.format(e))
+            transport.abort()
+            return
+        self.done()
+
+    def _advance(self, nbytes):
+        self.offset += nbytes
+        self.remaining -= nbytes
+        self.sent += nbytes
+
+    def done(self):
+        transport = self.transport
+        transport._sender = None
+        transport._flush_held()
+        self.future.set_result(self.sent)
+        if self.close_when_done:
+            transport.close()
+        transport._maybe_resume_protocol()
+
+    def fail(self, exc):
+        self.transport._sender = None
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+def _get_write_flusher():
+    hub = get_hub()
+    flusher = hub.data.get('gruvi:write_flusher')
+    if flusher is None:
+        flusher = hub.data['gruvi:write_flusher'] = _WriteFlusher(hub.loop)
+    return flusher
+
+
 class Transport(BaseTransport):
     """A connection oriented transport."""
 
+    #: Whether new transports coalesce writes by default. See
+    #: :meth:`set_write_coalescing`.
+    default_coalesce_writes = False
+
     def __init__(self, handle, mode='rw'):
         """
         The *handle* argument is the pyuv handle for which to create the
@@ -216,6 +662,12 @@ class Transport(BaseTransport):
             raise TypeError("handle: expecting a 'pyuv.Stream' instance, got {!r}"
                                 .format(type(handle).__name__))
         super(Transport, self).__init__(handle, mode)
+        self._corked = False
+        self._coalesce = self.default_coalesce_writes
+        self._pending_size = 0
+        self._flush_scheduled = False
+        self._held = []
+        self._held_size = 0
 
     @docfrom(BaseTransport.get_write_buffer_size)
     def get_write_buffer_size(self):
@@ -224,11 +676,57 @@ class Transport(BaseTransport):
         # _also_ use self._write_buffer_size to keep track of the total number
         # of oustanding write requests.. This allows us to keep track of e.g.
         # write_eof() that doesn't write actual bytes.
-        return self._handle.write_queue_size
+        size = self._handle.write_queue_size + self._pending_size
+        if self._sender is not None:
+            size += self._sender.remaining + self._held_size
+        return size
+
+    def cork(self):
+        """Hold back writes until :meth:`uncork` is called.
+
+        While the transport is corked, data passed to :meth:`write` and
+        :meth:`writelines` is collected. It is written with a single vectored
+        write when the transport is uncorked. The held back data counts
+        towards the write buffer size, so flow control keeps working.
+        """
+        self._corked = True
+
+    def uncork(self):
+        """Write all data held back since :meth:`cork` was called."""
+        self._corked = False
+        self._flush_pending()
+
+    def set_write_coalescing(self, enabled):
+        """Enable or disable write coalescing.
+
+        If write coalescing is enabled, writes are not submitted immediately
+        but are collected until the end of the current iteration of the event
+        loop. Just before the loop blocks for I/O, the collected data is
+        written with a single vectored write. This saves system calls and TCP
+        segments for protocols that write many small pieces of data in a
+        burst. It is done without delaying the data, because it would not have
+        been sent out earlier than that.
+
+        The default is :attr:`default_coalesce_writes`. Message protocols like
+        :class:`~gruvi.http.HttpProtocol` enable it automatically.
+        """
+        self._coalesce = bool(enabled)
+        if not self._coalesce and not self._corked:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        # Submit the writes that were held back as a single request.
+        self._flush_scheduled = False
+        if not self._pending or self._handle.closed or self._error:
+            return
+        bufs, self._pending = self._pending, []
+        self._pending_size = 0
+        self._submit(bufs[0] if len(bufs) == 1 else bufs)
 
     def _on_read_complete(self, handle, data, error):
         # Callback used with handle.start_read().
         assert handle is self._handle
+        self._note_read()
         if self._error:
             self._log.warning('ignore read status {} after error', error)
         elif error == pyuv.errno.UV_EOF:
@@ -242,6 +740,8 @@ class Transport(BaseTransport):
             self._error = TransportError.from_errno(error)
             self.abort()
         elif data:
+            self._reads += 1
+            self._bytes_read += len(data)
             self._protocol.data_received(data)
 
     @docfrom(BaseTransport.resume_reading)
@@ -253,6 +753,8 @@ class Transport(BaseTransport):
         if not self._reading:
             self._handle.start_read(self._on_read_complete)
             self._reading = True
+            self._note_read()
+            self._note_read_paused(False)
 
     @docfrom(BaseTransport.pause_reading)
     def pause_reading(self):
@@ -263,12 +765,17 @@ class Transport(BaseTransport):
         if self._reading:
             self._handle.stop_read()
             self._reading = False
+            self._note_read_paused(True)
 
-    def _on_write_complete(self, handle, error):
-        # Callback used with handle.write().
+    def _on_write_complete(self, handle, error, nbytes=0):
+        # Callback used with handle.write() and handle.shutdown(). The number
+        # of bytes written is only counted once the write has completed.
         assert handle is self._handle
         self._write_buffer_size -= 1
         assert self._write_buffer_size >= 0
+        if not error:
+            self._bytes_written += nbytes
+        self._note_write()
         if self._error:
             self._log.debug('ignore write status {} after error', error)
         # UV_ECANCELED happens when a handle is closed that has a write backlog.
@@ -277,6 +784,8 @@ class Transport(BaseTransport):
             self._log.warning('pyuv error {} in write callback', error)
             self._error = TransportError.from_errno(error)
             self.abort()
+        if self._sender is not None and self._can_send_more():
+            self._sender.step()
         self._maybe_resume_protocol()
         self._maybe_close()
 
@@ -285,26 +794,133 @@ class Transport(BaseTransport):
         if not isinstance(data, (bytes, bytearray, memoryview)):
             raise TypeError("data: expecting a bytes-like instance, got {!r}"
                                 .format(type(data).__name__))
+        if not self._hold_write([data]):
+            self._write(data)
+
+    def _hold_write(self, bufs):
+        # If a file is being sent, hold back *bufs* until it is done. Return
+        # whether the buffers were held back.
+        if self._sender is None:
+            return False
+        self._check_status()
+        if self._closing:
+            raise TransportError('transport is closing')
+        self._held.extend(bufs)
+        self._held_size += sum(len(buf) for buf in bufs)
+        return True
+
+    def _flush_held(self):
+        # Write the buffers that were held back while sending a file.
+        if not self._held or self._error or self._handle.closed:
+            return
+        bufs, self._held = self._held, []
+        self._held_size = 0
+        self.writelines(bufs)
+
+    def _can_send_more(self):
+        # Whether a _FileSender may continue.
+        return self._write_buffer_size == 0
+
+    def _send_chunk(self, data):
+        # Write a chunk of a file for a _FileSender.
+        self._submit(data)
+
+    def _write(self, data):
+        # Submit a write request for *data*, which is either a single buffer
+        # or a list of buffers. A list is written with a single vectored write.
         self._check_status()
         if not self._writable:
             raise TransportError('transport is not writable')
         if self._closing:
             raise TransportError('transport is closing')
+        if self._corked or self._coalesce:
+            if isinstance(data, list):
+                self._pending.extend(data)
+                self._pending_size += sum(len(buf) for buf in data)
+            else:
+                self._pending.append(data)
+                self._pending_size += len(data)
+            if not self._corked and not self._flush_scheduled:
+                self._flush_scheduled = True
+                _get_write_flusher().add(self)
+            self._maybe_pause_protocol()
+            return
+        self._submit(data)
+
+    def _submit(self, data):
+        # Submit a write request to libuv.
+        nbytes = sum(len(buf) for buf in data) if isinstance(data, list) else len(data)
         try:
-            self._handle.write(data, self._on_write_complete)
+            self._handle.write(data, functools.partial(self._on_write_complete, nbytes=nbytes))
         except pyuv.error.UVError as e:
             self._error = TransportError.from_errno(e.args[0])
             self.abort()
             raise compat.saved_exc(self._error)
         # We only keep track of the number of outstanding write requests
         # outselves. See note in get_write_buffer_size().
+        if self._write_buffer_size == 0:
+            self._note_write()
         self._write_buffer_size += 1
+        self._writes += 1
         self._maybe_pause_protocol()
 
     def writelines(self, seq):
-        """Write all elements from *seq* to the transport."""
-        for line in seq:
-            self.write(line)
+        """Write all elements from *seq* to the transport.
+
+        The elements are written with a single vectored write, so that they
+        are passed to the kernel in one system call if possible.
+        """
+        bufs = []
+        for data in seq:
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                raise TypeError("data: expecting a bytes-like instance, got {!r}"
+                                    .format(type(data).__name__))
+            if data:
+                bufs.append(data)
+        if self._hold_write(bufs):
+            return
+        if len(bufs) == 1:
+            self._write(bufs[0])
+        elif bufs:
+            self._write(bufs)
+
+    def sendfile(self, fileobj, offset=0, count=None):
+        """Send *count* bytes from the file *fileobj*, starting at *offset*.
+
+        The *fileobj* argument must be a regular file opened in binary mode,
+        or a file descriptor. If *count* is not specified, the file is sent
+        up to its end. The file position of *fileobj* is not used or changed.
+
+        Where possible, the data is sent with :func:`os.sendfile` so that it
+        is not copied into memory. The bytes that still need to be sent count
+        towards the write buffer size, so the usual flow control applies.
+        Data written while the file is being sent is held back until the file
+        is complete.
+
+        The return value is a :class:`~gruvi.Future` that resolves to the
+        number of bytes sent. The file must not be closed before it is done.
+        """
+        self._check_status()
+        if not self._writable:
+            raise TransportError('transport is not writable')
+        if self._closing:
+            raise TransportError('transport is closing')
+        if self._sender is not None:
+            raise TransportError('sendfile() already in progress')
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        if count is None:
+            count = max(0, os.fstat(fd).st_size - offset)
+        # Data that was written earlier must go first.
+        self._corked = False
+        self._flush_pending()
+        sender = self._sender = self._create_sender(fd, offset, count)
+        self._maybe_pause_protocol()
+        if self._can_send_more():
+            sender.step()
+        return sender.future
+
+    def _create_sender(self, fd, offset, count):
+        return _FileSender(self, fd, offset, count, True)
 
     def write_eof(self):
         """Shut down the write direction of the transport."""
@@ -313,18 +929,49 @@ class Transport(BaseTransport):
             raise TransportError('transport is not writable')
         if self._closing:
             raise TransportError('transport is closing')
+        if self._sender is not None:
+            raise TransportError('sendfile() in progress')
+        self._corked = False
+        self._flush_pending()
         try:
             self._handle.shutdown(self._on_write_complete)
         except pyuv.error.UVError as e:
             self._error = TransportError.from_errno(e.args[0])
             self.abort()
             raise compat.saved_exc(self._error)
+        if self._write_buffer_size == 0:
+            self._note_write()
         self._write_buffer_size += 1
 
     def can_write_eof(self):
         """Whether this transport can close the write direction."""
         return True
 
+    @docfrom(BaseTransport.close)
+    def close(self):
+        # Write out held back data before closing.
+        if self._sender is not None:
+            self._sender.close_when_done = True
+            return
+        if not self._closing and not self._handle.closed:
+            self._corked = False
+            try:
+                self._flush_pending()
+            except TransportError:
+                return
+        super(Transport, self).close()
+
+    @docfrom(BaseTransport.abort)
+    def abort(self):
+        # Held back data is discarded.
+        del self._pending[:]
+        self._pending_size = 0
+        del self._held[:]
+        self._held_size = 0
+        if self._sender is not None:
+            self._sender.fail(self._error or TransportError('transport was aborted'))
+        super(Transport, self).abort()
+
     def get_extra_info(self, name, default=None):
         """Get transport specific data.
 
@@ -387,30 +1034,93 @@ class Transport(BaseTransport):
 class DatagramTransport(BaseTransport):
     """A datagram transport."""
 
-    def __init__(self, handle, mode='rw'):
+    def __init__(self, handle, mode='rw', remote_address=None):
         """
         The *handle* argument is the pyuv handle for which to create the
         transport. It must be a :class:`pyuv.UDP` instance.
 
         The *mode* argument specifies if this is transport is read-only
         (``'r'``), write-only (``'w'``) or read-write (``'rw'``).
+
+        The optional *remote_address* argument specifies a default remote
+        address. If provided, it is used when :meth:`sendto` is called without
+        an address, and datagrams from other addresses are ignored.
         """
         if not isinstance(handle, pyuv.UDP):
             raise TypeError("handle: expecting a 'pyuv.UDP' instance, got {!r}"
                                 .format(type(handle).__name__))
         super(DatagramTransport, self).__init__(handle, mode)
+        self._remote_address = remote_address
+        # Sizes of the outstanding send requests. These complete in order.
+        self._send_sizes = collections.deque()
+        self._send_buffer_size = 0
+        # Datagrams received in this loop iteration, if batching is enabled.
+        self._batch = None
+        self._batch_scheduled = False
+
+    def get_extra_info(self, name, default=None):
+        """Get transport specific data.
+
+        In addition to the fields from :meth:`BaseTransport.get_extra_info`,
+        the following information is also available:
+
+        ==================  ===================================================
+        Name                Description
+        ==================  ===================================================
+        ``'sockname'``      The socket name i.e. the result of the
+                            ``getsockname()`` system call.
+        ``'peername'``      The default remote address, if any.
+        ==================  ===================================================
+        """
+        if name == 'sockname':
+            try:
+                return self._handle.getsockname()
+            except pyuv.error.UVError:
+                return default
+        elif name == 'peername':
+            return default if self._remote_address is None else self._remote_address
+        else:
+            return super(DatagramTransport, self).get_extra_info(name, default)
+
+    def set_receive_batching(self, enabled):
+        """Enable or disable receive batching.
+
+        If receive batching is enabled, the datagrams that are received in
+        one iteration of the event loop are collected and passed to the
+        protocol's :meth:`~gruvi.DatagramProtocol.datagrams_received` as a
+        single list of ``(data, addr)`` tuples. This saves a protocol callback
+        per datagram on busy sockets. The datagrams are delivered before the
+        loop blocks for I/O again, so no latency is added.
+
+        :class:`~gruvi.DatagramProtocol` enables this automatically if its
+        ``batch_datagrams`` attribute is set.
+        """
+        if enabled:
+            if self._batch is None:
+                self._batch = []
+        elif self._batch is not None:
+            self._flush_pending()
+            self._batch = None
+
+    def _flush_pending(self):
+        # Deliver the batched datagrams. Called by _WriteFlusher.
+        self._batch_scheduled = False
+        if not self._batch or self._protocol is None:
+            return
+        batch, self._batch = self._batch, []
+        self._protocol.datagrams_received(batch)
 
     @docfrom(BaseTransport.get_write_buffer_size)
     def get_write_buffer_size(self):
-        # Return the size of the write buffer. See the note for the same method
-        # in Transport.
-        # This was recently added to pyuv, so don't put a hard dependency on
-        # it. UDP buffering in the write direction very OS dependent anyway.
-        return getattr(self._handle, 'send_queue_size', 0)
+        # Return the size of the write buffer. The handle's send_queue_size is
+        # not available in all pyuv versions, so we count the bytes in the
+        # outstanding send requests ourselves.
+        return self._send_buffer_size
 
     def _on_recv_complete(self, handle, addr, flags, data, error):
         """Callback used with handle.start_recv()."""
         assert handle is self._handle
+        self._note_read()
         if error:
             self._log.warning('pyuv error {} in recv callback', error)
             self._protocol.error_received(TransportError.from_errno(error))
@@ -418,7 +1128,17 @@ class DatagramTransport(BaseTransport):
             assert flags & pyuv.UV_UDP_PARTIAL
             self._log.warning('ignoring partial datagram')
         elif data:
-            self._protocol.datagram_received(data, addr)
+            if self._remote_address is not None and addr != self._remote_address:
+                return
+            self._reads += 1
+            self._bytes_read += len(data)
+            if self._batch is None:
+                self._protocol.datagram_received(data, addr)
+                return
+            self._batch.append((data, addr))
+            if not self._batch_scheduled:
+                self._batch_scheduled = True
+                _get_write_flusher().add(self)
 
     @docfrom(BaseTransport.resume_reading)
     def resume_reading(self):
@@ -429,6 +1149,8 @@ class DatagramTransport(BaseTransport):
         if not self._reading:
             self._handle.start_recv(self._on_recv_complete)
             self._reading = True
+            self._note_read()
+            self._note_read_paused(False)
 
     @docfrom(BaseTransport.pause_reading)
     def pause_reading(self):
@@ -439,12 +1161,17 @@ class DatagramTransport(BaseTransport):
         if self._reading:
             self._handle.stop_recv()
             self._reading = False
+            self._note_read_paused(True)
 
-    def _on_send_complete(self, handle, error):
+    def _on_send_complete(self, handle, error, nbytes=0):
         """Callback used with handle.send()."""
         assert handle is self._handle
         self._write_buffer_size -= 1
         assert self._write_buffer_size >= 0
+        if not error:
+            self._bytes_written += nbytes
+        self._note_write()
+        self._send_buffer_size -= self._send_sizes.popleft()
         if self._error:
             self._log.debug('ignore sendto status {} after error', error)
         # See note in _on_write_complete() about UV_ECANCELED
@@ -466,8 +1193,11 @@ class DatagramTransport(BaseTransport):
         self._check_status()
         if not self._writable:
             raise TransportError('transport is not writable')
+        if addr is None:
+            addr = self._remote_address
         try:
-            self._handle.send(addr, data, self._on_send_complete)
+            self._handle.send(addr, data,
+                              functools.partial(self._on_send_complete, nbytes=len(data)))
         except pyuv.error.UVError as e:
             error = TransportError.from_errno(e.args[0])
             # Try to discern between permanent and transient errors. Permanent
@@ -476,5 +1206,96 @@ class DatagramTransport(BaseTransport):
                 raise error
             self._error = error
             self.abort()
+            return
+        if self._write_buffer_size == 0:
+            self._note_write()
         self._write_buffer_size += 1
+        self._writes += 1
+        self._send_sizes.append(len(data))
+        self._send_buffer_size += len(data)
         self._maybe_pause_protocol()
+
+    def sendto_many(self, datagrams):
+        """Send multiple datagrams.
+
+        The *datagrams* argument must be an iterable of ``(data, addr)``
+        tuples. The address may be ``None`` if the transport has a default
+        remote address.
+
+        Datagrams are sent directly while the socket accepts them, without
+        creating a send request. The remaining datagrams are queued and are
+        accounted for as a single write that completes when the last one is
+        sent. Errors for individual datagrams are passed to the protocol's
+        :meth:`~gruvi.DatagramProtocol.error_received`.
+        """
+        self._check_status()
+        if not self._writable:
+            raise TransportError('transport is not writable')
+        batch = []
+        for data, addr in datagrams:
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                raise TypeError("data: expecting a bytes-like instance, got {!r}"
+                                    .format(type(data).__name__))
+            batch.append((data, self._remote_address if addr is None else addr))
+        try_send = getattr(self._handle, 'try_send', None)
+        queued = []
+        for data, addr in batch:
+            # Only send directly if nothing is queued, to keep the order.
+            if try_send is None or queued or self._write_buffer_size > 0:
+                queued.append((data, addr))
+                continue
+            try:
+                try_send(addr, data)
+            except pyuv.error.UVError as e:
+                if e.args[0] == pyuv.errno.UV_EAGAIN:
+                    queued.append((data, addr))
+                    continue
+                if not self._on_send_error(e.args[0]):
+                    return
+                continue
+            self._writes += 1
+            self._bytes_written += len(data)
+        if not queued:
+            return
+        # The batch is accounted for only after all sends were submitted. If
+        # the transport is aborted before that, the sends that were already
+        # submitted complete with UV_ECANCELED and must not be accounted.
+        state = [len(queued), 0, False]
+        def on_complete(nbytes, handle, error):
+            state[0] -= 1
+            state[1] = state[1] or error
+            if not error and state[2]:
+                self._bytes_written += nbytes
+            if state[0] == 0 and state[2]:
+                self._on_send_complete(handle, state[1])
+        size = 0
+        for data, addr in queued:
+            try:
+                self._handle.send(addr, data, functools.partial(on_complete, len(data)))
+            except pyuv.error.UVError as e:
+                state[0] -= 1
+                if not self._on_send_error(e.args[0]):
+                    return
+                continue
+            self._writes += 1
+            size += len(data)
+        if state[0] == 0:
+            return
+        if self._write_buffer_size == 0:
+            self._note_write()
+        self._write_buffer_size += 1
+        self._send_sizes.append(size)
+        self._send_buffer_size += size
+        state[2] = True
+        self._maybe_pause_protocol()
+
+    def _on_send_error(self, errnum):
+        # Handle an error from sending a datagram in sendto_many(). Return
+        # whether the transport is still usable.
+        error = TransportError.from_errno(errnum)
+        if error.errno == pyuv.errno.UV_EBADF:
+            self._error = error
+            self.abort()
+            return False
+        self._protocol.error_received(error)
+        return True
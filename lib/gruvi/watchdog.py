@@ -0,0 +1,209 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+from __future__ import absolute_import, print_function
+
+import sys
+import bisect
+import threading
+import traceback
+
+from timeit import default_timer
+
+import pyuv
+import fibers
+
+from . import logging, util
+
+__all__ = []
+
+
+def callback_name(callback):
+    """Return a string describing *callback* for use in diagnostics.
+
+    If the callback switches to a fiber (which is how fibers are scheduled by
+    the hub), the fiber name is returned instead."""
+    target = getattr(callback, '__self__', None)
+    if isinstance(target, fibers.Fiber):
+        return 'fiber {}'.format(getattr(target, 'name', None) or util.objref(target))
+    name = getattr(callback, '__qualname__', None) or getattr(callback, '__name__', None)
+    return 'callback {}'.format(name or repr(callback))
+
+
+class LagHistogram(object):
+    """A histogram of event loop lag values with logarithmic buckets."""
+
+    #: Upper bounds of the buckets, in seconds. The last bucket is unbounded.
+    bounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self):
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._total = 0
+        self._max = 0.0
+
+    @property
+    def count(self):
+        """The number of samples in the histogram."""
+        return self._total
+
+    @property
+    def max(self):
+        """The maximum lag that was recorded."""
+        return self._max
+
+    def add(self, value):
+        """Add a lag sample of *value* seconds."""
+        self._counts[bisect.bisect_left(self.bounds, value)] += 1
+        self._total += 1
+        if value > self._max:
+            self._max = value
+
+    def percentile(self, pct):
+        """Return an upper bound for the *pct* percentile.
+
+        The result is the upper bound of the bucket that contains the
+        percentile, or the maximum recorded value for the last bucket.
+        """
+        if not self._total:
+            return 0.0
+        wanted = pct / 100.0 * self._total
+        seen = 0
+        for i in range(len(self._counts)):
+            seen += self._counts[i]
+            if seen >= wanted and seen > 0:
+                return min(self.bounds[i], self._max) if i < len(self.bounds) else self._max
+        return self._max
+
+    def buckets(self):
+        """Return the histogram as a list of ``(upper_bound, count)`` tuples.
+        The upper bound of the last bucket is ``None``."""
+        return list(zip(self.bounds + (None,), self._counts))
+
+
+class Watchdog(object):
+    """Event loop watchdog.
+
+    The watchdog measures event loop lag, and reports callbacks and fibers that
+    run for longer than a threshold without yielding to the hub. A single
+    CPU-bound fiber stalls every other fiber and every connection that is
+    served by the same hub, so these are important to find.
+
+    Lag is measured by a repeating timer that records how late it fires into a
+    :class:`LagHistogram`. Slow callbacks are detected by timing each callback
+    that is run by the hub. Because fibers are switched to from a hub callback,
+    this also covers fibers.
+
+    Optionally, a monitor thread checks periodically whether the hub is stuck
+    in a callback, and if so logs the stack of the hub thread while the
+    callback is still running. This is similar to asyncio's slow callback
+    debug mode, but it shows where the time is spent.
+
+    Normally you do not instantiate this class yourself but use
+    :meth:`Hub.enable_watchdog`.
+    """
+
+    def __init__(self, hub, threshold=0.1, interval=0.1, stacks=True):
+        """
+        The *threshold* argument specifies the time in seconds after which a
+        callback or fiber is reported as slow.
+
+        The *interval* argument specifies the interval in seconds at which to
+        measure loop lag.
+
+        If *stacks* is true, then a monitor thread is started that captures
+        the stack of callbacks that exceed the threshold.
+        """
+        self._hub = hub
+        self._threshold = threshold
+        self._interval = interval
+        self._log = logging.get_logger()
+        self._histogram = LagHistogram()
+        self._slow_callbacks = 0
+        self._current = None
+        self._seq = 0
+        self._reported = 0
+        self._last_tick = default_timer()
+        self._timer = pyuv.Timer(hub.loop)
+        self._timer.start(self._on_tick, interval, interval)
+        self._stopped = threading.Event()
+        self._thread = None
+        if stacks:
+            self._thread = threading.Thread(target=self._monitor, name='Watchdog')
+            self._thread.daemon = True
+            self._thread.start()
+
+    @property
+    def threshold(self):
+        """The threshold after which a callback is considered slow."""
+        return self._threshold
+
+    @property
+    def histogram(self):
+        """The :class:`LagHistogram` with loop lag samples."""
+        return self._histogram
+
+    def _on_tick(self, handle):
+        # Callback for our pyuv.Timer.
+        now = default_timer()
+        self._histogram.add(max(0.0, now - self._last_tick - self._interval))
+        self._last_tick = now
+
+    def enter(self, callback):
+        """Called by the hub before it runs *callback*."""
+        self._seq += 1
+        self._current = (self._seq, default_timer(), callback)
+
+    def leave(self):
+        """Called by the hub after a callback returned."""
+        seq, started, callback = self._current
+        self._current = None
+        elapsed = default_timer() - started
+        if elapsed < self._threshold:
+            return
+        self._slow_callbacks += 1
+        self._log.warning('{} ran for {:.3f} seconds without yielding',
+                          callback_name(callback), elapsed)
+
+    def _monitor(self):
+        # Main function of the monitor thread.
+        interval = self._threshold / 2.0
+        while not self._stopped.wait(interval):
+            current = self._current
+            if current is None or current[0] == self._reported:
+                continue
+            seq, started, callback = current
+            elapsed = default_timer() - started
+            if elapsed < self._threshold:
+                continue
+            self._reported = seq
+            frame = sys._current_frames().get(self._hub._thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame else '(unavailable)\n'
+            self._log.warning('{} is running for {:.3f} seconds without yielding, '
+                              'stack:\n{}', callback_name(callback), elapsed, stack)
+
+    def stats(self):
+        """Return a dictionary with watchdog statistics.
+
+        The dictionary contains the keys ``'slow_callbacks'``, ``'lag_p50'``,
+        ``'lag_p99'``, ``'lag_max'`` and ``'lag_samples'``. Lag values are in
+        seconds.
+        """
+        return {'slow_callbacks': self._slow_callbacks,
+                'lag_p50': self._histogram.percentile(50),
+                'lag_p99': self._histogram.percentile(99),
+                'lag_max': self._histogram.max,
+                'lag_samples': self._histogram.count}
+
+    def close(self):
+        """Stop the watchdog."""
+        if self._timer is None:
+            return
+        self._timer.close()
+        self._timer = None
+        self._stopped.set()
+        self._thread = None
@@ -0,0 +1,61 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+from __future__ import absolute_import, print_function
+
+import time
+import threading
+import unittest
+
+import gruvi
+from support import PerformanceTest
+
+
+class PerfLocal(PerformanceTest):
+
+    def _measure_access(self, local):
+        # Measure the number of attribute reads per second on *local*.
+        local.foo = 10
+        count = 0
+        t0 = t1 = time.time()
+        while t1 - t0 < 0.2:
+            for i in range(1000):
+                local.foo
+            count += 1000
+            t1 = time.time()
+        return count / (t1 - t0)
+
+    def perf_fiber_local_get(self):
+        result = []
+        def fiber():
+            result.append(self._measure_access(gruvi.local()))
+        gruvi.spawn(fiber).join()
+        self.add_result(result[0])
+
+    def perf_thread_local_get(self):
+        self.add_result(self._measure_access(threading.local()))
+
+    def perf_fiber_local_set(self):
+        result = []
+        def fiber():
+            local = gruvi.local()
+            count = 0
+            t0 = t1 = time.time()
+            while t1 - t0 < 0.2:
+                for i in range(1000):
+                    local.foo = i
+                count += 1000
+                t1 = time.time()
+            result.append(count / (t1 - t0))
+        gruvi.spawn(fiber).join()
+        self.add_result(result[0])
+
+
+if __name__ == '__main__':
+    unittest.defaultTestLoader.testMethodPrefix = 'perf'
+    unittest.main()
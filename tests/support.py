@@ -317,11 +317,11 @@ class MockTransport(object):
         return len(self.buffer.getvalue())
 
     def get_write_buffer_limits(self):
-        return self._write_buffer_high, self._write_buffer_low
+        return self._write_buffer_low, self._write_buffer_high
 
     def set_write_buffer_limits(self, high=None, low=None):
         if high is None:
-            high = self._write_buffer_size
+            high = self.default_write_buffer
         if low is None:
             low = high // 2
         if low > high:
@@ -351,7 +351,7 @@ class MockTransport(object):
 
     def write(self, buf):
         self.buffer.write(buf)
-        if self.get_write_buffer_size() > self.get_write_buffer_limits()[0]:
+        if self.get_write_buffer_size() > self.get_write_buffer_limits()[1]:
             self._can_write.clear()
             self._writing = False
             self._protocol.pause_writing()
@@ -0,0 +1,101 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+from __future__ import absolute_import, print_function
+
+import sys
+import socket
+import unittest
+
+import gruvi
+from gruvi.hub import get_hub
+from support import UnitTest
+
+if sys.version_info[:3] >= (3, 5, 3):
+    import asyncio
+    from gruvi.aio import AsyncioLoop, get_asyncio_loop, await_coroutine
+
+
+@unittest.skipIf(sys.version_info[:3] < (3, 5, 3), 'requires Python 3.5.3+')
+class TestAsyncioLoop(UnitTest):
+
+    def test_get_loop(self):
+        loop = get_asyncio_loop()
+        self.assertIsInstance(loop, AsyncioLoop)
+        self.assertIs(loop.hub, get_hub())
+        self.assertIs(get_asyncio_loop(), loop)
+        self.assertTrue(loop.is_running())
+
+    def test_await_sleep(self):
+        # A coroutine can be waited for from a fiber.
+        self.assertEqual(await_coroutine(asyncio.sleep(0.01, result='foo')), 'foo')
+
+    def test_await_exception(self):
+        loop = get_asyncio_loop()
+        future = loop.create_future()
+        loop.call_later(0.01, future.set_exception, ValueError('foo'))
+        self.assertRaises(ValueError, await_coroutine, future)
+
+    def test_await_timeout(self):
+        # On a timeout, the coroutine is cancelled.
+        future = asyncio.ensure_future(asyncio.sleep(10), loop=get_asyncio_loop())
+        self.assertRaises(gruvi.Timeout, await_coroutine, future, timeout=0.01)
+        gruvi.sleep(0)
+        self.assertTrue(future.cancelled())
+
+    def test_run_until_complete(self):
+        loop = get_asyncio_loop()
+        self.assertEqual(loop.run_until_complete(asyncio.sleep(0, result=10)), 10)
+
+    def test_call_soon_threadsafe(self):
+        loop = get_asyncio_loop()
+        future = loop.create_future()
+        pool = gruvi.ThreadPool(1)
+        pool.submit(loop.call_soon_threadsafe, future.set_result, 'bar')
+        self.assertEqual(await_coroutine(future), 'bar')
+        pool.close()
+
+    def test_sock_io(self):
+        # Asyncio socket I/O works side by side with fibers.
+        loop = get_asyncio_loop()
+        s1, s2 = socket.socketpair()
+        s1.setblocking(False)
+        s2.setblocking(False)
+        def sender():
+            gruvi.sleep(0.01)
+            s2.send(b'foo')
+        gruvi.spawn(sender)
+        self.assertEqual(await_coroutine(loop.sock_recv(s1, 10)), b'foo')
+        s1.close()
+        s2.close()
+
+    def test_streams(self):
+        # High level asyncio streams work, including create_connection() and
+        # create_server(). These use the current thread's event loop, which
+        # get_asyncio_loop() installs.
+        get_asyncio_loop()
+        def handler(reader, writer):
+            writer.write(b'bar\n')
+            writer.close()
+        server = await_coroutine(asyncio.start_server(handler, '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await_coroutine(asyncio.open_connection('127.0.0.1', port))
+        self.assertEqual(await_coroutine(reader.readline()), b'bar\n')
+        writer.close()
+        server.close()
+        await_coroutine(server.wait_closed())
+
+    def test_close(self):
+        loop = AsyncioLoop()
+        loop.close()
+        self.assertTrue(loop.is_closed())
+        self.assertFalse(loop.is_running())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,13 +8,18 @@
 
 from __future__ import absolute_import, print_function
 
+import os
 import socket
 import unittest
 
+import pyuv
 import gruvi
-from gruvi.stream import StreamProtocol
+from gruvi.stream import StreamProtocol, StreamServer
 from gruvi.endpoints import create_server, create_connection, getaddrinfo
-from gruvi.transports import TransportError
+from gruvi.endpoints import MultiHubServer, Server
+from gruvi.endpoints import create_datagram_endpoint, DatagramServer, DatagramClient
+from gruvi.protocols import DatagramProtocol
+from gruvi.transports import TransportError, TransportTimeout, Transport
 
 from support import UnitTest
 
@@ -36,6 +41,165 @@ class TestCreateConnection(UnitTest):
         self.assertEqual(cproto.stream.readline(), b'')
         ctrans.close()
 
+    def test_write_coalescing(self):
+        # Writes made in one loop iteration are written as one request.
+        server = create_server(StreamProtocol, ('localhost', 0))
+        ctrans, cproto = create_connection(StreamProtocol, server.addresses[0])
+        gruvi.sleep(0.1)  # allow Server to accept()
+        strans, sproto = list(server.connections)[0]
+        ctrans.set_write_coalescing(True)
+        ctrans.write(b'foo')
+        ctrans.writelines([b'bar', b'\n'])
+        self.assertEqual(ctrans._write_buffer_size, 0)
+        self.assertEqual(ctrans.get_write_buffer_size(), 7)
+        self.assertEqual(sproto.stream.readline(), b'foobar\n')
+        self.assertEqual(ctrans._pending, [])
+        server.close()
+        ctrans.close()
+
+    def test_idle_timeout(self):
+        # A server connection that is idle for longer than the server's idle
+        # timeout is aborted, and the reason is passed to connection_lost().
+        lost = []
+        class TimeoutServer(Server):
+            idle_timeout = 0.1
+            def connection_lost(self, transport, protocol, exc=None):
+                lost.append(exc)
+        server = TimeoutServer(StreamProtocol)
+        server.listen(('localhost', 0))
+        ctrans, cproto = create_connection(StreamProtocol, server.addresses[0])
+        gruvi.sleep(0.05)
+        cproto.stream.write(b'foo\n')  # activity resets the timeout
+        gruvi.sleep(0.08)
+        self.assertEqual(len(list(server.connections)), 1)
+        self.assertEqual(cproto.stream.readline(), b'')
+        self.assertEqual(len(list(server.connections)), 0)
+        self.assertEqual(len(lost), 1)
+        self.assertIsInstance(lost[0], TransportTimeout)
+        self.assertEqual(lost[0].reason, 'idle')
+        server.close()
+        ctrans.close()
+
+    def test_server_stats(self):
+        # Server.get_stats() aggregates the stats of open and closed
+        # connections. A stream connection is not closed on EOF, so the
+        # handler closes it when the client does.
+        def handler(stream, transport, protocol):
+            while stream.readline():
+                pass
+        server = StreamServer(handler)
+        server.listen(('localhost', 0))
+        for i in range(2):
+            ctrans, cproto = create_connection(StreamProtocol, server.addresses[0])
+            cproto.stream.write(b'foo\n')
+            gruvi.sleep(0.1)
+            if i == 0:
+                ctrans.close()
+                gruvi.sleep(0.1)
+        stats = server.get_stats()
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['closed_connections'], 1)
+        self.assertEqual(stats['bytes_read'], 8)
+        self.assertEqual(stats['reads'], 2)
+        self.assertNotIn('age', stats)
+        server.close()
+        ctrans.close()
+
+    def test_read_timeout(self):
+        # A read timeout aborts the connection and is raised by the stream.
+        server = create_server(StreamProtocol, ('localhost', 0))
+        ctrans, cproto = create_connection(StreamProtocol, server.addresses[0])
+        ctrans.set_timeouts(read=0.1)
+        self.assertEqual(ctrans.get_timeouts(), (None, 0.1, None))
+        exc = self.assertRaises(TransportTimeout, cproto.stream.readline)
+        self.assertEqual(exc.reason, 'read')
+        self.assertEqual(str(exc), 'read timeout expired')
+        self.assertEqual(exc.errno, TransportTimeout('read').errno)
+        server.close()
+        ctrans.close()
+
+    def test_timeouts_before_start(self):
+        # Timeouts that are set before the transport is started only start
+        # running when it is started.
+        hub = gruvi.get_hub()
+        sock1, sock2 = socket.socketpair()
+        handle = pyuv.Pipe(hub.loop)
+        handle.open(os.dup(sock1.fileno()))
+        sock1.close()
+        transport = Transport(handle)
+        transport.set_timeouts(idle=0.01)
+        self.assertEqual(len(hub.timers), 0)
+        gruvi.sleep(0.05)
+        self.assertFalse(handle.closed)
+        transport.start(StreamProtocol())
+        self.assertEqual(len(hub.timers), 1)
+        transport.abort()
+        sock2.close()
+        gruvi.sleep(0)
+
+    def getsockopt(self, transport, level, option):
+        handle = transport.get_extra_info('handle')
+        sock = socket.fromfd(handle.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            return sock.getsockopt(level, option)
+        finally:
+            sock.close()
+
+    def test_socket_options(self):
+        # Socket options can be passed to create_server() and
+        # create_connection(). Accepted connections inherit them.
+        server = create_server(StreamProtocol, ('localhost', 0), nodelay=True, keepalive=True)
+        ctrans, cproto = create_connection(StreamProtocol, server.addresses[0], nodelay=True)
+        gruvi.sleep(0.1)  # allow Server to accept()
+        strans, sproto = list(server.connections)[0]
+        self.assertTrue(self.getsockopt(strans, socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertTrue(self.getsockopt(strans, socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        self.assertTrue(self.getsockopt(ctrans, socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertFalse(self.getsockopt(ctrans, socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        ctrans.set_option('nodelay', False)
+        self.assertFalse(self.getsockopt(ctrans, socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertRaises(ValueError, ctrans.set_option, 'foo', True)
+        self.assertRaises(ValueError, create_connection, StreamProtocol,
+                          server.addresses[0], foo=True)
+        server.close()
+        ctrans.close()
+
+    def check_sendfile(self, ssl=None):
+        data = os.urandom(1024*1024)
+        fname = self.tempname('sendfile')
+        with open(fname, 'wb') as fout:
+            fout.write(data)
+        server = create_server(StreamProtocol, ('localhost', 0), ssl=ssl)
+        ctrans, cproto = create_connection(StreamProtocol, server.addresses[0], ssl=ssl)
+        gruvi.sleep(0.1)  # allow Server to accept()
+        strans, sproto = list(server.connections)[0]
+        with open(fname, 'rb') as fin:
+            cproto.stream.write(b'foo')
+            future = ctrans.sendfile(fin, 100)
+            # Writes are held back until the file is sent.
+            ctrans.write(b'bar')
+            self.assertGreater(ctrans.get_write_buffer_size(), len(data) // 2)
+            self.assertEqual(sproto.stream.read(3), b'foo')
+            received = sproto.stream.read(len(data) - 100)
+            self.assertEqual(future.result(), len(data) - 100)
+        self.assertEqual(received, data[100:])
+        self.assertEqual(sproto.stream.read(3), b'bar')
+        # A close() while sending waits for the file to be sent.
+        with open(fname, 'rb') as fin:
+            self.assertEqual(cproto.stream.sendfile(fin, 0, 1000), 1000)
+            ctrans.sendfile(fin)
+            ctrans.close()
+            self.assertEqual(sproto.stream.read(), data[:1000] + data)
+        server.close()
+
+    def test_sendfile(self):
+        # Ensure that a file can be sent with sendfile().
+        self.check_sendfile()
+
+    def test_sendfile_ssl(self):
+        # Ensure that sendfile() works over SSL.
+        self.check_sendfile(self.get_ssl_context())
+
     def test_pipe(self):
         # Ensure that create_connection() and create_server() can be used to
         # connect to each other over a pipe.
@@ -148,6 +312,104 @@ class TestCreateConnection(UnitTest):
         self.assertRaises(TransportError, create_connection, StreamProtocol, addr)
 
 
+class TestMultiHubServer(UnitTest):
+
+    def _run_echo(self, addr):
+        def echo_handler(stream, transport, protocol):
+            stream.write(stream.readline())
+        server = MultiHubServer(lambda: StreamServer(echo_handler), workers=2)
+        server.listen(addr)
+        self.assertEqual(len(server.servers), 2)
+        clients = []
+        for i in range(10):
+            ctrans, cproto = create_connection(StreamProtocol, server.addresses[0])
+            cproto.stream.write(b'foo\n')
+            clients.append((ctrans, cproto))
+        for ctrans, cproto in clients:
+            self.assertEqual(cproto.stream.readline(), b'foo\n')
+        server.close()
+        self.assertEqual(server.servers, [])
+        self.assertEqual(server.connections, [])
+        for ctrans, cproto in clients:
+            self.assertEqual(cproto.stream.readline(), b'')
+            ctrans.close()
+
+    def test_tcp(self):
+        # Ensure that connections are accepted and served by the workers.
+        self._run_echo(('localhost', 0))
+
+    def test_pipe(self):
+        self._run_echo(self.pipename())
+
+
+class BatchEchoProtocol(DatagramProtocol):
+    # Echo datagrams back in batches.
+
+    batch_datagrams = True
+
+    def __init__(self):
+        super(BatchEchoProtocol, self).__init__()
+        self.batches = []
+
+    def connection_made(self, transport):
+        super(BatchEchoProtocol, self).connection_made(transport)
+        self.transport = transport
+
+    def datagrams_received(self, datagrams):
+        self.batches.append(len(datagrams))
+        self.transport.sendto_many(datagrams)
+
+
+class DatagramCollector(DatagramProtocol):
+
+    def __init__(self):
+        super(DatagramCollector, self).__init__()
+        self.received = []
+
+    def datagram_received(self, data, addr):
+        self.received.append((data, addr))
+
+
+class TestDatagramEndpoint(UnitTest):
+
+    def test_create_datagram_endpoint(self):
+        # Ensure that two datagram endpoints can talk to each other.
+        strans, sproto = create_datagram_endpoint(DatagramCollector, ('localhost', 0))
+        addr = strans.get_extra_info('sockname')
+        ctrans, cproto = create_datagram_endpoint(DatagramCollector, remote_address=addr)
+        self.assertEqual(ctrans.get_extra_info('peername'), addr)
+        ctrans.sendto(b'foo')
+        gruvi.sleep(0.1)
+        self.assertEqual(len(sproto.received), 1)
+        self.assertEqual(sproto.received[0][0], b'foo')
+        caddr = sproto.received[0][1]
+        self.assertEqual(caddr[1], ctrans.get_extra_info('sockname')[1])
+        strans.sendto(b'bar', caddr)
+        gruvi.sleep(0.1)
+        self.assertEqual(cproto.received, [(b'bar', addr)])
+        strans.close()
+        ctrans.close()
+
+    def test_server_client_batched(self):
+        # Ensure that a DatagramServer and DatagramClient work, and that
+        # datagrams are sent and received in batches.
+        server = DatagramServer(BatchEchoProtocol)
+        server.listen(('localhost', 0))
+        client = DatagramClient(DatagramCollector)
+        client.connect(server.addresses[0])
+        datagrams = [('{}'.format(i).encode('ascii'), None) for i in range(100)]
+        client.transport.sendto_many(datagrams)
+        gruvi.sleep(0.2)
+        sproto = server.transports[0][1]
+        self.assertEqual(sum(sproto.batches), 100)
+        self.assertLess(len(sproto.batches), 100)
+        received = [data for data, addr in client.protocol.received]
+        self.assertEqual(sorted(received), sorted(data for data, addr in datagrams))
+        self.assertEqual(client.transport.get_write_buffer_size(), 0)
+        client.close()
+        server.close()
+
+
 class TestGetAddrInfo(UnitTest):
 
     def test_resolve(self):
@@ -80,5 +80,68 @@ class TestFiber(UnitTest):
         self.assertFalse(fiber.alive)
 
 
+class TestFiberCache(UnitTest):
+
+    def setUp(self):
+        super(TestFiberCache, self).setUp()
+        self.cache = gruvi.get_fiber_cache()
+        self.cache.set_maxsize(10)
+
+    def tearDown(self):
+        self.cache.set_maxsize(0)
+        gruvi.sleep(0)
+        super(TestFiberCache, self).tearDown()
+
+    def test_reuse(self):
+        # Ensure that a fiber is reused after its target returns. The cache
+        # is shared by all tests, so compare against a snapshot of its stats.
+        before = self.cache.stats()
+        result = []
+        def worker(value):
+            result.append((gruvi.current_fiber(), value))
+        f1 = gruvi.spawn(worker, 1)
+        gruvi.sleep(0)
+        self.assertFalse(f1.alive)
+        self.assertEqual(self.cache.stats()['idle'], 1)
+        f2 = gruvi.spawn(worker, 2)
+        self.assertIs(f1, f2)
+        self.assertTrue(f2.alive)
+        f2.join()
+        self.assertEqual(result, [(f1, 1), (f1, 2)])
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_maxsize(self):
+        # Ensure that no more than maxsize fibers are kept.
+        fibers = [gruvi.spawn(gruvi.sleep, 0.01) for i in range(20)]
+        for fiber in fibers:
+            fiber.join()
+        self.assertEqual(self.cache.stats()['idle'], 10)
+        self.cache.set_maxsize(5)
+        self.assertEqual(self.cache.stats()['idle'], 5)
+
+    def test_local_cleared(self):
+        # Ensure that fiber-local data is cleared when a fiber is reused.
+        loc = gruvi.local()
+        result = []
+        def worker(value):
+            result.append(getattr(loc, 'value', None))
+            loc.value = value
+        gruvi.spawn(worker, 1).join()
+        gruvi.spawn(worker, 2).join()
+        self.assertEqual(result, [None, None])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_cancel_idle(self):
+        # Cancelling a fiber that is idle in the cache is a no-op.
+        fiber = gruvi.spawn(lambda: None)
+        gruvi.sleep(0)
+        fiber.cancel()
+        gruvi.sleep(0)
+        self.assertEqual(self.cache.stats()['idle'], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
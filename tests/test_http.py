@@ -616,6 +616,30 @@ class TestHttp(UnitTest):
         server.close()
         client.close()
 
+    def test_file_wrapper(self):
+        # A file returned with wsgi.file_wrapper is sent with sendfile(), from
+        # its current position and with a Content-Length.
+        fname = self.tempname('file')
+        with open(fname, 'wb') as fout:
+            fout.write(b'xxxHello, world!')
+        def file_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            fin = open(fname, 'rb')
+            fin.seek(3)
+            return environ['wsgi.file_wrapper'](fin)
+        server = HttpServer(file_app)
+        server.listen(('localhost', 0))
+        addr = server.addresses[0]
+        client = HttpClient()
+        client.connect(addr)
+        for i in range(2):
+            client.request('GET', '/')
+            resp = client.getresponse()
+            self.assertEqual(resp.get_header('Content-Length'), '13')
+            self.assertEqual(resp.body.read(), b'Hello, world!')
+        server.close()
+        client.close()
+
     def test_request_headers(self):
         server = HttpServer(echo_app)
         server.listen(('localhost', 0))
@@ -20,6 +20,8 @@ import unittest
 from unittest import SkipTest
 
 import gruvi
+from gruvi.timers import TimerWheel
+from gruvi.watchdog import LagHistogram
 from support import UnitTest
 
 
@@ -146,6 +148,172 @@ class TestHub(UnitTest):
         self.assertEqual(len(result), 100)
         self.assertEqual(result, list(range(100)))
 
+    def test_coalesce_wakeups(self):
+        # Only the first callback queued since the last drain should
+        # interrupt the loop.
+        hub = gruvi.Hub()
+        result = []
+        for i in range(100):
+            hub.run_callback(result.append, i)
+        stats = hub.stats()
+        self.assertEqual(stats['wakeups'], 1)
+        self.assertEqual(stats['wakeups_coalesced'], 99)
+        self.assertTrue(stats['wakeup_pending'])
+        hub.close()
+        hub.switch()
+        self.assertEqual(len(result), 100)
+
+    def test_coalesce_wakeups_from_thread(self):
+        # Callbacks queued from another thread should all run, even if their
+        # wakeups are coalesced.
+        hub = gruvi.get_hub()
+        done = gruvi.Event()
+        result = []
+        def thread_main():
+            for i in range(100):
+                hub.run_callback(result.append, i)
+            hub.run_callback(done.set)
+        t1 = threading.Thread(target=thread_main)
+        t1.start()
+        self.assertTrue(done.wait(10))
+        t1.join()
+        self.assertEqual(result, list(range(100)))
+
+    def test_stats_disabled(self):
+        # By default only the basic statistics should be available.
+        hub = gruvi.get_hub()
+        stats = hub.stats()
+        self.assertIn('wakeups', stats)
+        self.assertIn('handles', stats)
+        self.assertNotIn('iterations', stats)
+
+    def test_stats(self):
+        # When enabled, the loop statistics should be collected.
+        hub = gruvi.get_hub()
+        hub.enable_stats()
+        live = []
+        def fiber():
+            live.append(hub.stats()['live_fibers'])
+            gruvi.sleep(0)
+        fibers = [gruvi.spawn(fiber) for i in range(10)]
+        for fib in fibers:
+            fib.join()
+        stats = hub.stats()
+        hub.disable_stats()
+        # Only check counts that do not depend on how the callbacks are spread
+        # over loop iterations. The current iteration is not accounted yet.
+        self.assertGreater(stats['iterations'], 0)
+        self.assertGreaterEqual(stats['callbacks'], 10)
+        self.assertGreaterEqual(stats['max_queue_depth'], 10)
+        self.assertGreaterEqual(stats['switches'], 2)
+        self.assertGreater(stats['switches_per_second'], 0)
+        self.assertGreaterEqual(stats['loop_time'], 0)
+        self.assertEqual(max(live), 10)
+        self.assertEqual(stats['live_fibers'], 0)
+        self.assertNotIn('iterations', hub.stats())
+
+    def test_priority(self):
+        # Low priority callbacks should run after normal priority callbacks.
+        hub = gruvi.Hub()
+        order = []
+        hub.run_callback(order.append, 'low1', priority=gruvi.PRIORITY_LOW)
+        hub.run_callback(order.append, 'normal1')
+        hub.run_callback(order.append, 'low2', priority=gruvi.PRIORITY_LOW)
+        hub.run_callback(order.append, 'normal2', priority=gruvi.PRIORITY_NORMAL)
+        self.assertRaises(ValueError, hub.run_callback, order.append, 'x', priority=10)
+        self.assertRaises(TypeError, hub.run_callback, order.append, 'x', foo=10)
+        hub.close()
+        hub.switch()
+        self.assertEqual(order, ['normal1', 'normal2', 'low1', 'low2'])
+
+    def test_priority_queued_in_pass(self):
+        # A low priority callback that is queued while callbacks are running
+        # should not overtake a normal priority one that is queued with it.
+        hub = gruvi.get_hub()
+        order = []
+        def queue_more():
+            hub.run_callback(order.append, 'low', priority=gruvi.PRIORITY_LOW)
+            hub.run_callback(order.append, 'normal')
+        hub.run_callback(queue_more)
+        gruvi.sleep(0.01)
+        self.assertEqual(order, ['normal', 'low'])
+
+    def test_fiber_priority(self):
+        # A low priority fiber should be scheduled after a normal one, also
+        # when it is switched back to.
+        order = []
+        def worker(name):
+            order.append(name)
+            gruvi.sleep(0)
+            order.append(name)
+        low = gruvi.spawn(worker, 'low', priority=gruvi.PRIORITY_LOW)
+        normal = gruvi.spawn(worker, 'normal')
+        self.assertEqual(low.priority, gruvi.PRIORITY_LOW)
+        self.assertEqual(normal.priority, gruvi.PRIORITY_NORMAL)
+        low.join(); normal.join()
+        self.assertEqual(order, ['normal', 'low', 'normal', 'low'])
+
+    def test_callback_budget(self):
+        # With a budget, callbacks are spread over multiple iterations but all
+        # of them eventually run, including low priority ones.
+        hub = gruvi.get_hub()
+        hub.set_callback_budget(2)
+        self.assertEqual(hub.callback_budget, (2, None))
+        hub.enable_stats()
+        result = []
+        try:
+            for i in range(10):
+                hub.run_callback(result.append, i)
+            hub.run_callback(result.append, 'low', priority=gruvi.PRIORITY_LOW)
+            gruvi.sleep(0.01)
+            stats = hub.stats()
+        finally:
+            hub.disable_stats()
+            hub.set_callback_budget()
+        self.assertEqual([x for x in result if x != 'low'], list(range(10)))
+        self.assertEqual(len(result), 11)
+        self.assertGreater(stats['budget_exhausted'], 0)
+        self.assertLessEqual(stats['max_callbacks_per_iteration'], 3)
+        self.assertRaises(ValueError, hub.set_callback_budget, 0)
+
+    def test_run_when_idle(self):
+        # Idle callbacks should run only after regular callbacks, and at most
+        # once per idle period.
+        hub = gruvi.get_hub()
+        order = []
+        def idle():
+            order.append('idle')
+            if order.count('idle') < 3:
+                hub.run_when_idle(idle)
+        hub.run_when_idle(idle)
+        hub.run_callback(order.append, 'callback')
+        gruvi.sleep(0)
+        self.assertEqual(order[0], 'callback')
+        for i in range(5):
+            gruvi.sleep(0.01)
+        self.assertEqual(order.count('idle'), 3)
+
+    def test_idle_gc(self):
+        # The automatic collector should be disabled, and collections should
+        # happen from the hub instead.
+        hub = gruvi.get_hub()
+        enabled = gc.isenabled()
+        idle_gc = hub.enable_idle_gc()
+        try:
+            self.assertIs(hub.idle_gc, idle_gc)
+            self.assertFalse(gc.isenabled())
+            for i in range(gc.get_threshold()[0] * 2):
+                a = []; a.append(a)
+                del a
+            gruvi.sleep(0.05)
+            stats = hub.stats()['gc']
+        finally:
+            hub.disable_idle_gc()
+        self.assertIsNone(hub.idle_gc)
+        self.assertEqual(gc.isenabled(), enabled)
+        self.assertGreater(sum(stats['collections']), 0)
+        self.assertGreaterEqual(stats['max_pause'], 0)
+
     def test_sleep(self):
         # Test that sleep() works
         hub = gruvi.get_hub()
@@ -160,6 +328,72 @@ class TestHub(UnitTest):
         self.assertGreaterEqual(t1-t0, 100)
 
 
+class TestWatchdog(UnitTest):
+
+    def test_slow_fiber(self):
+        # A fiber that does not yield should be reported.
+        hub = gruvi.get_hub()
+        watchdog = hub.enable_watchdog(threshold=0.01, interval=0.01)
+        self.assertIs(hub.watchdog, watchdog)
+        fiber = gruvi.spawn(time.sleep, 0.05)
+        fiber.join()
+        gruvi.sleep(0.02)
+        stats = hub.stats()['watchdog']
+        hub.disable_watchdog()
+        self.assertIsNone(hub.watchdog)
+        self.assertEqual(stats['slow_callbacks'], 1)
+        self.assertGreater(stats['lag_samples'], 0)
+        self.assertGreaterEqual(stats['lag_max'], 0.03)
+        self.assertGreaterEqual(stats['lag_p99'], stats['lag_p50'])
+
+    def test_histogram(self):
+        histogram = LagHistogram()
+        self.assertEqual(histogram.percentile(99), 0)
+        for i in range(98):
+            histogram.add(0.0005)
+        histogram.add(0.015)
+        histogram.add(10)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.max, 10)
+        self.assertEqual(histogram.percentile(50), 0.001)
+        self.assertEqual(histogram.percentile(99), 0.02)
+        self.assertEqual(histogram.percentile(100), 10)
+        self.assertEqual(histogram.buckets()[-1], (None, 1))
+
+
+class TestProfiler(UnitTest):
+
+    def test_profile(self):
+        # CPU time and switches should be attributed to the right fiber, and
+        # stack samples should be rooted at the fiber name.
+        hub = gruvi.get_hub()
+        profiler = hub.enable_profiler(interval=0.001)
+        self.assertIs(hub.profiler, profiler)
+        def busy():
+            t0 = time.time()
+            while time.time() - t0 < 0.05:
+                pass
+        def switcher():
+            for i in range(100):
+                gruvi.sleep(0)
+        f1 = gruvi.spawn(busy, name='busy')
+        f2 = gruvi.spawn(switcher, name='switcher')
+        f1.join(); f2.join()
+        self.assertIs(hub.disable_profiler(), profiler)
+        self.assertIsNone(hub.profiler)
+        self.assertEqual(profiler.top(1)[0].name, 'busy')
+        self.assertEqual(profiler.top(1, 'switches')[0].name, 'switcher')
+        self.assertGreaterEqual(profiler.top(1)[0].wall_time, 0.05)
+        lines = profiler.collapsed()
+        self.assertTrue(any(line.startswith('busy;') for line in lines))
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+        report = profiler.report()
+        self.assertIn('busy', report)
+        self.assertIn('switcher', report)
+
+
 class TestAssertNoSwitchpoints(UnitTest):
 
     def test_assert_no_switchpoints(self):
@@ -169,6 +403,106 @@ class TestAssertNoSwitchpoints(UnitTest):
             self.assertRaises(AssertionError, gruvi.sleep, 0)
 
 
+class TestCancelScope(UnitTest):
+
+    def test_deadline(self):
+        # A deadline should interrupt a blocking switchpoint with a Timeout,
+        # and propagate it out of the block.
+        def block():
+            with gruvi.deadline(0.02):
+                gruvi.sleep(1)
+        t0 = time.time()
+        self.assertRaises(gruvi.Timeout, block)
+        self.assertLess(time.time() - t0, 0.5)
+
+    def test_deadline_multiple_switchpoints(self):
+        # The deadline applies to the block as a whole, and switchpoints that
+        # have their own longer timeout should not start a timer.
+        hub = gruvi.get_hub()
+        event = gruvi.Event()
+        ntimers = []
+        def block():
+            with gruvi.deadline(0.05):
+                for i in range(3):
+                    gruvi.sleep(0.01)
+                ntimers.append(len(hub.timers))
+                event.wait(10)
+        self.assertRaises(gruvi.Timeout, block)
+        self.assertEqual(ntimers, [1])
+        self.assertEqual(len(hub.timers), 0)
+
+    def test_deadline_wait(self):
+        # wait() swallows its own timeout but not that of a deadline.
+        fut = gruvi.Future()
+        with gruvi.deadline(1):
+            self.assertEqual(gruvi.wait([fut], timeout=0.01), ([], [fut]))
+        def block():
+            with gruvi.deadline(0.02):
+                gruvi.wait([fut])
+        self.assertRaises(gruvi.Timeout, block)
+
+    def test_deadline_not_expired(self):
+        with gruvi.deadline(1) as scope:
+            gruvi.sleep(0)
+        self.assertFalse(scope.cancelled)
+        self.assertEqual(gruvi.get_hub().timers.__len__(), 0)
+
+    def test_level_triggered(self):
+        # After a scope expired, every switchpoint in it should raise.
+        exceptions = []
+        def block():
+            with gruvi.deadline(0.01):
+                try:
+                    gruvi.sleep(1)
+                except gruvi.Timeout as e:
+                    exceptions.append(e)
+                gruvi.sleep(0)
+        self.assertRaises(gruvi.Timeout, block)
+        self.assertEqual(len(exceptions), 1)
+
+    def test_nonblocking_switchpoint(self):
+        # A switchpoint that would not block also raises in a cancelled scope.
+        lock = gruvi.Lock()
+        with gruvi.cancel_scope() as scope:
+            scope.cancel()
+            self.assertRaises(gruvi.Cancelled, lock.acquire)
+            self.assertFalse(lock.locked())
+            lock.acquire()
+        self.assertTrue(scope.cancelled_caught)
+        self.assertFalse(lock.locked())
+
+    def test_cancel_scope(self):
+        # A cancel scope swallows its own cancellation.
+        with gruvi.cancel_scope(0.01) as scope:
+            gruvi.sleep(1)
+        self.assertTrue(scope.cancelled)
+        self.assertTrue(scope.cancelled_caught)
+
+    def test_cancel_from_other_fiber(self):
+        queue = gruvi.Queue()
+        scopes = []
+        def worker():
+            with gruvi.cancel_scope() as scope:
+                scopes.append(scope)
+                queue.get()
+        fiber = gruvi.spawn(worker)
+        gruvi.sleep(0)
+        scopes[0].cancel()
+        fiber.join(1)
+        self.assertTrue(scopes[0].cancelled_caught)
+
+    def test_nested(self):
+        # An outer scope that expires first cancels the inner block, and the
+        # inner cancel scope does not swallow it.
+        inner = gruvi.cancel_scope(10)
+        def block():
+            with gruvi.deadline(0.01):
+                with inner:
+                    gruvi.sleep(1)
+        self.assertRaises(gruvi.Timeout, block)
+        self.assertFalse(inner.cancelled_caught)
+
+
 class TestSwitchBack(UnitTest):
 
     def test_call(self):
@@ -195,6 +529,80 @@ class TestSwitchBack(UnitTest):
             exc = self.assertRaises(ValueError, hub.switch)
             self.assertEqual(exc.args[0], 'foo')
 
+    def test_timeout_precise(self):
+        # A precise timeout should use a dedicated timer instead of the wheel.
+        hub = gruvi.get_hub()
+        with gruvi.switch_back(0.01, precise=True):
+            self.assertEqual(len(hub.timers), 0)
+            self.assertRaises(gruvi.Timeout, hub.switch)
+
+    def test_timeout_cancel(self):
+        # Leaving a switch_back block should remove its timer from the wheel.
+        hub = gruvi.get_hub()
+        with gruvi.switch_back(10) as switcher:
+            self.assertEqual(len(hub.timers), 1)
+            hub.run_callback(switcher)
+            hub.switch()
+        self.assertEqual(len(hub.timers), 0)
+
+
+class TestTimerWheel(UnitTest):
+
+    def test_fire(self):
+        # Timers should fire, in order, and never early.
+        hub = gruvi.get_hub()
+        wheel = hub.timers
+        result = []
+        t0 = hub.loop.now()
+        for timeout in (0.03, 0.01, 0.02):
+            wheel.add(timeout, lambda t, timeout=timeout: result.append((timeout, hub.loop.now())))
+        self.assertEqual(len(wheel), 3)
+        gruvi.sleep(0.05)
+        self.assertEqual([r[0] for r in result], [0.01, 0.02, 0.03])
+        for timeout, t1 in result:
+            self.assertGreaterEqual(t1-t0, timeout*1000)
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel(self):
+        # A cancelled timer should not fire.
+        wheel = gruvi.get_hub().timers
+        result = []
+        timer = wheel.add(0.01, result.append)
+        self.assertTrue(timer.active)
+        timer.close()
+        self.assertFalse(timer.active)
+        timer.close()
+        self.assertEqual(len(wheel), 0)
+        gruvi.sleep(0.02)
+        self.assertEqual(result, [])
+
+    def test_short_timeout(self):
+        # A timeout shorter than one tick should not wait for the wheel.
+        wheel = gruvi.get_hub().timers
+        result = []
+        timer = wheel.add(0, result.append)
+        self.assertTrue(timer.active)
+        self.assertEqual(len(wheel), 0)
+        gruvi.sleep(0)
+        self.assertEqual(result, [timer])
+        self.assertFalse(timer.active)
+        t0 = time.time()
+        for i in range(100):
+            gruvi.sleep(0)
+        self.assertLess(time.time() - t0, 0.5)
+
+    def test_multiple_revolutions(self):
+        # Timers further away than one revolution should not fire early.
+        hub = gruvi.get_hub()
+        wheel = TimerWheel(hub.loop, 0.001, 4)
+        result = []
+        t0 = hub.loop.now()
+        wheel.add(0.02, lambda t: result.append(hub.loop.now()))
+        gruvi.sleep(0.04)
+        self.assertEqual(len(result), 1)
+        self.assertGreaterEqual(result[0]-t0, 20)
+        wheel.close()
+
 
 if __name__ == '__main__':
     unittest.main()
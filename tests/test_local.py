@@ -9,6 +9,7 @@
 from __future__ import absolute_import, print_function
 
 import gc
+import weakref
 import unittest
 
 import gruvi
@@ -55,15 +56,45 @@ class TestLocal(UnitTest):
 
     def test_cleanup_on_fiber_exit(self):
         local = gruvi.local()
+        class Value(object):
+            pass
         def fiber1():
-            local.foo = 10
+            local.foo = Value()
+            ref.append(weakref.ref(local.foo))
+        ref = []
         f1 = gruvi.spawn(fiber1)
         f1.join()
-        # Access the local object as if access was from f1
-        self.assertIn('foo', local._keys[f1])
-        self.assertEqual(local._keys[f1]['foo'], 10)
+        self.assertIsNotNone(ref[0]())
         del f1; gc.collect()
-        self.assertEqual(len(local._keys), 0)
+        self.assertIsNone(ref[0]())
+
+    def test_cleanup_on_local_deleted(self):
+        # The data of a local should be released when the local is garbage
+        # collected, also if the fiber that stored it is still alive.
+        local = gruvi.local()
+        class Value(object):
+            pass
+        local.foo = Value()
+        ref = weakref.ref(local.foo)
+        del local; gc.collect()
+        self.assertIsNone(ref())
+
+    def test_inherit(self):
+        # A local with inherit=True should be copied to spawned fibers.
+        local = gruvi.local(inherit=True)
+        other = gruvi.local()
+        result = []
+        def child():
+            result.append(getattr(local, 'foo', None))
+            result.append(getattr(other, 'foo', None))
+            local.foo = 'child'
+        def parent():
+            local.foo = 'parent'
+            other.foo = 'parent'
+            gruvi.spawn(child).join()
+            result.append(local.foo)
+        gruvi.spawn(parent).join()
+        self.assertEqual(result, ['parent', None, 'parent'])
 
 
 if __name__ == '__main__':
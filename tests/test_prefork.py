@@ -0,0 +1,183 @@
+#
+# This file is part of Gruvi. Gruvi is free software available under the
+# terms of the MIT license. See the file "LICENSE" that was provided
+# together with this source file for the licensing terms.
+#
+# Copyright (c) 2012-2017 the Gruvi authors. See the file "AUTHORS" for a
+# complete list.
+
+from __future__ import absolute_import, print_function
+
+import os
+import errno
+import signal
+import unittest
+
+import gruvi
+from gruvi.stream import StreamProtocol, StreamServer
+from gruvi.endpoints import create_connection
+
+from support import UnitTest
+
+if hasattr(os, 'fork'):
+    from gruvi.prefork import Prefork
+
+
+def pid_handler(stream, transport, protocol):
+    # Reply to each line with the PID of the worker.
+    while stream.readline():
+        stream.write('{}\n'.format(os.getpid()).encode('ascii'))
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+class TestPrefork(UnitTest):
+
+    def start_supervisor(self, workers, dispatch=False, listen=None):
+        server = Prefork(lambda: StreamServer(pid_handler), workers=workers,
+                         dispatch=dispatch)
+        server.restart_delay = 0.1
+        server.graceful_timeout = 1
+        for address, kwargs in listen or [(('localhost', 0), {})]:
+            server.listen(address, **kwargs)
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                # Use a process group so that the cleanup can kill the workers.
+                os.setpgid(0, 0)
+                server.run()
+                status = 0
+            finally:
+                os._exit(status)
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass  # The child did it already.
+        self.addCleanup(server.close)
+        self.addCleanup(self.kill_supervisor, pid)
+        return server, pid
+
+    def kill_supervisor(self, pid):
+        # Kill the supervisor and its workers if a test left them running.
+        for kill in (os.killpg, os.kill):
+            try:
+                kill(pid, signal.SIGKILL)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+        try:
+            os.waitpid(pid, 0)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+
+    def stop_supervisor(self, pid):
+        os.kill(pid, signal.SIGTERM)
+        for i in range(100):
+            wpid, status = os.waitpid(pid, os.WNOHANG)
+            if wpid == pid:
+                break
+            gruvi.sleep(0.1)
+        self.assertEqual(wpid, pid)
+        self.assertEqual(status, 0)
+
+    def get_pid(self, addr, **kwargs):
+        ctrans, cproto = create_connection(StreamProtocol, addr, **kwargs)
+        cproto.stream.write(b'pid\n')
+        with gruvi.deadline(5):
+            pid = int(cproto.stream.readline())
+        ctrans.close()
+        return pid
+
+    def test_serve(self):
+        # Ensure that connections are served by the workers.
+        server, spid = self.start_supervisor(2)
+        addr = server.addresses[0]
+        pids = set()
+        for i in range(20):
+            pids.add(self.get_pid(addr))
+        self.assertNotIn(spid, pids)
+        self.assertNotIn(os.getpid(), pids)
+        self.stop_supervisor(spid)
+
+    def test_restart_crashed(self):
+        # Ensure that a worker that crashes is restarted.
+        server, spid = self.start_supervisor(1)
+        addr = server.addresses[0]
+        pid1 = self.get_pid(addr)
+        os.kill(pid1, signal.SIGKILL)
+        pid2 = self.get_pid(addr)
+        self.assertNotEqual(pid2, pid1)
+        self.stop_supervisor(spid)
+
+    def test_rolling_restart(self):
+        # Ensure that SIGHUP replaces the workers.
+        server, spid = self.start_supervisor(1)
+        addr = server.addresses[0]
+        pid1 = self.get_pid(addr)
+        os.kill(spid, signal.SIGHUP)
+        for i in range(50):
+            pid2 = self.get_pid(addr)
+            if pid2 != pid1:
+                break
+            gruvi.sleep(0.1)
+        self.assertNotEqual(pid2, pid1)
+        self.stop_supervisor(spid)
+
+    def test_sigint_graceful(self):
+        # Ensure that a SIGINT to a worker stops it gracefully, so that it
+        # finishes the connections it has.
+        server, spid = self.start_supervisor(1)
+        addr = server.addresses[0]
+        ctrans, cproto = create_connection(StreamProtocol, addr)
+        cproto.stream.write(b'pid\n')
+        with gruvi.deadline(5):
+            pid = int(cproto.stream.readline())
+        os.kill(pid, signal.SIGINT)
+        gruvi.sleep(0.1)
+        cproto.stream.write(b'pid\n')
+        with gruvi.deadline(5):
+            self.assertEqual(int(cproto.stream.readline()), pid)
+        ctrans.close()
+        self.stop_supervisor(spid)
+
+    def test_dispatch(self):
+        # Ensure that in dispatch mode, connections are passed to the least
+        # loaded worker. Keeping connections open means that each new
+        # connection must go to a worker with fewer connections.
+        server, spid = self.start_supervisor(2, dispatch=True)
+        addr = server.addresses[0]
+        clients = []
+        pids = []
+        for i in range(6):
+            ctrans, cproto = create_connection(StreamProtocol, addr)
+            cproto.stream.write(b'pid\n')
+            with gruvi.deadline(5):
+                pids.append(int(cproto.stream.readline()))
+            clients.append(ctrans)
+        self.assertEqual(len(set(pids)), 2)
+        self.assertEqual(pids.count(pids[0]), 3)
+        for ctrans in clients:
+            ctrans.close()
+        self.stop_supervisor(spid)
+
+    def check_listen_args(self, dispatch):
+        # Ensure that the arguments of each listen() call apply to the sockets
+        # of that call only.
+        context = self.get_ssl_context()
+        listen = [(('127.0.0.1', 0), {}), (('127.0.0.1', 0), {'ssl': context})]
+        server, spid = self.start_supervisor(1, dispatch, listen)
+        plain, secure = server.addresses
+        pid = self.get_pid(plain)
+        self.assertEqual(self.get_pid(secure, ssl=context), pid)
+        self.stop_supervisor(spid)
+
+    def test_listen_args(self):
+        self.check_listen_args(False)
+
+    def test_listen_args_dispatch(self):
+        self.check_listen_args(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
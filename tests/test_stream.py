@@ -15,7 +15,7 @@ import unittest
 from io import TextIOWrapper
 
 import gruvi
-from gruvi.stream import Stream, StreamProtocol, StreamClient, StreamServer
+from gruvi.stream import Stream, StreamError, StreamProtocol, StreamClient, StreamServer
 from gruvi.errors import Timeout
 from gruvi.transports import TransportError
 from support import UnitTest, MockTransport
@@ -104,6 +104,63 @@ class TestStream(UnitTest):
         self.assertEqual(stream.read1(100), b'bar')
         self.assertEqual(stream.read1(100), b'')
 
+    def test_readinto(self):
+        stream = Stream(None)
+        stream.buffer.feed(b'foo')
+        stream.buffer.feed(b'bar')
+        buf = bytearray(4)
+        self.assertEqual(stream.readinto(buf), 4)
+        self.assertEqual(buf, b'foob')
+        stream.buffer.feed_eof()
+        self.assertEqual(stream.readinto(memoryview(buf)[1:]), 2)
+        self.assertEqual(buf, b'farb')
+        self.assertEqual(stream.readinto(buf), 0)
+
+    def test_readinto_wait_error(self):
+        stream = Stream(None)
+        stream.buffer.feed(b'foo')
+        def write_more():
+            gruvi.sleep(0.01)
+            stream.buffer.feed(b'bar')
+            gruvi.sleep(0.01)
+            stream.buffer.feed_error(RuntimeError)
+        gruvi.spawn(write_more)
+        buf = bytearray(10)
+        self.assertEqual(stream.readinto(buf), 6)
+        self.assertEqual(buf[:6], b'foobar')
+        self.assertRaises(RuntimeError, stream.readinto, buf)
+
+    def test_readexactly(self):
+        stream = Stream(None)
+        stream.buffer.feed(b'fo')
+        def write_more():
+            gruvi.sleep(0.01)
+            stream.buffer.feed(b'obar')
+            gruvi.sleep(0.01)
+            stream.buffer.feed_eof()
+        gruvi.spawn(write_more)
+        self.assertEqual(stream.readexactly(3), b'foo')
+        self.assertEqual(stream.readexactly(3), b'bar')
+        self.assertEqual(stream.readexactly(3), b'')
+
+    def test_readexactly_eof(self):
+        stream = Stream(None)
+        stream.buffer.feed(b'foo')
+        stream.buffer.feed_eof()
+        self.assertRaises(StreamError, stream.readexactly, 4)
+
+    def test_readexactly_large(self):
+        # A read that is larger than the buffer does not stall.
+        stream = Stream(None)
+        stream.buffer.set_buffer_limits(100)
+        def write_more():
+            for i in range(10):
+                gruvi.sleep(0)
+                stream.buffer.feed(b'x' * 50)
+        gruvi.spawn(write_more)
+        self.assertEqual(stream.readexactly(480), b'x' * 480)
+        self.assertEqual(stream.readexactly(20), b'x' * 20)
+
     def test_readline(self):
         stream = Stream(None)
         stream.buffer.feed(b'foo\n')
@@ -120,6 +177,28 @@ class TestStream(UnitTest):
         self.assertEqual(stream.readline(), b'foo\n')
         self.assertEqual(stream.readline(), b'bar\n')
 
+    def test_readline_split_delim(self):
+        # A multi-byte delimiter may be split over two chunks.
+        stream = Stream(None)
+        stream.buffer.feed(b'foo\r')
+        stream.buffer.feed(b'\nbar\r\n')
+        self.assertEqual(stream.readline(delim=b'\r\n'), b'foo\r\n')
+        self.assertEqual(stream.readline(delim=b'\r\n'), b'bar\r\n')
+
+    def test_get_chunk_delim(self):
+        # A line received in pieces is returned as a single chunk.
+        stream = Stream(None)
+        buf = b'foo\nbar'
+        for i in range(len(buf)):
+            stream.buffer.feed(buf[i:i+1])
+        self.assertEqual(stream.buffer.get_chunk(-1, b'\n'), b'foo\n')
+        self.assertEqual(stream.buffer.get_buffer_size(), 3)
+        def write_more():
+            gruvi.sleep(0.01)
+            stream.buffer.feed(b'\n')
+        gruvi.spawn(write_more)
+        self.assertEqual(stream.buffer.get_chunk(-1, b'\n'), b'bar\n')
+
     def test_readline_limit(self):
         stream = Stream(None)
         stream.buffer.feed(b'foobar\n')
@@ -172,6 +251,32 @@ class TestStream(UnitTest):
         self.assertEqual(stream.readline(), b'foo')
         self.assertEqual(stream.readline(), b'')
 
+    def test_readuntil(self):
+        stream = Stream(None)
+        stream.buffer.feed(b'foo\r')
+        stream.buffer.feed(b'\nbar')
+        stream.buffer.feed_eof()
+        self.assertEqual(stream.readuntil(b'\r\n'), b'foo\r\n')
+        exc = self.assertRaises(StreamError, stream.readuntil, b'\r\n')
+        self.assertIn('EOF', str(exc))
+        # The partial data is left in the buffer.
+        self.assertEqual(stream.read(), b'bar')
+        self.assertEqual(stream.readuntil(b'\r\n'), b'')
+
+    def test_readuntil_limit(self):
+        stream = Stream(None)
+        stream.buffer.feed(b'foobar\n')
+        exc = self.assertRaises(StreamError, stream.readuntil, b'\n', 3)
+        self.assertIn('within 3 bytes', str(exc))
+        self.assertEqual(stream.readuntil(b'\n'), b'foobar\n')
+
+    def test_readuntil_error(self):
+        stream = Stream(None)
+        stream.buffer.feed(b'foo')
+        stream.buffer.feed_error(RuntimeError)
+        self.assertRaises(RuntimeError, stream.readuntil)
+        self.assertEqual(stream.read(3), b'foo')
+
     def test_readlines_limit(self):
         stream = Stream(None)
         stream.buffer.feed(b'foo\nbar\n')
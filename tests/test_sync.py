@@ -725,5 +725,111 @@ class TestPriorityQueue(UnitTest):
         self.assertEqual(sorted(items), result)
 
 
+class TestChannel(UnitTest):
+
+    def test_basic(self):
+        # What is put in the channel, should come out, in order.
+        chan = gruvi.Channel()
+        for i in range(10):
+            chan.put(i)
+        self.assertEqual(chan.qsize(), 10)
+        for i in range(10):
+            self.assertEqual(chan.get(), i)
+        self.assertTrue(chan.empty())
+
+    def test_get_wait(self):
+        # Channel.get() should wait until an item becomes available.
+        chan = gruvi.Channel()
+        def put_channel(value):
+            gruvi.sleep(0.01)
+            chan.put(value)
+        gruvi.spawn(put_channel, 'foo')
+        self.assertEqual(chan.get(), 'foo')
+
+    def test_get_timeout(self):
+        chan = gruvi.Channel()
+        self.assertRaises(gruvi.QueueEmpty, chan.get, timeout=0.01)
+        self.assertRaises(gruvi.QueueEmpty, chan.get_nowait)
+        self.assertEqual(chan.get_many(timeout=0.01), [])
+        self.assertEqual(chan._getters, [])
+
+    def test_put_timeout(self):
+        chan = gruvi.Channel(maxsize=1)
+        chan.put(1)
+        self.assertTrue(chan.full())
+        self.assertRaises(gruvi.QueueFull, chan.put, 2, timeout=0.01)
+        self.assertRaises(gruvi.QueueFull, chan.put_nowait, 2)
+        self.assertEqual(chan._putters, [])
+
+    def test_get_many(self):
+        # A waiting consumer should be woken up once for a batch of items.
+        chan = gruvi.Channel()
+        batches = []
+        def consumer():
+            while True:
+                batch = chan.get_many()
+                batches.append(batch)
+                if None in batch:
+                    break
+        fiber = gruvi.spawn(consumer)
+        gruvi.sleep(0)
+        for i in range(10):
+            chan.put(i)
+        chan.put(None)
+        fiber.join()
+        self.assertEqual(batches, [list(range(10)) + [None]])
+        chan.put_many(range(5))
+        self.assertEqual(chan.get_many(3), [0, 1, 2])
+        self.assertEqual(chan.get_many(), [3, 4])
+
+    def test_produce_consume(self):
+        # No deadlocks with a bounded channel.
+        chan = gruvi.Channel(maxsize=10)
+        result = []
+        def producer(n):
+            for i in range(n):
+                chan.put(i)
+        def consumer(n):
+            while len(result) < n:
+                result.extend(chan.get_many())
+        ni = 2000
+        fprod = gruvi.spawn(producer, ni)
+        fcons = gruvi.spawn(consumer, ni)
+        fprod.join(); fcons.join()
+        self.assertEqual(result, list(range(ni)))
+
+    def test_thread_safety(self):
+        # Items put by fibers in multiple threads must all be received exactly
+        # once by consumers in multiple threads.
+        chan = gruvi.Channel()
+        result = []
+        def thread_put(tid, count):
+            for i in range(count):
+                chan.put((tid, i))
+                if i % 10 == 0:
+                    gruvi.sleep(0)
+            get_hub().close()
+        def thread_get():
+            while True:
+                items = chan.get_many()
+                result.extend(item for item in items if item is not None)
+                if None in items:
+                    # Leave the other stop markers for the other consumers.
+                    chan.put_many([None] * (items.count(None) - 1))
+                    break
+            get_hub().close()
+        getters = [threading.Thread(target=thread_get) for i in range(3)]
+        putters = [threading.Thread(target=thread_put, args=(i, 1000)) for i in range(5)]
+        for thread in getters + putters:
+            thread.start()
+        for thread in putters:
+            thread.join()
+        for thread in getters:
+            chan.put(None)
+        for thread in getters:
+            thread.join()
+        self.assertEqual(sorted(result), [(tid, i) for tid in range(5) for i in range(1000)])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -64,6 +64,24 @@ class EchoServer(ProtocolLogger):
         self.transport.write(data)
 
 
+class FlowControlLogger(ProtocolLogger):
+    """Protocol that logs the write buffer size on flow control events, and
+    that counts the data it receives."""
+
+    def __init__(self):
+        super(FlowControlLogger, self).__init__()
+        self.received = 0
+
+    def data_received(self, data):
+        self.received += len(data)
+
+    def pause_writing(self):
+        self.events.append(('pause_writing', self.transport.get_write_buffer_size()))
+
+    def resume_writing(self):
+        self.events.append(('resume_writing', self.transport.get_write_buffer_size()))
+
+
 class EventLoopTest(UnitTest):
 
     def setUp(self):
@@ -127,11 +145,14 @@ class TransportTest(object):
             trans = transports[1] = self.create_transport(handle, protocols[1], False)
             trans.write(b'foo\n')
             trans.write(b'bar\n')
-            trans.writelines([b'qux', b'quux'])
+            trans.writelines([b'qux', bytearray(b'qu'), b'', memoryview(b'ux')])
             if trans.can_write_eof():
                 trans.write_eof()
+            # Bytes are counted when the write completes.
+            written.append(trans.get_extra_info('stats')['bytes_written'])
         transports = [None, None]
         protocols = [None, None]
+        written = []
         server = self.create_handle()
         addr = self.bind_handle(server)
         server.listen(echo_server)
@@ -144,6 +165,8 @@ class TransportTest(object):
         self.assertIsInstance(ctrans, Transport)
         self.assertIsInstance(sproto, EchoServer)
         self.assertIsInstance(cproto, ProtocolLogger)
+        self.assertEqual(written, [0])
+        self.assertEqual(ctrans.get_extra_info('stats')['bytes_written'], 16)
         ctrans.close()
         self.run_loop(0.1)
         sevents = sproto.events
@@ -172,6 +195,105 @@ class TestTcpTransport(TransportTest, EventLoopTest):
         handle.bind((host, 0))
         return handle.getsockname()
 
+    def test_cork(self):
+        # While corked, writes are held back. On uncork they are written with
+        # a single write request.
+        @self.catch_errors
+        def echo_server(handle, error):
+            client = self.create_handle()
+            handle.accept(client)
+            protocols[0] = EchoServer()
+            transports[0] = self.create_transport(client, protocols[0], True)
+        @self.catch_errors
+        def echo_client(handle, error):
+            protocols[1] = ProtocolLogger()
+            trans = transports[1] = self.create_transport(handle, protocols[1], False)
+            trans.cork()
+            trans.write(b'foo')
+            trans.writelines([b'bar', b'baz'])
+            self.assertEqual(trans._write_buffer_size, 0)
+            self.assertEqual(trans.get_write_buffer_size(), 9)
+            trans.uncork()
+            self.assertEqual(trans._write_buffer_size, 1)
+        transports = [None, None]
+        protocols = [None, None]
+        server = self.create_handle()
+        addr = self.bind_handle(server)
+        server.listen(echo_server)
+        client = self.create_handle()
+        client.connect(addr, echo_client)
+        self.run_loop(0.1)
+        strans, ctrans = transports
+        self.assertEqual(protocols[0].events[1], ('data_received', b'foobarbaz'))
+        self.assertEqual(protocols[1].events[1], ('data_received', b'foobarbaz'))
+        ctrans.close()
+        self.run_loop(0.1)
+
+    def test_flow_control(self):
+        # The write buffer is accounted in bytes. The protocol is paused when
+        # it exceeds the high water mark and resumed when it drops to the low
+        # water mark.
+        chunk = b'x' * 262144
+        @self.catch_errors
+        def server_accept(handle, error):
+            client = self.create_handle()
+            handle.accept(client)
+            protocols[0] = FlowControlLogger()
+            transports[0] = self.create_transport(client, protocols[0], True)
+            transports[0].pause_reading()
+        @self.catch_errors
+        def client_connect(handle, error):
+            protocols[1] = FlowControlLogger()
+            trans = transports[1] = self.create_transport(handle, protocols[1], False)
+            trans.set_write_buffer_limits(1000000)
+            self.assertEqual(trans.get_write_buffer_limits(), (500000, 1000000))
+            for i in range(64):
+                trans.write(chunk)
+                written[0] += len(chunk)
+                if protocols[1].get_events('pause_writing'):
+                    break
+        transports = [None, None]
+        protocols = [None, None]
+        written = [0]
+        server = self.create_handle()
+        addr = self.bind_handle(server)
+        server.listen(server_accept)
+        client = self.create_handle()
+        client.connect(addr, client_connect)
+        self.run_loop(0.1)
+        strans, ctrans = transports
+        sproto, cproto = protocols
+        paused = cproto.get_events('pause_writing')
+        self.assertEqual(len(paused), 1)
+        self.assertGreater(paused[0][1], 1000000)
+        self.assertLess(paused[0][1], 1000000 + 2*len(chunk))
+        self.assertEqual(cproto.get_events('resume_writing'), [])
+        strans.resume_reading()
+        self.run_loop(0.5)
+        resumed = cproto.get_events('resume_writing')
+        self.assertEqual(len(resumed), 1)
+        self.assertLessEqual(resumed[0][1], 500000)
+        self.assertEqual(sproto.received, written[0])
+        # The flow control events show up in the stats.
+        cstats = ctrans.get_extra_info('stats')
+        self.assertEqual(cstats['write_pauses'], 1)
+        self.assertGreater(cstats['write_paused_time'], 0)
+        self.assertGreater(cstats['peak_write_buffer'], 1000000)
+        self.assertGreaterEqual(cstats['bytes_written'], written[0])
+        self.assertGreater(cstats['writes'], 0)
+        sstats = strans.get_extra_info('stats')
+        self.assertGreaterEqual(sstats['bytes_read'], written[0])
+        self.assertGreater(sstats['reads'], 0)
+        self.assertGreater(sstats['age'], 0)
+        ctrans.close()
+        strans.close()
+        self.run_loop(0.1)
+
+    def test_writelines_type_check(self):
+        # All elements are checked before anything is written.
+        transport = Transport(self.create_handle())
+        self.assertRaises(TypeError, transport.writelines, [b'foo', 10])
+
 
 class TestPipeTransport(TransportTest, EventLoopTest):
 
@@ -184,6 +306,23 @@ class TestPipeTransport(TransportTest, EventLoopTest):
         return addr
 
 
+class FailingUDP(pyuv.UDP):
+    """A UDP handle that fails the second send with EBADF, and that does not
+    support try_send()."""
+
+    try_send = None
+
+    def __init__(self, loop):
+        super(FailingUDP, self).__init__(loop)
+        self.sends = 0
+
+    def send(self, addr, data, callback=None):
+        self.sends += 1
+        if self.sends == 2:
+            raise pyuv.error.UDPError(pyuv.errno.UV_EBADF, 'bad file descriptor')
+        return super(FailingUDP, self).send(addr, data, callback)
+
+
 class TestUdpTransport(EventLoopTest):
 
     def create_handle(self):
@@ -225,6 +364,25 @@ class TestUdpTransport(EventLoopTest):
             self.assertEqual(event[1], b'bar')
             self.assertEqual(event[2], saddr)
 
+    def test_sendto_many_aborted(self):
+        # Sends that were submitted before a batch aborted the transport
+        # should not be accounted for when they complete.
+        self.loop.excepthook = lambda *exc_info: self.errors.append(exc_info[1])
+        server = self.create_handle()
+        saddr = self.bind_handle(server)
+        client = FailingUDP(self.loop)
+        self.bind_handle(client)
+        cproto = ProtocolLogger()
+        ctrans = self.create_transport(client, cproto)
+        ctrans.sendto_many([(b'foo', saddr), (b'bar', saddr), (b'baz', saddr)])
+        self.run_loop(0.1)
+        self.assertTrue(client.closed)
+        self.assertEqual(ctrans.get_write_buffer_size(), 0)
+        events = cproto.get_events('connection_lost')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][1].errno, pyuv.errno.UV_EBADF)
+        server.close()
+
 
 if __name__ == '__main__':
     unittest.main()